@@ -3,9 +3,8 @@ from datetime import datetime
 from django.apps import apps
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db.models import (
-    Subquery, OuterRef, FloatField, Case, When, Value
+    Subquery, OuterRef, Case, Max, When, Value
 )
-from django.db.models.functions import Cast
 
 
 class PlzRAirConditioningConsumption:
@@ -54,6 +53,7 @@ class PlzRAirConditioningConsumption:
         try:
             start_trend_log = device.trend_log_data.filter(
                 name=name,
+                num_value__isnull=False,
                 date_time__gte=start_date
             ).order_by('date_time').first()
         except ObjectDoesNotExist:
@@ -62,6 +62,7 @@ class PlzRAirConditioningConsumption:
         try:
             end_trend_log = device.trend_log_data.filter(
                 name=name,
+                num_value__isnull=False,
                 date_time__lte=end_date
             ).order_by('-date_time').first()
         except ObjectDoesNotExist:
@@ -86,8 +87,8 @@ class PlzRAirConditioningConsumption:
                 measure, var_data, start_date, end_date
             )
             name = var_data.get('name')
-            start_value = float(s_trend.value)
-            end_value = float(e_trend.value)
+            start_value = s_trend.num_value
+            end_value = e_trend.num_value
             ret_data['G_%s_start_date' % name] = s_trend.date_time.isoformat()
             ret_data['G_%s_start_value' % name] = start_value
             ret_data['G_%s_end_date' % name] = e_trend.date_time.isoformat()
@@ -103,8 +104,8 @@ class PlzRAirConditioningConsumption:
                 measure, var_data, start_date, end_date
             )
             name = var_data.get('name')
-            start_value = float(s_trend.value)
-            end_value = float(e_trend.value)
+            start_value = s_trend.num_value
+            end_value = e_trend.num_value
             ret_data['LE_%s_start_date' % name] = s_trend.date_time.isoformat()
             ret_data['LE_%s_start_value' % name] = start_value
             ret_data['LE_%s_end_date' % name] = e_trend.date_time.isoformat()
@@ -120,8 +121,8 @@ class PlzRAirConditioningConsumption:
                 measure, var_data, start_date, end_date
             )
             name = var_data.get('name')
-            start_value = float(s_trend.value)
-            end_value = float(e_trend.value)
+            start_value = s_trend.num_value
+            end_value = e_trend.num_value
             ret_data['LO_%s_start_date' % name] = s_trend.date_time.isoformat()
             ret_data['LO_%s_start_value' % name] = start_value
             ret_data['LO_%s_end_date' % name] = e_trend.date_time.isoformat()
@@ -172,24 +173,20 @@ class PlzRAirConditioningOccupation:
         for var_name in var_names:
             safe_name = re.sub(r"[^a-zA-Z0-9_\-.]+", "", var_name)
             annotate = {
-                safe_name: Cast(
-                    Subquery(
-                        self.tld_manager.filter(
-                            date_time=OuterRef('date_time'),
-                            device=device,
-                            name=var_name
-                        ).values('value')
-                    ),
-                    output_field=FloatField()
-                ) - Cast(
-                    Subquery(
-                        self.tld_manager.filter(
-                            date_time__lt=OuterRef('date_time'),
-                            device=device,
-                            name=var_name
-                        ).order_by('-date_time').values('value')[:1]
-                    ),
-                    output_field=FloatField()
+                safe_name: Subquery(
+                    self.tld_manager.filter(
+                        date_time=OuterRef('date_time'),
+                        device=device,
+                        name=var_name,
+                        num_value__isnull=False
+                    ).values('num_value')
+                ) - Subquery(
+                    self.tld_manager.filter(
+                        date_time__lt=OuterRef('date_time'),
+                        device=device,
+                        name=var_name,
+                        num_value__isnull=False
+                    ).order_by('-date_time').values('num_value')[:1]
                 )
             }
             qs = qs.annotate(
@@ -271,24 +268,20 @@ class PlzRAirConditioningDailyConsumption:
             safe_name = re.sub(r"[^a-zA-Z0-9_\-.]+", "", var_name)
             safe_names.append(safe_name)
             annotate = {
-                safe_name: Cast(
-                    Subquery(
-                        self.tld_manager.filter(
-                            date_time=OuterRef('date_time'),
-                            device=device,
-                            name=var_name
-                        ).values('value')
-                    ),
-                    output_field=FloatField()
-                ) - Cast(
-                    Subquery(
-                        self.tld_manager.filter(
-                            date_time__lt=OuterRef('date_time'),
-                            device=device,
-                            name=var_name
-                        ).order_by('-date_time').values('value')[:1]
-                    ),
-                    output_field=FloatField()
+                safe_name: Subquery(
+                    self.tld_manager.filter(
+                        date_time=OuterRef('date_time'),
+                        device=device,
+                        name=var_name,
+                        num_value__isnull=False
+                    ).values('num_value')
+                ) - Subquery(
+                    self.tld_manager.filter(
+                        date_time__lt=OuterRef('date_time'),
+                        device=device,
+                        name=var_name,
+                        num_value__isnull=False
+                    ).order_by('-date_time').values('num_value')[:1]
                 ),
                 'from_date': Subquery(
                     self.tld_manager.filter(
@@ -425,46 +418,39 @@ class BussParkWConsumption:
         return apps.get_model('x6gateapi.device').objects
 
     def _get_rtdata_demand(self, device, var_name, start_date, end_date):
-        values = []
-        nodes = device.nodes.filter(
+        return device.nodes.filter(
             removed_at__isnull=True,
             discard=False,
             name=var_name,
-            data__discard=False,
-            data__removed_at__isnull=True,
-            data__date_time__gte=start_date,
-            data__date_time__lte=end_date,
-        )
-        for node in nodes:
-            try:
-                values.append(float(node.value))
-            except (TypeError, ValueError):
-                pass
-        if not values:
-            return None
-        return max(values)
+            data_discard=False,
+            data_removed_at__isnull=True,
+            date_time__gte=start_date,
+            date_time__lte=end_date,
+        ).aggregate(demand=Max('num_value'))['demand']
 
     def _get_rtdata_values(self, device, var_name, start_date, end_date):
         start_none = device.nodes.filter(
             removed_at__isnull=True,
             discard=False,
             name=var_name,
-            data__discard=False,
-            data__removed_at__isnull=True,
-            data__date_time__gte=start_date
-        ).select_related('data').order_by('data__date_time').first()
+            data_discard=False,
+            data_removed_at__isnull=True,
+            num_value__isnull=False,
+            date_time__gte=start_date
+        ).order_by('date_time').first()
         end_node = device.nodes.filter(
             removed_at__isnull=True,
             discard=False,
             name=var_name,
-            data__discard=False,
-            data__removed_at__isnull=True,
-            data__date_time__lte=end_date
-        ).select_related('data').order_by('-data__date_time').first()
+            data_discard=False,
+            data_removed_at__isnull=True,
+            num_value__isnull=False,
+            date_time__lte=end_date
+        ).order_by('-date_time').first()
         if start_none and end_node:
             return [
-                (start_none.data.date_time, float(start_none.value)),
-                (end_node.data.date_time, float(end_node.value)),
+                (start_none.date_time, start_none.num_value),
+                (end_node.date_time, end_node.num_value),
             ]
         return None
 
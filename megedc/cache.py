@@ -0,0 +1,35 @@
+from django_redis.client import DefaultClient
+from functools import wraps
+from megedc.middleware import redis_timing
+
+
+def _timed(method):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with redis_timing():
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class TimedRedisClient(DefaultClient):
+    """
+    django-redis client recording the redis time of the current request
+    """
+
+    add = _timed(DefaultClient.add)
+    clear = _timed(DefaultClient.clear)
+    decr = _timed(DefaultClient.decr)
+    delete = _timed(DefaultClient.delete)
+    delete_many = _timed(DefaultClient.delete_many)
+    delete_pattern = _timed(DefaultClient.delete_pattern)
+    expire = _timed(DefaultClient.expire)
+    get = _timed(DefaultClient.get)
+    get_many = _timed(DefaultClient.get_many)
+    has_key = _timed(DefaultClient.has_key)
+    incr = _timed(DefaultClient.incr)
+    keys = _timed(DefaultClient.keys)
+    persist = _timed(DefaultClient.persist)
+    set = _timed(DefaultClient.set)
+    set_many = _timed(DefaultClient.set_many)
+    touch = _timed(DefaultClient.touch)
+    ttl = _timed(DefaultClient.ttl)
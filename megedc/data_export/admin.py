@@ -1,6 +1,7 @@
 from django.apps import apps
 from django.contrib import admin
 from django.core.exceptions import PermissionDenied
+from django.db.transaction import atomic
 from django.template.loader import get_template
 from django.template.response import TemplateResponse
 from django.urls import path
@@ -11,6 +12,7 @@ from megedc.data_export.views import (
     FormDataViewAPIView,
     FormDataUpdateViewAPIView
 )
+from megedc.x6gateapi import rollups
 from rangefilter.filters import DateTimeRangeFilterBuilder
 
 
@@ -86,7 +88,13 @@ class ExportDataAdmin(admin.ModelAdmin):
         discard_value = True
 
         def __call__(self, modeladmin, request, queryset):
-            queryset.update(discard=self.discard_value)
+            with atomic():
+                nodes = apps.get_model('x6gateapi.datanone').objects.filter(
+                    data_id__in=queryset.values('pk')
+                )
+                nodes.update(data_discard=self.discard_value)
+                queryset.update(discard=self.discard_value)
+                rollups.invalidate(rollups.ROLLUP_RTDATA, nodes)
 
     class not_discard_action(discard_action):
 
@@ -1,9 +1,119 @@
+import pytz
 import re
 from datetime import datetime
 from django.apps import apps
-from django.db.models import Subquery, OuterRef
+from django.conf import settings
+from django.db import connection
+from django.db.models import FilteredRelation, Max, Q
 from django.db.models.manager import Manager
+from django.utils import timezone
+from megedc.utils import bool_from_str
+from megedc.x6gateapi import archives, resolver
 from megedc.x6gateapi.models import RTData
+from types import SimpleNamespace
+
+
+# Local time buckets of the resampled exports, from the local time {t}
+RESAMPLE_INTERVALS = {
+    '1min': 'DATE_TRUNC(\'minute\', {t})',
+    '15min': (
+        'DATE_TRUNC(\'hour\', {t})'
+        ' + FLOOR(DATE_PART(\'minute\', {t}) / 15) * INTERVAL \'15 minutes\''
+    ),
+    '1h': 'DATE_TRUNC(\'hour\', {t})',
+    '1d': 'DATE_TRUNC(\'day\', {t})',
+}
+
+RESAMPLE_FIRST_SQL = '(ARRAY_AGG(n.num_value ORDER BY n.date_time, n.id))[1]'
+
+RESAMPLE_LAST_SQL = (
+    '(ARRAY_AGG(n.num_value ORDER BY n.date_time DESC, n.id DESC))[1]'
+)
+
+RESAMPLE_AGGREGATES = {
+    'avg': 'AVG(n.num_value)',
+    'min': 'MIN(n.num_value)',
+    'max': 'MAX(n.num_value)',
+    'first': RESAMPLE_FIRST_SQL,
+    'last': RESAMPLE_LAST_SQL,
+    'sum': 'SUM(n.num_value)',
+    'delta': '%s - %s' % (RESAMPLE_LAST_SQL, RESAMPLE_FIRST_SQL),
+}
+
+# Same aggregates for the archived values, from a ResampleBucket
+RESAMPLE_FUNCTIONS = {
+    'avg': lambda bucket: bucket.sum / bucket.count,
+    'min': lambda bucket: bucket.min,
+    'max': lambda bucket: bucket.max,
+    'first': lambda bucket: bucket.first[1],
+    'last': lambda bucket: bucket.last[1],
+    'sum': lambda bucket: bucket.sum,
+    'delta': lambda bucket: bucket.last[1] - bucket.first[1],
+}
+
+RESAMPLE_SQL = (
+    'SELECT ({bucket}) AT TIME ZONE %(tz)s AS bucket, n.device_id, n.name,'
+    ' {aggregate}'
+    ' FROM x6gateapi_datanone n'
+    ' WHERE n.gateway_id = %(gateway_id)s AND n.removed_at IS NULL'
+    ' AND n.num_value IS NOT NULL'
+    ' AND (n.device_id, n.name) IN (SELECT * FROM'
+    ' UNNEST(%(devices_ids)s::integer[], %(names)s::varchar[]))'
+    ' AND n.date_time >= %(from_date_time)s'
+    ' AND n.date_time <= %(to_date_time)s {discard}'
+    ' GROUP BY 1, 2, 3 ORDER BY 1'
+)
+
+
+def local_bucket(date_time, tz, interval):
+    """
+    Start of the local time bucket of a date time, like RESAMPLE_INTERVALS
+
+    :param date_time: Aware date time
+    :param tz: pytz time zone
+    :param interval: Interval, one of RESAMPLE_INTERVALS
+
+    :returns: Aware date time
+    """
+    local = date_time.astimezone(tz).replace(
+        tzinfo=None, second=0, microsecond=0
+    )
+    if interval == '15min':
+        local = local.replace(minute=local.minute // 15 * 15)
+    elif interval == '1h':
+        local = local.replace(minute=0)
+    elif interval == '1d':
+        local = local.replace(hour=0, minute=0)
+    return tz.localize(local)
+
+
+class ResampleBucket:
+    """
+    Running aggregates of the archived values of a bucket
+
+    The first and last values are kept with their (date_time, id)
+    position, the values can be added in any order.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.first = None
+        self.last = None
+
+    def add(self, position, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.first is None or position < self.first[0]:
+            self.first = (position, value)
+        if self.last is None or position > self.last[0]:
+            self.last = (position, value)
 
 
 class DataExportManager(Manager):
@@ -31,20 +141,25 @@ class DataExportManager(Manager):
 
         discard = kwargs.get('discard', None)
         gateway_id, var_names = self.get_var_names(full=True, **kwargs)
+        # The columns are pivoted from a single join with the nodes
         annotations = {}
         for device_id in var_names:
             for var_name, dev_var_name in var_names[device_id]:
-                filters = {
-                    'data': OuterRef('pk'),
-                    'name': dev_var_name,
-                    'device_id': device_id,
-                    'removed_at__isnull': True
-                }
-                value_qs = self.datanode_manager.filter(**filters)
-                annotations[var_name] = Subquery(value_qs.values('value')[:1])
+                annotations[var_name] = Max(
+                    'export_nodes__value',
+                    filter=Q(
+                        export_nodes__name=dev_var_name,
+                        export_nodes__device_id=device_id
+                    )
+                )
         if not annotations:
             return self.none()
-        queryset = queryset.annotate(**annotations).filter(
+        queryset = queryset.annotate(
+            export_nodes=FilteredRelation('nodes', condition=Q(
+                nodes__device_id__in=list(var_names),
+                nodes__removed_at__isnull=True
+            ))
+        ).annotate(**annotations).filter(
             gateway_id=gateway_id
         )
         if discard is not None:
@@ -54,6 +169,195 @@ class DataExportManager(Manager):
             )
         return queryset
 
+    def export_archived(self, **kwargs):
+        """
+        Rows of the archived frames, with the export_queryset attributes
+
+        The frames are generated an archive at a time.
+        """
+        gateway_id = kwargs.get('gateway_id')
+        if gateway_id is not None and not apps.get_model(
+            'x6gateapi.dataarchive'
+        ).objects.filter(
+            gateway_id=gateway_id,
+            kind=archives.ARCHIVE_RTDATA
+        ).exists():
+            return
+
+        from_date_time = kwargs.get('from_date_time', None)
+        if from_date_time is not None:
+            from_date_time = datetime.fromisoformat(from_date_time)
+
+        to_date_time = kwargs.get('to_date_time', None)
+        if to_date_time is not None:
+            to_date_time = datetime.fromisoformat(to_date_time)
+
+        discard = kwargs.get('discard', None)
+        gateway_id, var_names = self.get_var_names(full=True, **kwargs)
+        names = {}
+        for device_id in var_names:
+            for var_name, dev_var_name in var_names[device_id]:
+                names[(device_id, dev_var_name)] = var_name
+        if not names:
+            return
+        for rows in archives.iter_archived_rows(
+            archives.ARCHIVE_RTDATA,
+            gateway_id,
+            from_date_time=from_date_time,
+            to_date_time=to_date_time
+        ):
+            yield from self._archived_frames(rows, names, discard)
+
+    def _archived_frames(self, rows, names, discard):
+        # The nodes of a frame are archived together, one after the other
+        frame = None
+        data_id = None
+        for row in rows:
+            if discard is not None and (
+                row['data_discard'] != discard
+                or row['data_removed_at'] is not None
+            ):
+                continue
+            if frame is None or row['data_id'] != data_id:
+                if frame is not None:
+                    yield frame
+                data_id = row['data_id']
+                frame = SimpleNamespace(
+                    logdt=row['logdt'],
+                    date_time=row['date_time'],
+                    **{var_name: None for var_name in names.values()}
+                )
+            var_name = names.get((row['device_id'], row['name']))
+            if var_name is None or row['removed_at'] is not None:
+                continue
+            if getattr(frame, var_name) is None:
+                setattr(frame, var_name, row['value'])
+        if frame is not None:
+            yield frame
+
+    def export_resampled(self, interval, aggregate, **kwargs):
+        """
+        Frames of the values aggregated by gateway local time buckets
+
+        The stored values are aggregated in SQL and read with a server side
+        cursor, the archived values are aggregated an archive at a time.
+        Only the numeric values are aggregated.
+
+        :param interval: Bucket interval, one of RESAMPLE_INTERVALS
+        :param aggregate: Aggregate, one of RESAMPLE_AGGREGATES
+        :param kwargs: export_queryset filters
+
+        :returns: Iterator of rows with the export_queryset attributes,
+            sorted by bucket
+        """
+        gateway_id, var_names = self.get_var_names(full=True, **kwargs)
+        names = {}
+        for device_id in var_names:
+            for var_name, dev_var_name in var_names[device_id]:
+                names[(device_id, dev_var_name)] = var_name
+        if not names:
+            return
+        tz = pytz.timezone(str(apps.get_model('x6gateapi.gateway').objects.get(
+            pk=gateway_id
+        ).timezone))
+        from_date_time = kwargs.get('from_date_time', None)
+        if from_date_time is not None:
+            from_date_time = self._aware(from_date_time)
+        to_date_time = kwargs.get('to_date_time', None)
+        if to_date_time is not None:
+            to_date_time = self._aware(to_date_time)
+        discard = kwargs.get('discard', None)
+
+        def frames(rows):
+            frame = None
+            for bucket, device_id, name, value in rows:
+                if frame is None or frame.date_time != bucket:
+                    if frame is not None:
+                        yield frame
+                    frame = SimpleNamespace(
+                        logdt=bucket.astimezone(tz).strftime(
+                            '%Y-%m-%d %H:%M:%S'
+                        ),
+                        date_time=bucket,
+                        **{var_name: None for var_name in names.values()}
+                    )
+                setattr(frame, names[(device_id, name)], value)
+            if frame is not None:
+                yield frame
+
+        yield from frames(self._archived_resampled(
+            gateway_id, names, tz, interval, aggregate, from_date_time,
+            to_date_time, discard
+        ))
+        sql = RESAMPLE_SQL.format(
+            bucket=RESAMPLE_INTERVALS[interval].format(
+                t='(n.date_time AT TIME ZONE %(tz)s)'
+            ),
+            aggregate=RESAMPLE_AGGREGATES[aggregate],
+            discard=(
+                '' if discard is None
+                else 'AND n.data_discard = %(discard)s'
+                ' AND n.data_removed_at IS NULL'
+            )
+        )
+        keys = list(names)
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(sql, {
+                'tz': tz.zone,
+                'gateway_id': gateway_id,
+                'devices_ids': [x[0] for x in keys],
+                'names': [x[1] for x in keys],
+                'from_date_time': from_date_time or datetime.min.replace(
+                    tzinfo=pytz.utc
+                ),
+                'to_date_time': to_date_time or datetime.max.replace(
+                    tzinfo=pytz.utc
+                ),
+                'discard': discard,
+            })
+            while True:
+                rows = cursor.fetchmany(settings.MEGEDC_EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield from frames(rows)
+
+    def _aware(self, date_time):
+        date_time = datetime.fromisoformat(date_time)
+        if timezone.is_naive(date_time):
+            return timezone.make_aware(date_time)
+        return date_time
+
+    def _archived_resampled(self, gateway_id, names, tz, interval, aggregate,
+                            from_date_time, to_date_time, discard):
+        function = RESAMPLE_FUNCTIONS[aggregate]
+        for rows in archives.iter_archived_rows(
+            archives.ARCHIVE_RTDATA,
+            gateway_id,
+            from_date_time=from_date_time,
+            to_date_time=to_date_time
+        ):
+            buckets = {}
+            for row in rows:
+                if discard is not None and (
+                    row['data_discard'] != discard
+                    or row['data_removed_at'] is not None
+                ):
+                    continue
+                key = (row['device_id'], row['name'])
+                if key not in names or row['removed_at'] is not None or (
+                    row['num_value'] is None
+                ):
+                    continue
+                key = (local_bucket(row['date_time'], tz, interval),) + key
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = ResampleBucket()
+                bucket.add(
+                    (row['date_time'], row['id'] or 0), row['num_value']
+                )
+            for key in sorted(buckets, key=lambda x: x[0]):
+                yield key + (function(buckets[key]),)
+
     def get_var_names(self, **kwargs):
         device_ids = kwargs.get('device_ids', [])
         gateway_id = kwargs.get('gateway_id')
@@ -71,27 +375,45 @@ class DataExportManager(Manager):
                 removed_at__isnull=True
             )
 
-        var_names = {}
-        for result_row in dev_qs.values_list('dev_id', 'name', 'gateway__id'):
+        devices = list(dev_qs.values_list('dev_id', 'name', 'gateway__id'))
+        for _, _, dev_gateway_id in devices:
             if gateway_id is None:
-                gateway_id = result_row[2]
+                gateway_id = dev_gateway_id
             else:
-                if gateway_id != result_row[2]:
+                if gateway_id != dev_gateway_id:
                     raise Exception(
                         'cannot export values from different gateways'
                     )
-            dev_id = result_row[0]
-            device_name = result_row[1]
-            queryset = self.datanode_manager.filter(
-                device_id=dev_id,
-                removed_at__isnull=True
-            )
-            if discard is not None:
-                queryset = queryset.filter(discard=discard)
-            queryset = queryset.distinct('name')
+        if isinstance(discard, str):
+            discard = bool_from_str(discard)
+
+        # Variables with realdata nodes, from the cached variables stats
+        dev_var_names = {}
+        if gateway_id is not None:
+            for dev_id, dev_var_name, has_valid, has_discarded in (
+                resolver.get_catalog(gateway_id)
+            ):
+                if discard is None or (
+                    has_discarded if discard else has_valid
+                ):
+                    dev_var_names.setdefault(dev_id, set()).add(
+                        dev_var_name
+                    )
+
+            # The archived variables are exported too
+            for variables in apps.get_model(
+                'x6gateapi.dataarchive'
+            ).objects.filter(
+                gateway_id=gateway_id,
+                kind=archives.ARCHIVE_RTDATA
+            ).values_list('variables', flat=True):
+                for dev_id, dev_var_name in variables:
+                    dev_var_names.setdefault(dev_id, set()).add(dev_var_name)
+
+        var_names = {}
+        for dev_id, device_name, _ in devices:
             var_names[dev_id] = []
-            for row in queryset.values_list('name'):
-                dev_var_name = row[0]
+            for dev_var_name in sorted(dev_var_names.get(dev_id, [])):
                 union_var_name = '%s__%s' % (
                     re.sub(r"[^a-zA-Z0-9_\-.]+", "", device_name),
                     re.sub(r"[^a-zA-Z0-9_\-.]+", "", dev_var_name)
@@ -0,0 +1,141 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from heapq import nsmallest
+from itertools import chain, islice
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward only pagination ordered by (date_time, id)
+
+    The cursor is the position of the last row of the previous page, so
+    every page is read from an index without OFFSET nor COUNT. The lists
+    are paginated when the cursor or the page size is requested, or always
+    with MEGEDC_EXPORT_PAGINATE.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        if not settings.MEGEDC_EXPORT_PAGINATE and (
+            self.cursor_query_param not in request.query_params
+            and self.page_size_query_param not in request.query_params
+        ):
+            return None
+        page_size = settings.MEGEDC_EXPORT_PAGE_SIZE
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            pass
+        return min(max(page_size, 1), settings.MEGEDC_EXPORT_MAX_PAGE_SIZE)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            date_time, pk = urlsafe_b64decode(
+                encoded.encode('ascii')
+            ).decode('ascii').split('|')
+            position = (datetime.fromisoformat(date_time), int(pk))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        # The rows positions are aware date times
+        if timezone.is_naive(position[0]):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        return urlsafe_b64encode(
+            ('%s|%s' % (position[0].isoformat(), position[1])).encode('ascii')
+        ).decode('ascii')
+
+    def position(self, row):
+        if isinstance(row, dict):
+            return (row['date_time'], row['id'])
+        return (row.date_time, row.id)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_instances(lambda position: [], queryset, request)
+
+    def paginate_instances(self, get_instances, queryset, request):
+        """
+        Paginate the instances followed by the queryset rows
+
+        Only the first instances of the page are kept while the instances
+        are read, they don't need to be sorted.
+
+        :param get_instances: Function getting the instances older than the
+            queryset rows, it gets the cursor position, or None, to skip the
+            instances of the previous pages
+        :param queryset: Queryset to paginate, of instances or values
+        :param request: Request
+
+        :returns: List of the page rows, or None if the list is not
+            paginated
+        """
+        self.page_size = self.get_page_size(request)
+        if self.page_size is None:
+            return None
+        self.request = request
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by('date_time', 'id')
+        instances = get_instances(position)
+        if position is not None:
+            queryset = queryset.filter(
+                Q(date_time__gt=position[0])
+                | Q(date_time=position[0], id__gt=position[1])
+            )
+            instances = (
+                x for x in instances if self.position(x) > position
+            )
+        instances = nsmallest(
+            self.page_size + 1, instances, key=self.position
+        )
+        page = list(islice(
+            chain(instances, queryset[:self.page_size + 1]),
+            self.page_size + 1
+        ))
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_position = None
+        if self.has_next:
+            self.next_position = self.position(page[-1])
+        return page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
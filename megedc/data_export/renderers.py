@@ -0,0 +1,187 @@
+import csv
+import json
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+from abc import ABC, abstractmethod
+from django.conf import settings
+from itertools import islice
+from megedc.x6gateapi.ingest import to_num_value
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class StreamingRenderer(BaseRenderer, ABC):
+    """
+    Renderer of rows written as they are generated
+
+    The views return a StreamingHttpResponse with the stream chunks when
+    it is the accepted renderer, render only handles the error responses.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, cls=JSONEncoder).encode('utf-8')
+
+    @abstractmethod
+    def stream(self, columns, rows, chunk_size=None, types=None):
+        """
+        Generate the encoded output in chunks of rows
+
+        :param columns: Row keys, in output order
+        :param rows: Iterable of row dicts
+        :param chunk_size: Rows per chunk, by default
+            MEGEDC_EXPORT_CHUNK_SIZE
+        :param types: Dict of columns with their pyarrow types, only used
+            by the typed formats
+        """
+
+
+class TextRenderer(StreamingRenderer):
+    """
+    Text rows, a line per row after the header
+    """
+
+    def stream(self, columns, rows, chunk_size=None, types=None):
+        chunk_size = chunk_size or settings.MEGEDC_EXPORT_CHUNK_SIZE
+        chunk = [self.header(columns)]
+        for row in rows:
+            chunk.append(self.line(columns, row))
+            if len(chunk) >= chunk_size:
+                yield ''.join(chunk).encode(self.charset)
+                chunk = []
+        if any(chunk):
+            yield ''.join(chunk).encode(self.charset)
+
+    def header(self, columns):
+        return ''
+
+    @abstractmethod
+    def line(self, columns, row):
+        pass
+
+
+class Echo:
+    """
+    File like object that returns the written value
+    """
+
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(TextRenderer):
+
+    media_type = 'text/csv'
+    format = 'csv'
+    writer = csv.writer(Echo())
+
+    def header(self, columns):
+        return self.writer.writerow(columns)
+
+    def line(self, columns, row):
+        return self.writer.writerow([row.get(column) for column in columns])
+
+
+class NDJSONRenderer(TextRenderer):
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def line(self, columns, row):
+        return json.dumps(
+            {column: row.get(column) for column in columns},
+            cls=JSONEncoder
+        ) + '\n'
+
+
+class Sink:
+    """
+    Write only file that keeps the written bytes until they are popped
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.position = 0
+        self.chunks = []
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class ArrowRenderer(StreamingRenderer):
+    """
+    Arrow IPC stream with a record batch per chunk of rows
+
+    The columns are strings unless typed, the float columns parse the
+    string values like the realdata num_value.
+    """
+
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+
+    def new_writer(self, sink, schema):
+        return pyarrow.ipc.new_stream(sink, schema)
+
+    def stream(self, columns, rows, chunk_size=None, types=None):
+        chunk_size = chunk_size or settings.MEGEDC_EXPORT_CHUNK_SIZE
+        types = types or {}
+        schema = pyarrow.schema([
+            (column, types.get(column, pyarrow.string()))
+            for column in columns
+        ])
+        floats = [
+            column for column in columns
+            if pyarrow.types.is_floating(schema.field(column).type)
+        ]
+        sink = Sink()
+        writer = self.new_writer(pyarrow.PythonFile(sink, mode='w'), schema)
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for row in chunk:
+                for column in floats:
+                    if isinstance(row.get(column), str):
+                        row[column] = to_num_value(row[column])
+            writer.write_batch(
+                pyarrow.RecordBatch.from_pylist(chunk, schema=schema)
+            )
+            yield sink.pop()
+        writer.close()
+        yield sink.pop()
+
+
+class ParquetRenderer(ArrowRenderer):
+    """
+    Parquet file compressed with zstd, with a row group per chunk of rows
+    """
+
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
+
+    def new_writer(self, sink, schema):
+        return pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
@@ -1,3 +1,617 @@
-# from django.test import TestCase
+import csv
+import io
+import json
+import pyarrow
+import pyarrow.parquet
+import pytz
+import tempfile
+from base64 import urlsafe_b64encode
+from django.apps import apps
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+from megedc.data_export.models import DataExport
+from megedc.x6gateapi import archives, ingest, resolver, rollups
+from megedc.x6gateapi.serializers import (
+    RTAlarmDataSerializer, TrendLogDataSerializer
+)
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+
+class DataExportTestCase(APITestCase):
+
+    faker = Faker()
+
+    @classmethod
+    def setUpTestData(cls):
+        client = apps.get_model('general.client').objects.create(
+            name=cls.faker.country(),
+            currency_model_id=1
+        )
+        cls.project = apps.get_model('general.project').objects.create(
+            name=cls.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        cls.user = apps.get_model('auth.user').objects.create_superuser(
+            cls.faker.user_name(), cls.faker.email(), 'password'
+        )
+
+    def setUp(self):
+        resolver.clear()
+        self.client.force_authenticate(self.user)
+
+    def create_gateway(self, **kwargs):
+        return apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=self.project,
+            **kwargs
+        )
+
+    def test_export_pivot(self):
+        gateway = self.create_gateway()
+        for index in range(2):
+            gateway.devices.create(
+                channel='1', id=str(index), name='device %s' % (index),
+                ready=True
+            )
+        ingest.ingest_rtdata_batch(gateway, [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": str(device),
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var %s" % (index),
+                                "value": "%s.%s.%s" % (minute, device, index),
+                            }
+                            for index in range(2)
+                        ]
+                    }
+                    for device in range(2)
+                ]
+            }
+            for minute in [5, 10]
+        ])
+        gateway.nodes.filter(value='10.1.1').update(removed_at=timezone.now())
+        queryset = DataExport.objects.export_queryset(gateway_id=gateway.id)
+        # Una sola consulta agrupada, sin subconsultas por columna
+        self.assertEqual(str(queryset.query).count('SELECT'), 1)
+        self.assertEqual(
+            [
+                [getattr(row, 'device1__var%s' % (x)) for x in range(2)]
+                + [getattr(row, 'device0__var1')]
+                for row in queryset.order_by('date_time')
+            ],
+            [['5.1.0', '5.1.1', '5.0.1'], ['10.1.0', None, '10.0.1']]
+        )
+        self.assertEqual(queryset.count(), 2)
+        queryset.filter(date_time__minute=5).update(discard=True)
+        self.assertEqual(
+            DataExport.objects.export_queryset(
+                gateway_id=gateway.id, discard=False
+            ).count(),
+            1
+        )
+
+    def test_export_streaming(self):
+        gateway = self.create_gateway()
+        gateway.devices.create(
+            channel='1', id='1', name='device', ready=True
+        )
+        ingest.ingest_rtdata_batch(gateway, [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {"name": "var %s" % (index), "value": "a,\"%s" % (
+                                minute + index
+                            )}
+                            for index in range(2)
+                        ] + [{"name": "num", "value": str(minute)}]
+                    }
+                ]
+            }
+            for minute in [5, 10, 15]
+        ])
+        url = reverse('data_export:rtdata-export')
+        rows = self.client.get(url, {'gateway': gateway.id}).json()
+        self.assertEqual(len(rows), 3)
+
+        with override_settings(MEGEDC_EXPORT_CHUNK_SIZE=1), \
+                self.assertLogs('megedc.timing', 'INFO') as logs, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                url, {'gateway': gateway.id, 'format': 'csv'}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            self.assertEqual(
+                response['Content-Type'], 'text/csv; charset=utf-8'
+            )
+            # Los tiempos se registran al consumir el contenido
+            self.assertEqual(logs.records, [])
+            # Un bloque por fila, la cabecera va con la primera
+            chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 3)
+        log_data = json.loads(logs.records[0].getMessage())
+        self.assertEqual(log_data['db_queries'], len(queries))
+        self.assertNotIn('Server-Timing', response)
+        csv_rows = list(csv.DictReader(io.StringIO(
+            b''.join(chunks).decode('utf-8')
+        )))
+        self.assertEqual(list(csv_rows[0]), list(rows[0]))
+        self.assertEqual(csv_rows, rows)
+
+        response = self.client.get(
+            url, {'gateway': gateway.id, 'format': 'ndjson'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [
+                json.loads(x) for x in b''.join(
+                    response.streaming_content
+                ).decode('utf-8').splitlines()
+            ],
+            rows
+        )
+
+        # Columnas tipadas en Arrow y Parquet
+        for file_format, read in [
+            ('arrow', lambda x: pyarrow.ipc.open_stream(x).read_all()),
+            ('parquet', lambda x: pyarrow.parquet.read_table(
+                pyarrow.BufferReader(x)
+            )),
+        ]:
+            with override_settings(MEGEDC_EXPORT_CHUNK_SIZE=2):
+                response = self.client.get(
+                    url, {'gateway': gateway.id, 'format': file_format}
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                table = read(b''.join(response.streaming_content))
+            self.assertEqual(table.column_names, list(rows[0]))
+            self.assertEqual(table.num_rows, 3)
+            self.assertEqual(
+                table.schema.field('utc_date_time').type,
+                pyarrow.timestamp('us', tz='UTC')
+            )
+            self.assertEqual(
+                table.schema.field('gateway_minute').type, pyarrow.int16()
+            )
+            self.assertEqual(
+                sorted(table.column('device__num').to_pylist()),
+                [5.0, 10.0, 15.0]
+            )
+            self.assertEqual(
+                table.column('device__var0').to_pylist(), [None] * 3
+            )
+
+            ingest.ingest_trend_log(gateway, {
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "trendlog": [
+                            {
+                                "dblink": "dblink_%s" % (file_format),
+                                "name": "num",
+                                "data": [
+                                    {
+                                        "date_time": "2016-02-19 00:00:00",
+                                        "value": "1.5",
+                                        "unit": "kWh",
+                                    }
+                                ]
+                            }
+                        ]
+                    }
+                ]
+            })
+            response = self.client.get(
+                reverse('data_export:trendlogdata-export'),
+                {'gateway': gateway.id, 'format': file_format}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            table = read(b''.join(response.streaming_content))
+            self.assertEqual(
+                table.schema.field('date_time').type,
+                pyarrow.timestamp('us', tz='UTC')
+            )
+            self.assertEqual(table.column('value').to_pylist()[0], 1.5)
+            self.assertEqual(table.column('unit').to_pylist()[0], 'kWh')
+
+    def test_export_archived(self):
+        gateway = self.create_gateway()
+        gateway.devices.create(
+            channel='1', id='1', name='device_1', ready=True
+        )
+        ingest.ingest_rtdata_batch(gateway, [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_%s" % (index),
+                                "value": str(minute + index),
+                                "unit": "kWh",
+                                "dblink": "dblink_%s" % (index),
+                            }
+                            for index in range(2)
+                        ]
+                    }
+                ]
+            }
+            for minute in [5, 10, 15]
+        ])
+        ingest.ingest_trend_log(gateway, {
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "trendlog": [
+                        {
+                            "dblink": "dblink_1",
+                            "name": "var_1",
+                            "data": [
+                                {
+                                    "date_time": "2016-02-19 00:%02d:00" % (
+                                        minute
+                                    ),
+                                    "value": str(minute),
+                                    "unit": "kWh",
+                                }
+                                for minute in [0, 15, 30]
+                            ]
+                        }
+                    ]
+                }
+            ]
+        })
+
+        def exports():
+            rtdata = self.client.get(reverse('data_export:rtdata-export'), {
+                'gateway': gateway.id,
+                'from_date_time': '2016-02-19 00:10:00+00:00',
+            })
+            # La lista completa por defecto
+            trend_log = self.client.get(
+                reverse('data_export:trendlogdata-export'),
+                {'gateway': gateway.id}
+            ).json()
+            # Una sola pagina con la paginacion activada
+            with override_settings(MEGEDC_EXPORT_PAGINATE=True):
+                page = self.client.get(
+                    reverse('data_export:trendlogdata-export'),
+                    {'gateway': gateway.id}
+                ).json()
+            self.assertEqual(page, {'next': None, 'results': trend_log})
+            # Paginas por cursor, sin OFFSET
+            pages = []
+            params = {'gateway': gateway.id, 'page_size': 2}
+            while params:
+                page = self.client.get(
+                    reverse('data_export:trendlogdata-export'), params
+                ).json()
+                pages.append(len(page['results']))
+                self.assertEqual(
+                    page['results'],
+                    sorted(trend_log, key=lambda x: x['date_time'])[
+                        sum(pages[:-1]):sum(pages)
+                    ]
+                )
+                params = page['next'] and {
+                    'gateway': gateway.id,
+                    'page_size': 2,
+                    'cursor': parse_qs(urlparse(page['next']).query)[
+                        'cursor'
+                    ][0]
+                }
+            self.assertEqual(pages, [2, 1])
+            return (
+                sorted(rtdata.json(), key=lambda x: x['utc_date_time']),
+                sorted(trend_log, key=lambda x: x['date_time']),
+            )
+
+        stored = exports()
+        self.assertEqual(len(stored[0]), 2)
+        self.assertEqual(len(stored[1]), 3)
+        response = self.client.get(
+            reverse('data_export:trendlogdata-export'),
+            {'gateway': gateway.id, 'from_date_time': '2016-02-30'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Un cursor sin zona horaria no es valido
+        response = self.client.get(
+            reverse('data_export:trendlogdata-export'),
+            {
+                'gateway': gateway.id,
+                'cursor': urlsafe_b64encode(b'2016-02-19T00:00:00|1').decode()
+            }
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # Los meses archivados se leen por lotes, desde el cursor
+        with tempfile.TemporaryDirectory() as archive_root:
+            with override_settings(
+                MEGEDC_ARCHIVE_ROOT=archive_root,
+                MEGEDC_ARCHIVE_AFTER_MONTHS=1,
+                MEGEDC_ARCHIVE_CHUNK_SIZE=2
+            ):
+                with self.captureOnCommitCallbacks(execute=True):
+                    archives.archive()
+                self.assertFalse(gateway.data.exists())
+                self.assertEqual(exports(), stored)
+
+    def test_export_resampling(self):
+        gateway = self.create_gateway(
+            time_zone=pytz.timezone('America/Panama')
+        )
+        gateway.devices.create(
+            channel='1', id='1', name='device', ready=True
+        )
+        ingest.ingest_rtdata_batch(gateway, [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {"name": "var", "value": str(value)},
+                            {"name": "text", "value": "on"},
+                        ]
+                    }
+                ]
+            }
+            for minute, value in [(5, 1), (10, 2), (20, 4), (35, 8)]
+        ])
+        url = reverse('data_export:rtdata-export')
+
+        def resampled(interval, agg):
+            response = self.client.get(url, {
+                'gateway': gateway.id, 'interval': interval, 'agg': agg
+            })
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [
+                (x['gateway_hour'], x['gateway_minute'], x['device__var'])
+                for x in response.json()
+            ]
+
+        def exports():
+            return [
+                resampled('15min', 'avg'),
+                resampled('15min', 'delta'),
+                resampled('1h', 'sum'),
+                resampled('1d', 'last'),
+            ]
+
+        hour = gateway.data.get(
+            logdt='2016-02-19 00:05:00'
+        ).date_time.astimezone(gateway.timezone).strftime('%H')
+        stored = exports()
+        self.assertEqual(stored, [
+            [(hour, '00', 1.5), (hour, '15', 4.0), (hour, '30', 8.0)],
+            [(hour, '00', 1.0), (hour, '15', 0.0), (hour, '30', 0.0)],
+            [(hour, '00', 15.0)],
+            [('00', '00', 8.0)],
+        ])
+        response = self.client.get(url, {
+            'gateway': gateway.id, 'interval': '2h'
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Los meses archivados se agregan igual
+        with tempfile.TemporaryDirectory() as archive_root:
+            with override_settings(
+                MEGEDC_ARCHIVE_ROOT=archive_root,
+                MEGEDC_ARCHIVE_AFTER_MONTHS=1
+            ):
+                with self.captureOnCommitCallbacks(execute=True):
+                    archives.archive()
+                self.assertFalse(gateway.data.exists())
+                self.assertEqual(exports(), stored)
+
+    def test_export_values_serializer(self):
+        gateway = self.create_gateway()
+        device = gateway.devices.create(
+            channel='1', id='1', name='device', ready=True
+        )
+        ingest.ingest_trend_log(gateway, {
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "trendlog": [
+                        {
+                            "dblink": "dblink_1",
+                            "name": "var_1",
+                            "data": [
+                                {
+                                    "date_time": "2016-02-19 00:%02d:00" % (
+                                        minute
+                                    ),
+                                    "value": str(minute),
+                                    "unit": unit,
+                                }
+                                for minute, unit in [
+                                    (0, 'kWh'), (15, 'Wh'), (30, None)
+                                ]
+                            ]
+                        }
+                    ]
+                }
+            ]
+        })
+        for index in range(2):
+            device.alarms.create(
+                logdt='2016-02-19 00:0%s:00' % (index),
+                name='alarm', value=str(index), type=None, flag='1'
+            )
+        for serializer_class, queryset in [
+            (TrendLogDataSerializer, device.trend_log_data.select_related(
+                'variable', 'device__gateway'
+            )),
+            (RTAlarmDataSerializer, device.alarms.select_related(
+                'device__gateway'
+            )),
+        ]:
+            queryset = queryset.order_by('date_time', 'id')
+            expected = JSONRenderer().render(
+                serializer_class(queryset, many=True).data
+            )
+            serializer = serializer_class()
+            with CaptureQueriesContext(connection) as queries:
+                data = serializer.values_representation(
+                    serializer.values_queryset(queryset)
+                )
+            self.assertEqual(len(queries), 1)
+            self.assertIn(len(data), [2, 3])
+            # La misma salida, byte a byte
+            self.assertEqual(JSONRenderer().render(data), expected)
+
+    def test_variable_catalog(self):
+        gateway = self.create_gateway()
+        for index in range(2):
+            gateway.devices.create(
+                channel='1', id=str(index), name='device %s' % (index),
+                ready=bool(index)
+            )
+        ingest.ingest_rtdata_batch(gateway, [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": str(device),
+                        "channel": "1",
+                        "node": [
+                            {"name": "var", "value": str(minute)}
+                        ]
+                    }
+                    for device in range(2)
+                ]
+            }
+            for minute in [5, 10]
+        ])
+        # Las variables nuevas salen de sus primeros nodos, el conteo se
+        # calcula con los rollups
+        self.assertEqual(
+            [
+                (x.has_valid_nodes, x.nodes_count, x.last_seen.minute)
+                for x in apps.get_model('x6gateapi.variable').objects.filter(
+                    device__gateway=gateway
+                ).order_by('device__id')
+            ],
+            [(False, 0, 10), (True, 0, 10)]
+        )
+        rollups.update(rollups.ROLLUP_RTDATA)
+        # El dispositivo 0 no esta listo, sus valores se descartan
+        variables = {
+            x.device.id: x for x in apps.get_model(
+                'x6gateapi.variable'
+            ).objects.filter(device__gateway=gateway).select_related('device')
+        }
+        self.assertEqual(variables['1'].nodes_count, 2)
+        self.assertEqual(variables['1'].first_seen.minute, 5)
+        self.assertEqual(variables['1'].last_seen.minute, 10)
+        self.assertTrue(variables['1'].has_valid_nodes)
+        self.assertFalse(variables['1'].has_discarded_nodes)
+        self.assertFalse(variables['0'].has_valid_nodes)
+        self.assertTrue(variables['0'].has_discarded_nodes)
+
+        def var_names(**kwargs):
+            with CaptureQueriesContext(connection) as queries:
+                _, var_names = DataExport.objects.get_var_names(
+                    gateway_id=gateway.id, **kwargs
+                )
+            # Sin recorrer los valores guardados
+            self.assertFalse([
+                x for x in queries if 'x6gateapi_datanone' in x['sql']
+            ])
+            return sorted(
+                x[0] for names in var_names.values() for x in names
+            )
+
+        self.assertEqual(var_names(), ['device0__var', 'device1__var'])
+        self.assertEqual(var_names(discard='f'), ['device1__var'])
+        self.assertEqual(var_names(discard=True), ['device0__var'])
+        # El catalogo queda en cache
+        with self.assertNumQueries(0):
+            resolver.get_catalog(gateway.id)
+
+        # Un valor valido nuevo actualiza el catalogo sin los rollups
+        device = gateway.devices.get(id='0')
+        device.ready = True
+        device.save()
+        rt_data = ingest.ingest_rtdata(gateway, {
+            "logdt": "2016-02-19 00:15:00",
+            "device": [
+                {"id": "0", "channel": "1", "node": [
+                    {"name": "var", "value": "15"}
+                ]}
+            ]
+        })
+        self.assertEqual(
+            var_names(discard=False), ['device0__var', 'device1__var']
+        )
+        self.assertEqual(
+            apps.get_model('x6gateapi.variable').objects.get(
+                device__gateway=gateway, device__id='0'
+            ).last_seen,
+            rt_data.date_time
+        )
+
+        # Una variable creada por el trend log sale con su primer nodo
+        ingest.ingest_trend_log(gateway, {
+            "device": [
+                {"id": "1", "channel": "1", "trendlog": [
+                    {"name": "tl", "dblink": "tl", "data": [
+                        {"date_time": "2016-02-19 00:00:00", "value": "1"}
+                    ]}
+                ]}
+            ]
+        })
+        self.assertEqual(var_names(), ['device0__var', 'device1__var'])
+        ingest.ingest_rtdata(gateway, {
+            "logdt": "2016-02-19 00:20:00",
+            "device": [
+                {"id": "1", "channel": "1", "node": [
+                    {"name": "tl", "value": "20"}
+                ]}
+            ]
+        })
+        self.assertEqual(
+            var_names(discard=False),
+            ['device0__var', 'device1__tl', 'device1__var']
+        )
+
+        # Los valores borrados salen del catalogo
+        rollups.soft_delete(
+            rollups.ROLLUP_RTDATA,
+            gateway.nodes.filter(device__id='1'),
+            timezone.now()
+        )
+        rollups.update(rollups.ROLLUP_RTDATA)
+        self.assertEqual(var_names(), ['device0__var'])
+        variable = apps.get_model('x6gateapi.variable').objects.get(
+            device__gateway=gateway, device__id='1', name='var'
+        )
+        self.assertEqual(
+            (variable.first_seen, variable.has_valid_nodes), (None, False)
+        )
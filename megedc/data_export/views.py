@@ -1,10 +1,27 @@
+import pyarrow
 from datetime import datetime
-from django.http.response import Http404
+from django.conf import settings
+from django.http.response import Http404, StreamingHttpResponse
 from django.apps import apps
+from django.utils import timezone
+from itertools import chain
+from megedc.data_export.models import (
+    RESAMPLE_AGGREGATES, RESAMPLE_INTERVALS
+)
+from megedc.data_export.pagination import KeysetPagination
+from megedc.data_export.renderers import (
+    ArrowRenderer,
+    CSVRenderer,
+    NDJSONRenderer,
+    ParquetRenderer,
+    StreamingRenderer,
+)
 from megedc.utils import bool_from_str
+from megedc.x6gateapi import archives
 from megedc.x6gateapi.serializers import (
     TrendLogDataSerializer, RTAlarmDataSerializer
 )
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import (
     get_object_or_404,
     ListAPIView,
@@ -13,22 +30,83 @@ from rest_framework.generics import (
 )
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, DjangoModelPermissions
 from megedc.billing.measue_calculators import Calculators
 from megedc.data_export.serializers import FormDataUpdateViewSerializer
 
 
+def streaming_response(renderer, content, name):
+    """
+    Response with the content generated by a streaming renderer
+    """
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type = '%s; charset=%s' % (content_type, renderer.charset)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+        name, renderer.format
+    )
+    return response
+
+
 class RTDataExportAPIView(APIView):
 
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [
+        CSVRenderer,
+        NDJSONRenderer,
+        ArrowRenderer,
+        ParquetRenderer,
+    ]
+
+    date_time_columns = [
+        'logdt',
+        'utc_date_time',
+        'utc_year',
+        'utc_month',
+        'utc_day',
+        'utc_hour',
+        'utc_minute',
+        'gateway_date_time',
+        'gateway_year',
+        'gateway_month',
+        'gateway_day',
+        'gateway_hour',
+        'gateway_minute',
+    ]
+
+    date_time_parts = ('year', 'month', 'day', 'hour', 'minute')
+
     @property
     def dataexport_manager(self):
         return apps.get_model('data_export.dataexport').objects
 
     def get(self, request, *args, **kwargs):
-        return Response(self.make_data(request))
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, StreamingRenderer):
+            return Response(self.make_data(request))
+        typed = isinstance(renderer, ArrowRenderer)
+        columns, rows, types = self.export_data(request, typed=typed)
+        return streaming_response(
+            renderer, renderer.stream(columns, rows, types=types), 'rt_data'
+        )
 
     def make_data(self, request):
+        _, rows, _ = self.export_data(request)
+        return rows
+
+    def export_data(self, request, typed=False):
+        """
+        Get the export columns, the rows generator and the columns types
+
+        With typed the rows keep the date times and numbers, the columns
+        types are the pyarrow types of the typed formats.
+
+        The stored rows are read with a server side cursor, in chunks of
+        MEGEDC_EXPORT_CHUNK_SIZE rows. With an interval the values are
+        aggregated by gateway local time buckets with the agg aggregate.
+        """
         device_ids = []
         discard = self.request.query_params.get('discard', 'f')
         if discard is not None:
@@ -47,23 +125,78 @@ class RTDataExportAPIView(APIView):
             device_ids=device_ids,
             gateway_id=gateway_id
         )
-        data_qs = self.dataexport_manager.export_queryset(
-            device_ids=device_ids,
-            gateway_id=gateway_id,
-            discard=discard,
-            from_date_time=request.query_params.get('from_date_time', None),
-            to_date_time=request.query_params.get('to_date_time', None)
-        )
+        filters = {
+            'device_ids': device_ids,
+            'gateway_id': gateway_id,
+            'discard': discard,
+            'from_date_time': request.query_params.get('from_date_time', None),
+            'to_date_time': request.query_params.get('to_date_time', None),
+        }
+        interval = request.query_params.get('interval', None)
+        aggregate = request.query_params.get('agg', 'avg')
+        if interval is not None and interval not in RESAMPLE_INTERVALS:
+            raise ValidationError({'interval': 'Must be one of %s' % (
+                ', '.join(RESAMPLE_INTERVALS)
+            )})
+        if aggregate not in RESAMPLE_AGGREGATES:
+            raise ValidationError({'agg': 'Must be one of %s' % (
+                ', '.join(RESAMPLE_AGGREGATES)
+            )})
         gateway = get_object_or_404(
             apps.get_model('x6gateapi.gateway').objects,
             pk=gateway_id
         )
-        gateway_tz = gateway.timezone
+        if interval is not None:
+            qs_rows = self.dataexport_manager.export_resampled(
+                interval, aggregate, **filters
+            )
+        else:
+            data_qs = self.dataexport_manager.export_queryset(**filters)
+            # The archived months are older than the stored ones
+            qs_rows = chain(
+                self.dataexport_manager.export_archived(**filters),
+                data_qs.iterator(chunk_size=settings.MEGEDC_EXPORT_CHUNK_SIZE)
+            )
         var_names = []
         for device_id in var_names_data:
             for var_name, _ in var_names_data[device_id]:
                 var_names.append(var_name)
-        for qs_row in data_qs.iterator():
+        types = {
+            'utc_date_time': pyarrow.timestamp('us', tz='UTC'),
+            'gateway_date_time': pyarrow.timestamp(
+                'us', tz=str(gateway.timezone)
+            ),
+        }
+        for column in self.date_time_columns:
+            if column.endswith(self.date_time_parts):
+                types[column] = pyarrow.int16()
+        for var_name in var_names:
+            types[var_name] = pyarrow.float64()
+        make_rows = self.make_typed_rows if typed else self.make_rows
+        return (
+            self.date_time_columns + var_names,
+            make_rows(gateway.timezone, var_names, qs_rows),
+            types
+        )
+
+    def make_typed_rows(self, gateway_tz, var_names, qs_rows):
+        for qs_row in qs_rows:
+            gateway_date_time = qs_row.date_time.astimezone(gateway_tz)
+            row = {
+                'logdt': qs_row.logdt,
+                'utc_date_time': qs_row.date_time,
+                'gateway_date_time': gateway_date_time,
+            }
+            for part in self.date_time_parts:
+                value = getattr(gateway_date_time, part)
+                row['utc_%s' % (part)] = value
+                row['gateway_%s' % (part)] = value
+            for var_name in var_names:
+                row[var_name] = getattr(qs_row, var_name, None)
+            yield row
+
+    def make_rows(self, gateway_tz, var_names, qs_rows):
+        for qs_row in qs_rows:
             gateway_date_time = qs_row.date_time.astimezone(gateway_tz)
             row = {
                 'logdt': qs_row.logdt,
@@ -91,18 +224,44 @@ class RTDataExportAPIView(APIView):
 
 class DataListAPIView(ListAPIView):
 
+    pagination_class = KeysetPagination
+
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [
+        ArrowRenderer,
+        ParquetRenderer,
+    ]
+
+    # Types of the typed formats columns, strings by default
+    arrow_types = {}
+
+    def get_date_times(self):
+        """
+        Parse the from_date_time and to_date_time query params
+
+        :returns: Tuple of the from and to aware date times, None when not
+            given
+        """
+        date_times = []
+        for param in ('from_date_time', 'to_date_time'):
+            date_time = self.request.query_params.get(param, None)
+            if date_time is not None:
+                try:
+                    date_time = datetime.fromisoformat(date_time)
+                except ValueError:
+                    raise ValidationError({param: 'Invalid date time'})
+                if timezone.is_naive(date_time):
+                    date_time = timezone.make_aware(date_time)
+            date_times.append(date_time)
+        return tuple(date_times)
+
     def filter_queryset(self, queryset):
         queryset = super().filter_queryset(queryset)
         gw_id = self.request.query_params.get('gateway')
 
-        from_date_time = self.request.query_params.get('from_date_time', None)
+        from_date_time, to_date_time = self.get_date_times()
         if from_date_time is not None:
-            from_date_time = datetime.fromisoformat(from_date_time)
             queryset = queryset.filter(date_time__gte=from_date_time)
-
-        to_date_time = self.request.query_params.get('to_date_time', None)
         if to_date_time is not None:
-            to_date_time = datetime.fromisoformat(to_date_time)
             queryset = queryset.filter(date_time__lte=to_date_time)
 
         if not gw_id:
@@ -115,14 +274,95 @@ class DataListAPIView(ListAPIView):
         )
         return queryset.select_related('device', 'device__gateway')
 
+    def archived_instances(self, position=None):
+        """
+        Get the archived instances, older than the stored rows
+
+        :param position: Pagination position, (date_time, id), the archived
+            instances are read from its date time
+
+        :returns: Iterable of instances
+        """
+        return []
+
+    def list(self, request, *args, **kwargs):
+        # The stored rows are read as values, without model instances
+        serializer = self.get_serializer()
+        queryset = serializer.values_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        renderer = request.accepted_renderer
+        if isinstance(renderer, StreamingRenderer):
+            rows = serializer.values_rows(chain(
+                self.archived_instances(),
+                queryset.order_by('date_time', 'id').iterator(
+                    chunk_size=settings.MEGEDC_EXPORT_CHUNK_SIZE
+                )
+            ))
+            return streaming_response(renderer, renderer.stream(
+                list(serializer.fields), rows, types=self.arrow_types
+            ), serializer.Meta.model._meta.model_name)
+        page = self.paginator.paginate_instances(
+            self.archived_instances, queryset, request
+        )
+        if page is not None:
+            return self.get_paginated_response(
+                serializer.values_representation(page)
+            )
+        return Response(serializer.values_representation(chain(
+            self.archived_instances(),
+            queryset.order_by('date_time', 'id')
+        )))
+
 
 class TrendLogDataListAPIView(DataListAPIView):
 
     serializer_class = TrendLogDataSerializer
 
+    arrow_types = {
+        'date_time': pyarrow.timestamp('us', tz='UTC'),
+        'value': pyarrow.float64(),
+    }
+
     @property
     def queryset(self):
-        return apps.get_model('x6gateapi.trendlogdata').objects
+        return apps.get_model('x6gateapi.trendlogdata').objects.select_related(
+            'variable'
+        )
+
+    def archived_instances(self, position=None):
+        gw_id = self.request.query_params.get('gateway')
+        if not gw_id:
+            raise Http404()
+        from_date_time, to_date_time = self.get_date_times()
+        if position is not None and (
+            from_date_time is None or position[0] > from_date_time
+        ):
+            from_date_time = position[0]
+        rows = archives.archived_rows(
+            archives.ARCHIVE_TREND_LOG,
+            gw_id,
+            from_date_time=from_date_time,
+            to_date_time=to_date_time
+        )
+        devices = apps.get_model('x6gateapi.device').objects.filter(
+            gateway_id=gw_id
+        ).select_related('gateway').in_bulk()
+        model = apps.get_model('x6gateapi.trendlogdata')
+        return (
+            model(
+                id=row['id'],
+                device=devices[row['device_id']],
+                name=row['name'],
+                date_time=row['date_time'],
+                value=row['value'],
+                num_value=row['num_value'],
+                dblink=row['dblink'],
+                unit=row['unit']
+            )
+            for row in rows
+            if row['removed_at'] is None and row['device_id'] in devices
+        )
 
 
 class RTAlarmDataListAPIView(DataListAPIView):
@@ -24,6 +24,7 @@ from django.utils.timezone import localtime
 from megedc.billing.invoice_makers import InvoiceMakers
 from megedc.mixers import CeUpDeAtAdminMixser
 from megedc.utils import bool_from_str
+from megedc.x6gateapi import resolver, rollups
 
 
 # Fot register Admin classes
@@ -189,6 +190,7 @@ class ProjectDeleteActionConfirm:
             )
         else:
             counrt = queryset.count()
+            projects_pks = list(queryset.values_list('pk', flat=True))
             with atomic():
                 apps.get_model('x6gateapi.gateway').objects.filter(
                     removed_at__isnull=True,
@@ -198,18 +200,29 @@ class ProjectDeleteActionConfirm:
                     removed_at__isnull=True,
                     gateway__project__in=queryset
                 ).update(removed_at=localtime())
-                apps.get_model('x6gateapi.rtdata').objects.filter(
-                    removed_at__isnull=True,
-                    gateway__project__in=queryset
-                ).update(removed_at=localtime())
-                apps.get_model('x6gateapi.DataNone').objects.filter(
-                    removed_at__isnull=True,
-                    device__gateway__project__in=queryset,
-                ).update(removed_at=localtime())
-                apps.get_model('x6gateapi.trendlogdata').objects.filter(
-                    removed_at__isnull=True,
-                    device__gateway__project__in=queryset,
-                ).update(removed_at=localtime())
+                rollups.soft_delete_frames(
+                    apps.get_model('x6gateapi.rtdata').objects.filter(
+                        removed_at__isnull=True,
+                        gateway__project__in=queryset
+                    ),
+                    localtime()
+                )
+                rollups.soft_delete(
+                    rollups.ROLLUP_RTDATA,
+                    apps.get_model('x6gateapi.DataNone').objects.filter(
+                        removed_at__isnull=True,
+                        gateway__project__in=queryset,
+                    ),
+                    localtime()
+                )
+                rollups.soft_delete(
+                    rollups.ROLLUP_TREND_LOG,
+                    apps.get_model('x6gateapi.trendlogdata').objects.filter(
+                        removed_at__isnull=True,
+                        device__gateway__project__in=queryset,
+                    ),
+                    localtime()
+                )
                 local_model = apps.get_model('x6gateapi.local')
                 local_qs = local_model.objects.filter(
                     removed_at__isnull=True,
@@ -218,6 +231,7 @@ class ProjectDeleteActionConfirm:
                 local_admin = self.admin_site._registry.get(local_model)
                 local_admin.delete_queryset(request, local_qs)
                 queryset.update(removed_at=localtime())
+            resolver.invalidate_projects(projects_pks)
 
             modeladmin.message_user(
                 request,
@@ -254,8 +268,7 @@ class ProjectDeleteActionConfirm:
             )
             datanode_qs = apps.get_model('x6gateapi.DataNone').objects.filter(
                 removed_at__isnull=True,
-                device__gateway__project=project,
-                data__gateway__project=project,
+                gateway__project=project,
             )
             trnds_qs = apps.get_model('x6gateapi.trendlogdata').objects.filter(
                 removed_at__isnull=True,
@@ -298,6 +311,9 @@ class ProjectAdmin(CeUpDeAtAdminMixser,
 
         def __call__(self, modeladmin, request, queryset):
             queryset.update(enabled=self.disable_value)
+            resolver.invalidate_projects(
+                list(queryset.values_list('pk', flat=True))
+            )
 
     class enable_action(disable_action):
 
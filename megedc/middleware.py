@@ -0,0 +1,139 @@
+import contextvars
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('megedc.timing')
+
+_request_timing = contextvars.ContextVar('megedc_request_timing', default=None)
+
+
+class RequestTiming():
+    """
+    Time spent by a request on SQL queries and redis commands
+    """
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.redis_calls = 0
+        self.redis_time = 0.0
+        self._redis_depth = 0
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.db_queries += 1
+
+    def python_time(self, total):
+        return max(total - self.db_time - self.redis_time, 0)
+
+    @contextmanager
+    def redis(self):
+        # Nested calls, like get_many calling get, are counted once
+        self._redis_depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._redis_depth -= 1
+            if self._redis_depth == 0:
+                self.redis_time += time.perf_counter() - start
+                self.redis_calls += 1
+
+
+@contextmanager
+def redis_timing():
+    """
+    Record the wrapped redis command on the current request timing
+    """
+    timing = _request_timing.get()
+    if timing is None:
+        yield
+        return
+    with timing.redis():
+        yield
+
+
+class ServerTimingMiddleware():
+    """
+    Record SQL, redis and python time of every request
+
+    The times are logged in the megedc.timing logger with the URL name of
+    the request, and sent in the Server-Timing header if
+    MEGEDC_SERVER_TIMING_HEADER is enabled. The streaming responses run
+    their queries while the content is iterated, so they are logged once
+    the content is consumed and have not header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @contextmanager
+    def timed(self, timing):
+        token = _request_timing.set(timing)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timing.db_wrapper)
+                    )
+                yield
+        finally:
+            _request_timing.reset(token)
+
+    def timed_stream(self, request, response, content, timing, start):
+        with self.timed(timing):
+            yield from content
+        self.log(request, response, timing, time.perf_counter() - start)
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        start = time.perf_counter()
+        with self.timed(timing):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.timed_stream(
+                request, response, response.streaming_content, timing, start
+            )
+            return response
+        total = time.perf_counter() - start
+        if settings.MEGEDC_SERVER_TIMING_HEADER:
+            response['Server-Timing'] = ', '.join([
+                'db;dur=%.2f;desc="%s queries"' % (
+                    timing.db_time * 1000, timing.db_queries
+                ),
+                'redis;dur=%.2f;desc="%s calls"' % (
+                    timing.redis_time * 1000, timing.redis_calls
+                ),
+                'app;dur=%.2f' % (timing.python_time(total) * 1000),
+                'total;dur=%.2f' % (total * 1000),
+            ])
+        self.log(request, response, timing, total)
+        return response
+
+    def log(self, request, response, timing, total):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        resolver_match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'url_name': (
+                resolver_match.view_name
+                if resolver_match is not None else None
+            ),
+            'method': request.method,
+            'status': response.status_code,
+            'db_queries': timing.db_queries,
+            'db_ms': round(timing.db_time * 1000, 2),
+            'redis_calls': timing.redis_calls,
+            'redis_ms': round(timing.redis_time * 1000, 2),
+            'python_ms': round(timing.python_time(total) * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+        }))
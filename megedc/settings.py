@@ -1,4 +1,5 @@
 import os
+from celery.schedules import crontab
 from datetime import timedelta
 from megedc.utils import bool_from_str, get_env, passwd_file
 from pathlib import Path
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'megedc.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -199,6 +201,28 @@ CELERY_RESULT_EXPIRES = timedelta(
 )
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_IMPORTS = ['megedc.billing.tasks', 'megedc.x6gateapi.tasks']
+CELERY_BEAT_SCHEDULE = {
+    'x6gateapi-maintain-partitions': {
+        'task': 'megedc.x6gateapi.tasks.maintain_partitions',
+        'schedule': crontab(minute=30, hour=0),
+    },
+    'x6gateapi-update-rollups': {
+        'task': 'megedc.x6gateapi.tasks.update_rollups',
+        'schedule': crontab(minute='*/5'),
+    },
+    'x6gateapi-enforce-retention': {
+        'task': 'megedc.x6gateapi.tasks.enforce_retention',
+        'schedule': crontab(minute=0, hour=2),
+    },
+    'x6gateapi-purge-removed': {
+        'task': 'megedc.x6gateapi.tasks.purge_removed',
+        'schedule': crontab(minute=0, hour=3),
+    },
+    'x6gateapi-archive-cold-data': {
+        'task': 'megedc.x6gateapi.tasks.archive_cold_data',
+        'schedule': crontab(minute=0, hour=4),
+    },
+}
 
 JASPERSERVER_URL = get_env(
     'JASPERSERVER_URL', 'http://localhost:8080'
@@ -227,7 +251,7 @@ CACHES = {
                                 'DJANGO_CACHES_DEFAULT_LOCATION',
                                 'redis://localhost:6379/0'),
         "OPTIONS": {
-            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CLIENT_CLASS": "megedc.cache.TimedRedisClient",
         }
     }
 }
@@ -261,3 +285,139 @@ TINYMCE_DEFAULT_CONFIG = {
 DATA_UPLOAD_MAX_NUMBER_FIELDS = int(
     get_env('DJANGO_DATA_UPLOAD_MAX_NUMBER_FIELDS', '1000')
 )
+
+MEGEDC_X6GATEAPI_BATCH_CHUNK_SIZE = int(
+    get_env('MEGEDC_X6GATEAPI_BATCH_CHUNK_SIZE', '500')
+)
+
+MEGEDC_X6GATEAPI_ASYNC_INGEST = bool_from_str(
+    get_env('MEGEDC_X6GATEAPI_ASYNC_INGEST', 'f')
+)
+
+MEGEDC_X6GATEAPI_ALARM_ALERTS = bool_from_str(
+    get_env('MEGEDC_X6GATEAPI_ALARM_ALERTS', 'f')
+)
+
+MEGEDC_X6GATEAPI_INGEST_DRAIN_SIZE = int(
+    get_env('MEGEDC_X6GATEAPI_INGEST_DRAIN_SIZE', '1000')
+)
+
+MEGEDC_X6GATEAPI_INGEST_DRAIN_DELAY = int(
+    get_env('MEGEDC_X6GATEAPI_INGEST_DRAIN_DELAY', '2')
+)
+
+MEGEDC_X6GATEAPI_RESOLVER_TIMEOUT = int(
+    get_env('MEGEDC_X6GATEAPI_RESOLVER_TIMEOUT', '300')
+)
+
+MEGEDC_X6GATEAPI_RESOLVER_LOCAL_TIMEOUT = int(
+    get_env('MEGEDC_X6GATEAPI_RESOLVER_LOCAL_TIMEOUT', '10')
+)
+
+MEGEDC_X6GATEAPI_RESOLVER_LOCAL_SIZE = int(
+    get_env('MEGEDC_X6GATEAPI_RESOLVER_LOCAL_SIZE', '1024')
+)
+
+MEGEDC_X6GATEAPI_IDEMPOTENCY_TIMEOUT = int(
+    get_env('MEGEDC_X6GATEAPI_IDEMPOTENCY_TIMEOUT', '600')
+)
+
+MEGEDC_X6GATEAPI_MAX_DECODED_SIZE = int(
+    get_env('MEGEDC_X6GATEAPI_MAX_DECODED_SIZE', str(10 * 1024 * 1024))
+)
+
+MEGEDC_SERVER_TIMING_HEADER = bool_from_str(
+    get_env('MEGEDC_SERVER_TIMING_HEADER', 'f')
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'megedc.timing': {
+            'handlers': ['console'],
+            'level': get_env('MEGEDC_TIMING_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+MEGEDC_PARTITIONS_AHEAD = int(get_env('MEGEDC_PARTITIONS_AHEAD', '3'))
+
+MEGEDC_PARTITIONS_RETENTION_MONTHS = int(
+    get_env('MEGEDC_PARTITIONS_RETENTION_MONTHS', '0')
+)
+
+# Default partition of the rows out of the monthly ranges, without it
+# those inserts fail
+MEGEDC_PARTITIONS_DEFAULT = bool_from_str(
+    get_env('MEGEDC_PARTITIONS_DEFAULT', 't')
+)
+
+MEGEDC_PARTITIONS_DROP_DETACHED = bool_from_str(
+    get_env('MEGEDC_PARTITIONS_DROP_DETACHED', 'f')
+)
+
+MEGEDC_ROLLUPS_BATCH_SIZE = int(
+    get_env('MEGEDC_ROLLUPS_BATCH_SIZE', '50000')
+)
+
+MEGEDC_ROLLUPS_MAX_BATCHES = int(
+    get_env('MEGEDC_ROLLUPS_MAX_BATCHES', '20')
+)
+
+# Ids before the watermark read again, ids are not committed in order
+MEGEDC_ROLLUPS_ID_OVERLAP = int(
+    get_env('MEGEDC_ROLLUPS_ID_OVERLAP', '1000')
+)
+
+MEGEDC_RETENTION_BATCH_SIZE = int(
+    get_env('MEGEDC_RETENTION_BATCH_SIZE', '10000')
+)
+
+# Local days of raw data removed per source and gateway on each run
+MEGEDC_RETENTION_MAX_DAYS = int(get_env('MEGEDC_RETENTION_MAX_DAYS', '31'))
+
+MEGEDC_RETENTION_SLEEP = float(get_env('MEGEDC_RETENTION_SLEEP', '0'))
+
+MEGEDC_PURGE_GRACE_DAYS = int(get_env('MEGEDC_PURGE_GRACE_DAYS', '30'))
+
+MEGEDC_PURGE_BATCH_SIZE = int(get_env('MEGEDC_PURGE_BATCH_SIZE', '1000'))
+
+MEGEDC_PURGE_SLEEP = float(get_env('MEGEDC_PURGE_SLEEP', '0.1'))
+
+MEGEDC_ARCHIVE_ROOT = get_env('MEGEDC_ARCHIVE_ROOT', 'archives')
+
+# Months kept in the database, 0 disables the archives
+MEGEDC_ARCHIVE_AFTER_MONTHS = int(
+    get_env('MEGEDC_ARCHIVE_AFTER_MONTHS', '0')
+)
+
+MEGEDC_ARCHIVE_MAX_MONTHS = int(get_env('MEGEDC_ARCHIVE_MAX_MONTHS', '12'))
+
+# Rows read, written and deleted per archive chunk
+MEGEDC_ARCHIVE_CHUNK_SIZE = int(
+    get_env('MEGEDC_ARCHIVE_CHUNK_SIZE', '10000')
+)
+
+# Rows read per server side cursor fetch and written per streamed chunk
+MEGEDC_EXPORT_CHUNK_SIZE = int(get_env('MEGEDC_EXPORT_CHUNK_SIZE', '2000'))
+
+# Paginate the export lists by default, as {next, results} pages. Without
+# it the lists are paginated only when requested with the cursor or
+# page_size params, and the full list is returned otherwise
+MEGEDC_EXPORT_PAGINATE = bool_from_str(
+    get_env('MEGEDC_EXPORT_PAGINATE', 'f')
+)
+
+# Rows per page of the export lists, unless requested with page_size
+MEGEDC_EXPORT_PAGE_SIZE = int(get_env('MEGEDC_EXPORT_PAGE_SIZE', '1000'))
+
+MEGEDC_EXPORT_MAX_PAGE_SIZE = int(
+    get_env('MEGEDC_EXPORT_MAX_PAGE_SIZE', '10000')
+)
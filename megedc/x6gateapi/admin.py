@@ -7,6 +7,7 @@ from django.contrib import admin
 from django.contrib import messages
 from django.contrib.admin.options import csrf_protect_m
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.db.models import Q
 from django.http.response import HttpResponseRedirect
 from django.template.exceptions import TemplateSyntaxError
 from django.urls import reverse, path
@@ -19,7 +20,7 @@ from megedc.emporiaenergy.partner_api import (
     PartnerApiResponseException,
 )
 from megedc.mixers import CeUpDeAtAdminMixser
-from megedc.x6gateapi import EE_RESOLUTION_CHOICES
+from megedc.x6gateapi import EE_RESOLUTION_CHOICES, resolver
 from megedc.x6gateapi.gateway_maker import GatewayMaker
 from pygments import highlight
 from pygments.formatters import HtmlFormatter
@@ -296,6 +297,9 @@ class GatewayAdmin(CeUpDeAtAdminMixser,
 
         def __call__(self, modeladmin, request, queryset):
             queryset.update(enabled=self.disable_value)
+            resolver.invalidate_gateways(
+                list(queryset.values_list('pk', flat=True))
+            )
 
     class enable_action(disable_action):
 
@@ -611,6 +615,9 @@ class DeviceAdmin(CeUpDeAtAdminMixser,
 
         def __call__(self, modeladmin, request, queryset):
             queryset.update(ready=self.ready_value)
+            resolver.invalidate_devices(
+                set(queryset.values_list('gateway_id', flat=True))
+            )
 
     class not_ready_action(ready_action):
 
@@ -841,6 +848,79 @@ class AlertAdmin(CeUpDeAtAdminMixser,
 _for_register.append(('x6gateapi.Alert', AlertAdmin))
 
 
+class RetentionPolicyAdmin(CeUpDeAtAdminMixser,
+                           admin.ModelAdmin):
+
+    fields = [
+        'name',
+        'enabled',
+        'project',
+        'gateway',
+        'raw_days',
+        'hourly_rollup_days',
+        'daily_rollup_days',
+        'created_at',
+        'updated_at',
+    ]
+
+    list_display = [
+        'name',
+        'enabled',
+        'project',
+        'gateway',
+        'raw_days',
+        'hourly_rollup_days',
+        'daily_rollup_days',
+    ]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if not request.user.is_superuser:
+            client = request.user.megeuser.client
+            queryset = queryset.filter(
+                Q(project__client=client) | Q(gateway__project__client=client)
+            )
+        else:
+            chgc_client = request.session.get('chgc_client')
+            if chgc_client:
+                queryset = queryset.filter(
+                    Q(project__client_id=chgc_client)
+                    | Q(gateway__project__client_id=chgc_client)
+                )
+        return queryset
+
+    def get_field_queryset(self, db, db_field, request):
+        queryset = super().get_field_queryset(db, db_field, request)
+        lookup = {
+            'project': 'client',
+            'gateway': 'project__client',
+        }.get(db_field.name)
+        if lookup is not None:
+            if queryset is None:
+                queryset = db_field.remote_field.model.objects.all()
+            queryset = queryset.filter(removed_at__isnull=True)
+            if not request.user.is_superuser:
+                queryset = queryset.filter(**{
+                    lookup: request.user.megeuser.client
+                })
+            else:
+                chgc_client = request.session.get('chgc_client')
+                if chgc_client:
+                    queryset = queryset.filter(**{
+                        lookup + '_id': chgc_client
+                    })
+        return queryset
+
+    def delete_model(self, request, obj):
+        obj.__class__.objects.filter(pk=obj.pk).update(removed_at=localtime())
+
+    def delete_queryset(self, request, queryset):
+        queryset.update(removed_at=localtime())
+
+
+_for_register.append(('x6gateapi.RetentionPolicy', RetentionPolicyAdmin))
+
+
 class RTAlarmAdmin(AdminChangeLinksMixin,
                    admin.ModelAdmin):
 
@@ -885,6 +965,33 @@ class RTAlarmAdmin(AdminChangeLinksMixin,
 _for_register.append(('x6gateapi.RTAlarm', RTAlarmAdmin))
 
 
+class PurgeLogAdmin(admin.ModelAdmin):
+
+    list_display = [
+        'table',
+        'rows',
+        'owned_rows',
+        'removed_before',
+        'started_at',
+        'finished_at',
+    ]
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_module_permission(self, request):
+        return request.user.is_superuser
+
+
+_for_register.append(('x6gateapi.PurgeLog', PurgeLogAdmin))
+
+
 for model_name, admin_class in _for_register:
     model = apps.get_model(model_name)
     if not admin.site.is_registered(model):
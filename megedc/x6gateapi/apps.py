@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class X6GateapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'megedc.x6gateapi'
+
+    def ready(self):
+        from megedc.x6gateapi import signals
+        signals.connect()
@@ -0,0 +1,516 @@
+import os
+import pyarrow
+import pyarrow.dataset
+import pyarrow.parquet
+import tempfile
+from datetime import datetime
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.transaction import atomic
+from django.utils import timezone
+from functools import partial
+from itertools import chain
+from megedc.x6gateapi import rollups
+from megedc.x6gateapi.partitions import month_start
+
+
+ARCHIVE_RTDATA = 'rtdata'
+ARCHIVE_TREND_LOG = 'trendlog'
+
+ARCHIVE_KINDS = [
+    (ARCHIVE_RTDATA, 'Realdata'),
+    (ARCHIVE_TREND_LOG, 'Trend log'),
+]
+
+TIMESTAMP = pyarrow.timestamp('us', tz='UTC')
+
+# A row per node, the frames without nodes have null node columns
+RTDATA_SCHEMA = pyarrow.schema([
+    ('data_id', pyarrow.int64()),
+    ('logdt', pyarrow.string()),
+    ('date_time', TIMESTAMP),
+    ('data_discard', pyarrow.bool_()),
+    ('data_removed_at', TIMESTAMP),
+    ('id', pyarrow.int64()),
+    ('device_id', pyarrow.int32()),
+    ('name', pyarrow.string()),
+    ('value', pyarrow.string()),
+    ('num_value', pyarrow.float64()),
+    ('dblink', pyarrow.string()),
+    ('unit', pyarrow.string()),
+    ('discard', pyarrow.bool_()),
+    ('removed_at', TIMESTAMP),
+])
+
+RTDATA_SQL = (
+    'SELECT f.id, f.logdt, f.date_time, f.discard, f.removed_at, n.id,'
+    ' n.device_id, n.name, n.value, n.num_value,'
+    ' COALESCE(n.dblink, v.dblink), COALESCE(n.unit, v.unit), n.discard,'
+    ' n.removed_at'
+    ' FROM x6gateapi_rtdata f'
+    ' LEFT JOIN x6gateapi_datanone n ON n.data_id = f.id'
+    ' LEFT JOIN x6gateapi_variable v ON v.id = n.variable_id'
+    ' WHERE f.gateway_id = %s AND f.date_time >= %s AND f.date_time < %s'
+    ' AND f.id > %s ORDER BY f.date_time, f.id, n.id'
+)
+
+TREND_LOG_SCHEMA = pyarrow.schema([
+    ('id', pyarrow.int64()),
+    ('device_id', pyarrow.int32()),
+    ('name', pyarrow.string()),
+    ('date_time', TIMESTAMP),
+    ('value', pyarrow.string()),
+    ('num_value', pyarrow.float64()),
+    ('dblink', pyarrow.string()),
+    ('unit', pyarrow.string()),
+    ('removed_at', TIMESTAMP),
+])
+
+TREND_LOG_SQL = (
+    'SELECT t.id, t.device_id, t.name, t.date_time, t.value, t.num_value,'
+    ' t.dblink, COALESCE(t.unit, v.unit), t.removed_at'
+    ' FROM x6gateapi_trendlogdata t'
+    ' JOIN x6gateapi_device d ON d.dev_id = t.device_id'
+    ' LEFT JOIN x6gateapi_variable v ON v.id = t.variable_id'
+    ' WHERE d.gateway_id = %s AND t.date_time >= %s AND t.date_time < %s'
+    ' AND t.id > %s ORDER BY t.date_time, t.id'
+)
+
+MONTHS_SQL = {
+    ARCHIVE_RTDATA: (
+        'SELECT MIN(date_time) FROM x6gateapi_rtdata'
+        ' WHERE gateway_id = %s AND date_time >= %s AND date_time < %s'
+    ),
+    ARCHIVE_TREND_LOG: (
+        'SELECT MIN(t.date_time) FROM x6gateapi_trendlogdata t'
+        ' JOIN x6gateapi_device d ON d.dev_id = t.device_id'
+        ' WHERE d.gateway_id = %s AND t.date_time >= %s'
+        ' AND t.date_time < %s'
+    ),
+}
+
+ARCHIVE_QUERIES = {
+    ARCHIVE_RTDATA: (RTDATA_SCHEMA, RTDATA_SQL, 'data_id'),
+    ARCHIVE_TREND_LOG: (TREND_LOG_SCHEMA, TREND_LOG_SQL, 'id'),
+}
+
+# Ids of the month rows still stored, the pending archives skip them
+LIVE_SQL = {
+    ARCHIVE_RTDATA: (
+        'SELECT n.id FROM x6gateapi_datanone n'
+        ' WHERE n.gateway_id = %(gateway_id)s'
+        ' AND n.date_time >= %(from)s AND n.date_time < %(to)s',
+        'SELECT f.id FROM x6gateapi_rtdata f'
+        ' WHERE f.gateway_id = %(gateway_id)s'
+        ' AND f.date_time >= %(from)s AND f.date_time < %(to)s'
+    ),
+    ARCHIVE_TREND_LOG: (
+        'SELECT t.id FROM x6gateapi_trendlogdata t'
+        ' JOIN x6gateapi_device d ON d.dev_id = t.device_id'
+        ' WHERE d.gateway_id = %(gateway_id)s'
+        ' AND t.date_time >= %(from)s AND t.date_time < %(to)s',
+        None
+    ),
+}
+
+ARCHIVE_SOURCES = {
+    ARCHIVE_RTDATA: rollups.ROLLUP_RTDATA,
+    ARCHIVE_TREND_LOG: rollups.ROLLUP_TREND_LOG,
+}
+
+
+def _fetch(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _fetch_chunks(sql, params, chunk_size):
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def archive_path(archive):
+    return os.path.join(settings.MEGEDC_ARCHIVE_ROOT, archive.path)
+
+
+def read_batches(archive, filters=None, columns=None, batch_size=None):
+    """
+    Read an archive in record batches
+
+    Only the row groups that can match the filters are read.
+
+    :param archive: DataArchive
+    :param filters: pyarrow filters, in the read_table format
+    :param columns: Columns to read, all by default
+    :param batch_size: Maximum rows per batch, by default
+        MEGEDC_ARCHIVE_CHUNK_SIZE
+
+    :returns: Iterator of pyarrow record batches
+    """
+    return pyarrow.dataset.dataset(
+        archive_path(archive), format='parquet'
+    ).to_batches(
+        columns=columns,
+        filter=(
+            pyarrow.parquet.filters_to_expression(filters)
+            if filters else None
+        ),
+        batch_size=batch_size or settings.MEGEDC_ARCHIVE_CHUNK_SIZE
+    )
+
+
+def max_archived_id(archive, column):
+    """
+    Get the maximum id of an archive from the row groups statistics
+    """
+    metadata = pyarrow.parquet.ParquetFile(archive_path(archive)).metadata
+    index = metadata.schema.names.index(column)
+    max_id = 0
+    for group in range(metadata.num_row_groups):
+        statistics = metadata.row_group(group).column(index).statistics
+        if statistics is not None and statistics.has_min_max:
+            max_id = max(max_id, statistics.max)
+    return max_id
+
+
+def write_archive(archive, kind, month, chunk_size):
+    """
+    Write the archive of a month with its new rows to a temporary file
+
+    The rows already archived are copied first, the rows with ids up to
+    the maximum archived id are in the archive already and are skipped.
+
+    :returns: Tuple of the temporary file path, the number of rows, the
+        (dev_id, name) pairs and the rollups hours keys of the new rows, or
+        None if the month has not new rows
+    """
+    schema, sql, id_column = ARCHIVE_QUERIES[kind]
+    path = archive_path(archive)
+    archived = archive.pk is not None and os.path.exists(path)
+    min_id = max_archived_id(archive, id_column) if archived else 0
+    chunks = _fetch_chunks(
+        sql, [archive.gateway_id, month, month_start(month, 1), min_id],
+        chunk_size
+    )
+    rows = next(chunks, None)
+    if rows is None:
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        suffix='.tmp', dir=os.path.dirname(path)
+    )
+    os.close(fd)
+    index = schema.names.index
+    num_rows = 0
+    variables = set()
+    hours_keys = set()
+    try:
+        with pyarrow.parquet.ParquetWriter(
+            tmp_path, schema, compression='zstd'
+        ) as writer:
+            if archived:
+                for batch in read_batches(archive):
+                    writer.write_batch(batch)
+                    num_rows += batch.num_rows
+            while rows:
+                writer.write_batch(pyarrow.RecordBatch.from_pylist(
+                    [dict(zip(schema.names, row)) for row in rows],
+                    schema=schema
+                ))
+                num_rows += len(rows)
+                for row in rows:
+                    if row[index('device_id')] is None or (
+                        not row[index('name')]
+                    ):
+                        continue
+                    variables.add(
+                        (row[index('device_id')], row[index('name')])
+                    )
+                    hours_keys.add((
+                        row[index('device_id')],
+                        row[index('name')],
+                        row[index('date_time')].replace(
+                            minute=0, second=0, microsecond=0
+                        )
+                    ))
+                rows = next(chunks, None)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, num_rows, variables, hours_keys
+
+
+def delete_archived(archive, chunk_size=None):
+    """
+    Delete the stored rows of an archive
+
+    The ids are read from the archive file and deleted a batch at a time,
+    each batch in its own transaction. The frames are deleted with their
+    last node, and the variables stats are computed again at the end.
+
+    :param archive: DataArchive
+    :param chunk_size: Ids per batch, by default MEGEDC_ARCHIVE_CHUNK_SIZE
+
+    :returns: Number of deleted rows
+    """
+    deleted = 0
+    if archive.kind == ARCHIVE_RTDATA:
+        columns = ['id', 'data_id']
+    else:
+        columns = ['id']
+    for batch in read_batches(
+        archive, columns=columns, batch_size=chunk_size
+    ):
+        ids = [x for x in batch.column('id').to_pylist() if x is not None]
+        with atomic():
+            if archive.kind == ARCHIVE_RTDATA:
+                deleted += _execute(
+                    'DELETE FROM x6gateapi_datanone WHERE id = ANY(%s)',
+                    [ids]
+                )
+                deleted += _execute(
+                    'DELETE FROM x6gateapi_rtdata f WHERE f.id = ANY(%s)'
+                    ' AND NOT EXISTS (SELECT 1 FROM x6gateapi_datanone n'
+                    ' WHERE n.data_id = f.id)',
+                    [sorted(set(batch.column('data_id').to_pylist()))]
+                )
+            else:
+                deleted += _execute(
+                    'DELETE FROM x6gateapi_trendlogdata WHERE id = ANY(%s)',
+                    [ids]
+                )
+    if archive.kind == ARCHIVE_RTDATA:
+        rollups.refresh_variables(archive.variables)
+    return deleted
+
+
+def complete_archive(archive, chunk_size=None):
+    """
+    Delete the archived rows of a pending archive and mark it as complete
+    """
+    delete_archived(archive, chunk_size)
+    archive.pending = False
+    archive.save(update_fields=['pending', 'updated_at'])
+
+
+def archive_month(gateway, kind, month, chunk_size=None):
+    """
+    Move the rows of a gateway and month to its archive
+
+    The rows are read with a server side cursor and written in row groups
+    to a temporary file, after the rows of the month already archived. The
+    file replaces the archive before its record is saved, so a committed
+    archive always has its file. The archive is pending, and its readers
+    skip the rows still stored, until the rows are deleted once the
+    archive is committed. The rollups of the archived rows are computed
+    again before the rows are removed.
+
+    :param gateway: Gateway
+    :param kind: Archive kind, one of ARCHIVE_KINDS
+    :param month: UTC month start
+    :param chunk_size: Rows per chunk, by default MEGEDC_ARCHIVE_CHUNK_SIZE
+
+    :returns: DataArchive or None if the month has not rows
+    """
+    chunk_size = chunk_size or settings.MEGEDC_ARCHIVE_CHUNK_SIZE
+    archive_model = apps.get_model('x6gateapi.dataarchive')
+    archive = archive_model.objects.filter(
+        gateway=gateway,
+        kind=kind,
+        month=month
+    ).first()
+    if archive is None:
+        archive = archive_model(
+            gateway=gateway,
+            kind=kind,
+            month=month,
+            path=os.path.join(
+                kind, str(gateway.id), month.strftime('%Y%m.parquet')
+            )
+        )
+    written = write_archive(archive, kind, month, chunk_size)
+    if written is None:
+        if archive.pk is None:
+            return None
+        # Rows left by an interrupted archive
+        complete_archive(archive, chunk_size)
+        return archive
+    tmp_path, num_rows, variables, hours_keys = written
+    try:
+        if archive.pk is not None and not archive.pending:
+            # The replaced file has rows still stored
+            archive.pending = True
+            archive.save(update_fields=['pending', 'updated_at'])
+        os.replace(tmp_path, archive_path(archive))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    with atomic():
+        archive.variables = sorted(
+            set(tuple(x) for x in archive.variables) | variables
+        )
+        archive.rows = num_rows
+        archive.size = os.path.getsize(archive_path(archive))
+        archive.pending = True
+        archive.save()
+        rollups.refresh(ARCHIVE_SOURCES[kind], hours_keys)
+        transaction.on_commit(
+            partial(complete_archive, archive, chunk_size)
+        )
+    return archive
+
+
+def archive_gateway(gateway, before, max_months=None):
+    """
+    Archive the months of a gateway before a date time
+
+    The months are archived from the oldest one, the rows of each month
+    are deleted when it is committed.
+
+    :param gateway: Gateway
+    :param before: UTC month start, older months are archived
+    :param max_months: Maximum number of months per kind, by default
+        MEGEDC_ARCHIVE_MAX_MONTHS
+
+    :returns: List of DataArchive
+    """
+    max_months = max_months or settings.MEGEDC_ARCHIVE_MAX_MONTHS
+    archived = []
+    for kind, _ in ARCHIVE_KINDS:
+        after = datetime.min.replace(tzinfo=timezone.utc)
+        for _ in range(max_months):
+            oldest = _fetch(
+                MONTHS_SQL[kind], [gateway.id, after, before]
+            )[0][0]
+            if oldest is None:
+                break
+            archive = archive_month(gateway, kind, month_start(oldest))
+            if archive is not None:
+                archived.append(archive)
+            after = month_start(oldest, 1)
+    return archived
+
+
+def archive(now=None):
+    """
+    Archive the months older than MEGEDC_ARCHIVE_AFTER_MONTHS
+
+    :param now: Current date time, by default timezone.now()
+
+    :returns: List of DataArchive
+    """
+    if not settings.MEGEDC_ARCHIVE_AFTER_MONTHS:
+        return []
+    before = month_start(
+        now or timezone.now(), -settings.MEGEDC_ARCHIVE_AFTER_MONTHS
+    )
+    archived = []
+    for gateway in apps.get_model('x6gateapi.gateway').objects.iterator():
+        archived.extend(archive_gateway(gateway, before))
+    return archived
+
+
+def iter_archived_rows(kind, gateway_id, from_date_time=None,
+                       to_date_time=None, filters=None, batch_size=None):
+    """
+    Read the archived rows of a gateway, an archive at a time
+
+    Each archive is read in record batches, the rows are in the order
+    they were archived. The rows of a pending archive still stored are
+    skipped, they are read from the database.
+
+    :param kind: Archive kind, one of ARCHIVE_KINDS
+    :param gateway_id: Gateway id
+    :param from_date_time: Rows from this date time, included
+    :param to_date_time: Rows to this date time, included
+    :param filters: Extra pyarrow filters
+    :param batch_size: Maximum rows per batch, by default
+        MEGEDC_ARCHIVE_CHUNK_SIZE
+
+    :returns: Iterator of the row dicts iterators of each archive, sorted
+        by month
+    """
+    archives = apps.get_model('x6gateapi.dataarchive').objects.filter(
+        gateway_id=gateway_id,
+        kind=kind
+    ).order_by('month')
+    filters = list(filters or [])
+    if from_date_time is not None:
+        from_date_time = _aware(from_date_time)
+        archives = archives.filter(month__gte=month_start(from_date_time))
+        filters.append(('date_time', '>=', from_date_time))
+    if to_date_time is not None:
+        to_date_time = _aware(to_date_time)
+        archives = archives.filter(month__lte=to_date_time)
+        filters.append(('date_time', '<=', to_date_time))
+    for archive in archives:
+        rows = _batches_rows(read_batches(
+            archive, filters=filters or None, batch_size=batch_size
+        ))
+        if archive.pending:
+            rows = _skip_live(archive, rows)
+        yield rows
+
+
+def _batches_rows(batches):
+    for batch in batches:
+        yield from batch.to_pylist()
+
+
+def _skip_live(archive, rows):
+    # Nodes by id, the frames without nodes by frame id
+    params = {
+        'gateway_id': archive.gateway_id,
+        'from': archive.month,
+        'to': month_start(archive.month, 1),
+    }
+    rows_sql, frames_sql = LIVE_SQL[archive.kind]
+    live = set(x for x, in _fetch(rows_sql, params))
+    live_frames = set(
+        x for x, in _fetch(frames_sql, params)
+    ) if frames_sql else set()
+    for row in rows:
+        if row['id'] is None:
+            if row.get('data_id') not in live_frames:
+                yield row
+        elif row['id'] not in live:
+            yield row
+
+
+def archived_rows(kind, gateway_id, from_date_time=None, to_date_time=None,
+                  filters=None):
+    """
+    Read the archived rows of a gateway
+
+    :param kind: Archive kind, one of ARCHIVE_KINDS
+    :param gateway_id: Gateway id
+    :param from_date_time: Rows from this date time, included
+    :param to_date_time: Rows to this date time, included
+    :param filters: Extra pyarrow filters
+
+    :returns: Iterator of row dicts, an archive at a time
+    """
+    return chain.from_iterable(iter_archived_rows(
+        kind, gateway_id, from_date_time=from_date_time,
+        to_date_time=to_date_time, filters=filters
+    ))
+
+
+def _aware(date_time):
+    if timezone.is_naive(date_time):
+        return timezone.make_aware(date_time)
+    return date_time.astimezone(timezone.utc)
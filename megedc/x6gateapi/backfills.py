@@ -0,0 +1,146 @@
+import time
+from django.db import connection
+from django.db.transaction import atomic
+from megedc.x6gateapi.ingest import to_num_value
+
+
+NUM_VALUE_TABLES = {
+    'datanone': 'x6gateapi_datanone',
+    'trendlogdata': 'x6gateapi_trendlogdata',
+}
+
+NUM_VALUE_SELECT_SQL = (
+    'SELECT "id", "value" FROM "{table}"'
+    ' WHERE "id" >= %s AND "id" < %s AND "num_value" IS NULL'
+    ' AND "value" IS NOT NULL'
+)
+
+NUM_VALUE_UPDATE_SQL = (
+    'UPDATE "{table}" AS "t" SET "num_value" = "v"."num_value"'
+    ' FROM unnest(%s::bigint[], %s::double precision[])'
+    ' AS "v"("id", "num_value")'
+    ' WHERE "t"."id" = "v"."id"'
+)
+
+NODES_SQL = (
+    'UPDATE "x6gateapi_datanone" AS "node"'
+    ' SET "date_time" = "data"."date_time",'
+    ' "gateway_id" = "data"."gateway_id",'
+    ' "data_discard" = "data"."discard",'
+    ' "data_removed_at" = "data"."removed_at"'
+    ' FROM "x6gateapi_rtdata" AS "data"'
+    ' WHERE "data"."id" = "node"."data_id"'
+    ' AND "node"."id" >= %s AND "node"."id" < %s'
+    ' AND ("node"."date_time" IS NULL OR "node"."gateway_id" IS NULL)'
+)
+
+
+def _fetch(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def backfill_table(table, pending_sql, update_chunk, chunk_size=10000,
+                   sleep=0.0, progress=None):
+    """
+    Update the rows of a table by id ranges
+
+    Each range is updated in its own transaction, from the first pending
+    row to the last row of the table.
+
+    :param table: Table name
+    :param pending_sql: SQL condition of the rows to update
+    :param update_chunk: Function updating the rows of an id range, it gets
+        the first and the next to last id and returns the updated rows
+    :param chunk_size: Number of ids updated per transaction
+    :param sleep: Seconds to wait between chunks
+    :param progress: Function called with the first id of each chunk and
+        the last id
+
+    :returns: Number of updated rows
+    """
+    first = _fetch('SELECT min("id") FROM "%s" WHERE %s' % (
+        table, pending_sql
+    ))[0][0]
+    if first is None:
+        return 0
+    last = _fetch('SELECT max("id") FROM "%s"' % (table))[0][0]
+    updated = 0
+    for start_id in range(first, last + 1, chunk_size):
+        with atomic():
+            updated += update_chunk(start_id, start_id + chunk_size)
+        if progress is not None:
+            progress(start_id, last)
+        if sleep:
+            time.sleep(sleep)
+    return updated
+
+
+def backfill_num_value(table, chunk_size=10000, sleep=0.0, progress=None):
+    """
+    Fill the num_value of the stored rows of a table
+
+    The values are parsed with to_num_value, so the values that are not
+    finite numbers are left as NULL like in the ingest.
+
+    :param table: Table name, one of NUM_VALUE_TABLES
+    :param chunk_size: Number of ids updated per transaction
+    :param sleep: Seconds to wait between chunks
+    :param progress: Function called with the first id of each chunk and
+        the last id
+
+    :returns: Number of updated rows
+    """
+    def update_chunk(start_id, end_id):
+        ids = []
+        num_values = []
+        for pk, value in _fetch(
+            NUM_VALUE_SELECT_SQL.format(table=table), [start_id, end_id]
+        ):
+            num_value = to_num_value(value)
+            if num_value is not None:
+                ids.append(pk)
+                num_values.append(num_value)
+        if not ids:
+            return 0
+        return _execute(
+            NUM_VALUE_UPDATE_SQL.format(table=table), [ids, num_values]
+        )
+
+    return backfill_table(
+        table,
+        '"num_value" IS NULL AND "value" IS NOT NULL',
+        update_chunk,
+        chunk_size,
+        sleep,
+        progress
+    )
+
+
+def backfill_nodes(chunk_size=10000, sleep=0.0, progress=None):
+    """
+    Copy the frame date time, gateway, discard and removal of the stored
+    nodes
+
+    :param chunk_size: Number of ids updated per transaction
+    :param sleep: Seconds to wait between chunks
+    :param progress: Function called with the first id of each chunk and
+        the last id
+
+    :returns: Number of updated rows
+    """
+    return backfill_table(
+        'x6gateapi_datanone',
+        '("date_time" IS NULL OR "gateway_id" IS NULL)',
+        lambda start_id, end_id: _execute(NODES_SQL, [start_id, end_id]),
+        chunk_size,
+        sleep,
+        progress
+    )
@@ -0,0 +1,701 @@
+import hashlib
+import math
+import re
+from datetime import datetime, timedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.db.transaction import atomic, on_commit
+from megedc.x6gateapi import resolver, tasks
+
+
+# Margin used to match already stored frames by logdt, live frames are
+# stored with the reception date time instead of the logdt one.
+LOGDT_MATCH_MARGIN = timedelta(days=1)
+
+
+# Numeric values, same pattern than the backfill SQL
+NUM_VALUE_REGEX = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+NUM_VALUE_RE = re.compile(NUM_VALUE_REGEX)
+
+
+# Stats of the new nodes merged into their variables, only the changed
+# variables are updated
+VARIABLES_STATS_SQL = (
+    'UPDATE x6gateapi_variable v SET'
+    ' first_seen = LEAST(v.first_seen, s.first_seen),'
+    ' last_seen = GREATEST(v.last_seen, s.last_seen),'
+    ' has_valid_nodes = v.has_valid_nodes OR s.has_valid,'
+    ' has_discarded_nodes = v.has_discarded_nodes OR s.has_discarded'
+    ' FROM UNNEST(%s::integer[], %s::timestamptz[], %s::timestamptz[],'
+    ' %s::boolean[], %s::boolean[])'
+    ' AS s(id, first_seen, last_seen, has_valid, has_discarded)'
+    ' WHERE v.id = s.id AND ('
+    'v.first_seen IS NULL OR v.first_seen > s.first_seen'
+    ' OR v.last_seen < s.last_seen'
+    ' OR (s.has_valid AND NOT v.has_valid_nodes)'
+    ' OR (s.has_discarded AND NOT v.has_discarded_nodes))'
+)
+
+
+def to_num_value(value):
+    """
+    Parse a raw gateway value
+
+    :param value: Raw value string
+
+    :returns: Float value or None if it is not a finite number
+    """
+    if value is None or not NUM_VALUE_RE.match(str(value)):
+        return None
+    num_value = float(value)
+    if not math.isfinite(num_value):
+        return None
+    return num_value
+
+
+def device_key(device_data):
+    """
+    Make the (channel, id) key of a device payload
+
+    :param device_data: Dict with the device channel and id
+
+    :returns: Tuple with channel and id as strings
+    """
+    channel = device_data.get('channel')
+    dev_id = device_data.get('id')
+    return (
+        str(channel) if channel is not None else None,
+        str(dev_id) if dev_id is not None else None,
+    )
+
+
+def resolve_devices(gateway, devices_names):
+    """
+    Get the gateway devices, bulk creating the missing ones
+
+    :param gateway: Gateway instance
+    :param devices_names: Dict of (channel, id) keys with the name to use
+        when the device does not exist
+
+    :returns: Dict of (channel, id) keys with Device instances
+    """
+    device_model = apps.get_model('x6gateapi.device')
+    devices = resolver.get_devices(gateway)
+    missing = [key for key in devices_names if key not in devices]
+    if missing:
+        device_model.objects.bulk_create(
+            [
+                device_model(
+                    gateway=gateway,
+                    channel=channel,
+                    id=dev_id,
+                    name=devices_names[(channel, dev_id)],
+                )
+                for channel, dev_id in missing
+            ],
+            ignore_conflicts=True
+        )
+        # Concurrent requests can create the same devices, load them back
+        resolver.invalidate_devices([gateway.id])
+        devices = resolver.get_devices(gateway)
+    return devices
+
+
+def new_variable(rows):
+    """
+    Make the variable of its first data rows
+
+    The realdata nodes stats of a new variable are the ones of its first
+    nodes, so it is exported before the rollups update computes them.
+
+    :param rows: DataNone or TrendLogData instances of the variable
+
+    :returns: Variable instance not saved yet
+    """
+    row = rows[0]
+    variable = apps.get_model('x6gateapi.variable')(
+        device_id=row.device_id,
+        name=row.name,
+        dblink=row.dblink,
+        unit=row.raw_unit,
+    )
+    nodes = [
+        x for x in rows
+        if isinstance(x, apps.get_model('x6gateapi.datanone'))
+    ]
+    if nodes:
+        dates = [x.date_time for x in nodes if x.date_time is not None]
+        variable.first_seen = min(dates, default=None)
+        variable.last_seen = max(dates, default=None)
+        variable.has_valid_nodes = any(not x.discard for x in nodes)
+        variable.has_discarded_nodes = any(x.discard for x in nodes)
+    return variable
+
+
+def link_variables(gateway, rows):
+    """
+    Link data rows to their variables, bulk creating the missing ones
+
+    The new variables are made by new_variable, the rows only keep the
+    dblink and unit that differ from the variable ones. The variables are
+    read from the database when the resolver cache is not available.
+
+    :param gateway: Gateway instance
+    :param rows: DataNone or TrendLogData instances not saved yet
+    """
+    variables = resolver.get_variables(gateway)
+    missing = {}
+    for row in rows:
+        key = (row.device_id, row.name)
+        if row.name and key not in variables:
+            missing.setdefault(key, []).append(row)
+    if missing:
+        apps.get_model('x6gateapi.variable').objects.bulk_create(
+            [new_variable(key_rows) for key_rows in missing.values()],
+            ignore_conflicts=True
+        )
+        # Concurrent requests can create the same variables, load them back
+        resolver.invalidate_variables([gateway.id])
+        variables = resolver.get_variables(gateway)
+    for row in rows:
+        variable = variables.get((row.device_id, row.name))
+        if variable is not None:
+            row.set_variable(variable)
+
+
+def update_variables(gateway, nodes):
+    """
+    Merge the stats of new realdata nodes into their variables
+
+    The first and last seen and whether there are valid or discarded nodes
+    are updated with one statement, so the variables created by trend logs
+    or by discarded nodes are exported as soon as they have the nodes.
+    The gateway variables, with the catalog, are invalidated when the
+    valid or discarded flags change. The rollups compute all the stats
+    again.
+
+    :param gateway: Gateway instance
+    :param nodes: Saved DataNone instances linked to their variables
+    """
+    stats = {}
+    for node in nodes:
+        if node.variable is None or node.date_time is None:
+            continue
+        variable_stats = stats.get(node.variable.id)
+        if variable_stats is None:
+            stats[node.variable.id] = [
+                node.date_time, node.date_time,
+                not node.discard, node.discard, node.variable
+            ]
+            continue
+        variable_stats[0] = min(variable_stats[0], node.date_time)
+        variable_stats[1] = max(variable_stats[1], node.date_time)
+        variable_stats[2] = variable_stats[2] or not node.discard
+        variable_stats[3] = variable_stats[3] or node.discard
+    if not stats:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(VARIABLES_STATS_SQL, [
+            list(stats),
+            *([x[index] for x in stats.values()] for index in range(4))
+        ])
+    if any(
+        (has_valid and not variable.has_valid_nodes)
+        or (has_discarded and not variable.has_discarded_nodes)
+        for _, _, has_valid, has_discarded, variable in stats.values()
+    ):
+        resolver.invalidate_variables([gateway.id])
+
+
+def _make_nodes(devices, rt_data, devices_data):
+    datanode_model = apps.get_model('x6gateapi.datanone')
+    nodes = []
+    for device_data in devices_data:
+        device = devices[device_key(device_data)]
+        for node in device_data.get('node', []):
+            nodes.append(datanode_model(
+                dblink=node.get('dblink'),
+                name=node.get('name'),
+                value=node.get('value'),
+                num_value=to_num_value(node.get('value')),
+                unit=node.get('unit'),
+                device=device,
+                data=rt_data,
+                date_time=rt_data.date_time,
+                gateway_id=rt_data.gateway_id,
+                data_discard=rt_data.discard,
+                discard=(not device.ready)
+            ))
+    return nodes
+
+
+def _frames_devices_names(frames):
+    devices_names = {}
+    for frame in frames:
+        for device_data in frame.get('device', []):
+            devices_names[device_key(device_data)] = 'no name'
+    return devices_names
+
+
+def ingest_rtdata(gateway, data):
+    """
+    Store one realdata frame with all its nodes
+
+    :param gateway: Gateway instance
+    :param data: Realdata payload with the logdt and the devices nodes
+
+    :returns: Created RTData instance
+    """
+    rt_data = gateway.data.create(
+        logdt=data.get('logdt'),
+        gateway=gateway
+    )
+    devices_data = data.get('device', [])
+    devices = resolve_devices(gateway, _frames_devices_names([data]))
+    nodes = _make_nodes(devices, rt_data, devices_data)
+    link_variables(gateway, nodes)
+    apps.get_model('x6gateapi.datanone').objects.bulk_create(nodes)
+    update_variables(gateway, nodes)
+    return rt_data
+
+
+def ingest_rtdata_frames(gateway, dated_frames):
+    """
+    Store many realdata frames received at known date times
+
+    All the frames and all their nodes are inserted with one statement each.
+
+    :param gateway: Gateway instance
+    :param dated_frames: List of (date_time, payload) tuples
+
+    :returns: List of created RTData instances
+    """
+    rtdata_model = apps.get_model('x6gateapi.rtdata')
+    devices = resolve_devices(
+        gateway, _frames_devices_names([x[1] for x in dated_frames])
+    )
+    rt_datas = rtdata_model.objects.bulk_create([
+        rtdata_model(
+            logdt=frame.get('logdt'),
+            date_time=date_time,
+            gateway=gateway
+        )
+        for date_time, frame in dated_frames
+    ])
+    nodes = []
+    for rt_data, (_, frame) in zip(rt_datas, dated_frames):
+        nodes.extend(_make_nodes(devices, rt_data, frame.get('device', [])))
+    link_variables(gateway, nodes)
+    apps.get_model('x6gateapi.datanone').objects.bulk_create(nodes)
+    update_variables(gateway, nodes)
+    return rt_datas
+
+
+def ingest_alarms(gateway, data):
+    """
+    Store the alarms nodes of an alarm payload
+
+    All the alarms are inserted with one statement. If
+    MEGEDC_X6GATEAPI_ALARM_ALERTS is enabled the matching alerts are sent by
+    a Celery task once the transaction is committed.
+
+    :param gateway: Gateway instance
+    :param data: Alarm payload with the alarms nodes
+
+    :returns: List of created RTAlarm instances
+    """
+    rtalarm_model = apps.get_model('x6gateapi.rtalarm')
+    nodes_data = data.get('node', [])
+    devices = resolve_devices(
+        gateway,
+        {device_key(node_data): 'no name' for node_data in nodes_data}
+    )
+    rt_alarms = rtalarm_model.objects.bulk_create([
+        rtalarm_model(
+            logdt=node_data.get('logdt'),
+            name=node_data.get('name'),
+            value=node_data.get('value'),
+            threadhold_value=node_data.get('threadhold_value'),
+            unit=node_data.get('unit'),
+            type=node_data.get('type'),
+            flag=node_data.get('flag'),
+            device=devices[device_key(node_data)]
+        )
+        for node_data in nodes_data
+    ])
+    if rt_alarms and settings.MEGEDC_X6GATEAPI_ALARM_ALERTS:
+        alarm_ids = [rt_alarm.id for rt_alarm in rt_alarms]
+        on_commit(lambda: tasks.send_alarms_alerts.delay(alarm_ids))
+    return rt_alarms
+
+
+def ingest_trend_log(gateway, data, chunk_size=None):
+    """
+    Store the trend log points of a trend log payload
+
+    Points are deduplicated in memory and inserted by chunks ignoring the
+    ones already stored for the same device, dblink and date time.
+
+    :param gateway: Gateway instance
+    :param data: Trend log payload with the devices trend logs
+    :param chunk_size: Points per insert statement
+    """
+    if chunk_size is None:
+        chunk_size = settings.MEGEDC_X6GATEAPI_BATCH_CHUNK_SIZE
+    trendlog_model = apps.get_model('x6gateapi.trendlogdata')
+    devices_data = data.get('device', [])
+    devices = resolve_devices(
+        gateway,
+        {
+            device_key(device_data): device_data.get('name', 'no_name')
+            for device_data in devices_data
+        }
+    )
+    gateway_tz = gateway.timezone
+    date_times = {}
+    points = {}
+    for device_data in devices_data:
+        device = devices[device_key(device_data)]
+        for trendlog in device_data.get('trendlog', []):
+            dblink = trendlog.get('dblink')
+            for node in trendlog.get('data', []):
+                str_date_time = node.get('date_time')
+                date_time = date_times.get(str_date_time)
+                if date_time is None:
+                    date_time = gateway_tz.localize(
+                        datetime.fromisoformat(str_date_time)
+                    )
+                    date_times[str_date_time] = date_time
+                key = (device.dev_id, dblink, date_time)
+                if key in points:
+                    continue
+                points[key] = trendlog_model(
+                    device=device,
+                    date_time=date_time,
+                    dblink=dblink,
+                    name=trendlog.get('name'),
+                    value=node.get('value'),
+                    num_value=to_num_value(node.get('value')),
+                    unit=node.get('unit'),
+                )
+
+    # NULL dblinks are not unique for the database, skip stored ones here
+    null_dblink_keys = [key for key in points if key[1] is None]
+    if null_dblink_keys:
+        stored = trendlog_model.objects.filter(
+            device_id__in=set(key[0] for key in null_dblink_keys),
+            dblink__isnull=True,
+            date_time__in=set(key[2] for key in null_dblink_keys),
+        ).values_list('device_id', 'date_time')
+        for device_id, date_time in stored:
+            points.pop((device_id, None, date_time), None)
+
+    link_variables(gateway, list(points.values()))
+    trendlog_model.objects.bulk_create(
+        points.values(),
+        batch_size=chunk_size,
+        ignore_conflicts=True
+    )
+
+
+INGEST_RTDATA = 'rtdata'
+INGEST_ALARM = 'alarm'
+INGEST_TREND_LOG = 'trendlog'
+INGEST_RTDATA_BATCH = 'rtdatabatch'
+
+INGEST_KINDS = [
+    (INGEST_RTDATA, 'Realdata'),
+    (INGEST_ALARM, 'Alarm'),
+    (INGEST_TREND_LOG, 'Trend log'),
+    (INGEST_RTDATA_BATCH, 'Realdata batch'),
+]
+
+
+def ingest(gateway, kind, data):
+    """
+    Store a gateway payload
+
+    :param gateway: Gateway instance
+    :param kind: Payload kind, one of INGEST_KINDS
+    :param data: Payload
+    """
+    with resolver.devices_guard(gateway):
+        return INGESTERS[kind](gateway, data)
+
+
+def enqueue(gateway, kind, data):
+    """
+    Append a gateway payload to the ingest queue
+
+    :param gateway: Gateway instance
+    :param kind: Payload kind, one of INGEST_KINDS
+    :param data: Payload
+
+    :returns: Created IngestItem instance
+    """
+    return apps.get_model('x6gateapi.ingestitem').objects.create(
+        kind=kind,
+        payload=data,
+        gateway=gateway
+    )
+
+
+IDEMPOTENCY_KEY = 'x6gateapi_idempotency_%s_%s_%s'
+IDEMPOTENCY_PENDING = 'pending'
+IDEMPOTENCY_DONE = 'done'
+
+
+def idempotency_key(gateway, kind, data, header_key=None):
+    """
+    Make the idempotency cache key of a gateway payload
+
+    The Idempotency-Key header is used if it is given, otherwise the payload
+    logdt.
+
+    :param gateway: Gateway instance
+    :param kind: Payload kind, one of INGEST_KINDS
+    :param data: Payload
+    :param header_key: Idempotency-Key header value
+
+    :returns: Cache key or None if the payload can not be identified
+    """
+    if not settings.MEGEDC_X6GATEAPI_IDEMPOTENCY_TIMEOUT:
+        return None
+    key = header_key
+    if not key and isinstance(data, dict):
+        key = data.get('logdt')
+    if not key:
+        return None
+    key = hashlib.sha1(str(key).encode()).hexdigest()
+    return IDEMPOTENCY_KEY % (gateway.id, kind, key)
+
+
+def idempotency_claim(key):
+    """
+    Claim an idempotency key before storing its payload
+
+    :param key: Cache key from idempotency_key
+
+    :returns: None if claimed, IDEMPOTENCY_PENDING if other request is
+        storing the payload or IDEMPOTENCY_DONE if it is already stored
+    """
+    if cache.add(
+        key,
+        IDEMPOTENCY_PENDING,
+        settings.MEGEDC_X6GATEAPI_IDEMPOTENCY_TIMEOUT
+    ):
+        return None
+    return cache.get(key, IDEMPOTENCY_PENDING)
+
+
+def idempotency_done(key):
+    cache.set(
+        key,
+        IDEMPOTENCY_DONE,
+        settings.MEGEDC_X6GATEAPI_IDEMPOTENCY_TIMEOUT
+    )
+
+
+def idempotency_release(key):
+    cache.delete(key)
+
+
+def _ingest_items(gateway, items):
+    rtdata_frames = []
+    with resolver.devices_guard(gateway):
+        for item in items:
+            if item.kind == INGEST_RTDATA:
+                # Frames keep the reception date time like in the sync mode
+                rtdata_frames.append((item.created_at, item.payload))
+            else:
+                ingest(gateway, item.kind, item.payload)
+        if rtdata_frames:
+            ingest_rtdata_frames(gateway, rtdata_frames)
+
+
+def drain_gateway_queue(gateway, limit=None):
+    """
+    Store a batch of the gateway queued payloads
+
+    The batch is written in one transaction, if it fails each item is
+    retried alone and the failing ones are kept in the queue with the error.
+
+    :param gateway: Gateway instance
+    :param limit: Max items of the batch
+
+    :returns: Tuple with the number of stored and failed items
+    """
+    if limit is None:
+        limit = settings.MEGEDC_X6GATEAPI_INGEST_DRAIN_SIZE
+    item_model = apps.get_model('x6gateapi.ingestitem')
+    with atomic():
+        items = list(
+            item_model.objects.select_for_update(skip_locked=True).filter(
+                gateway=gateway,
+                error__isnull=True
+            ).order_by('id')[:limit]
+        )
+        if not items:
+            return (0, 0)
+        failed = []
+        try:
+            with atomic():
+                _ingest_items(gateway, items)
+        except Exception:
+            for item in items:
+                try:
+                    with atomic():
+                        _ingest_items(gateway, [item])
+                except Exception as exce:
+                    item.error = str(exce)
+                    failed.append(item)
+        if failed:
+            item_model.objects.bulk_update(failed, ['error'])
+        failed_ids = set(item.id for item in failed)
+        item_model.objects.filter(
+            id__in=[item.id for item in items if item.id not in failed_ids]
+        ).delete()
+    return (len(items) - len(failed), len(failed))
+
+
+def drain_queue(gateway_id=None, limit=None):
+    """
+    Store the queued payloads grouped by gateway until the queue is empty
+
+    :param gateway_id: Only drain the queue of this gateway
+    :param limit: Max items of each batch
+
+    :returns: Dict of gateway ids with the stored and failed items
+    """
+    item_model = apps.get_model('x6gateapi.ingestitem')
+    gateway_model = apps.get_model('x6gateapi.gateway')
+    queryset = item_model.objects.filter(error__isnull=True)
+    if gateway_id is not None:
+        queryset = queryset.filter(gateway_id=gateway_id)
+    gateway_ids = set(queryset.values_list('gateway_id', flat=True))
+    ret = {}
+    for gateway in gateway_model.objects.filter(id__in=gateway_ids):
+        stored = failed = 0
+        while True:
+            b_stored, b_failed = drain_gateway_queue(gateway, limit)
+            if not b_stored and not b_failed:
+                break
+            stored += b_stored
+            failed += b_failed
+        ret[gateway.id] = {'stored': stored, 'failed': failed}
+    return ret
+
+
+def logdt_date_time(gateway_tz, logdt):
+    """
+    Make the aware date time of a gateway logdt
+
+    :param gateway_tz: Gateway timezone
+    :param logdt: Gateway local date time string
+
+    :returns: Aware datetime
+
+    :raises ValueError: If logdt is not a valid date time
+    """
+    if not isinstance(logdt, str):
+        raise ValueError('Invalid logdt "%s"' % (logdt))
+    return gateway_tz.localize(datetime.fromisoformat(logdt))
+
+
+def ingest_rtdata_batch(gateway, frames, chunk_size=None):
+    """
+    Store many realdata frames, skipping the ones already stored
+
+    The RTData date_time of each frame is taken from its logdt. A frame is
+    a duplicate if the gateway already has data with the same date time or
+    with the same logdt. Each chunk of frames is written in its own
+    transaction.
+
+    :param gateway: Gateway instance
+    :param frames: List of realdata payloads
+    :param chunk_size: Frames per transaction
+
+    :returns: Tuple with the number of created and duplicated frames
+
+    :raises ValueError: If any frame has an invalid logdt
+    """
+    if chunk_size is None:
+        chunk_size = settings.MEGEDC_X6GATEAPI_BATCH_CHUNK_SIZE
+    gateway_tz = gateway.timezone
+    rtdata_model = apps.get_model('x6gateapi.rtdata')
+    datanode_model = apps.get_model('x6gateapi.datanone')
+
+    dated_frames = {}
+    for frame in frames:
+        if not isinstance(frame, dict):
+            raise ValueError('Invalid frame "%s"' % (frame))
+        date_time = logdt_date_time(gateway_tz, frame.get('logdt'))
+        dated_frames.setdefault(date_time, frame)
+    duplicated = len(frames) - len(dated_frames)
+
+    devices = resolve_devices(
+        gateway, _frames_devices_names(dated_frames.values())
+    )
+
+    created = 0
+    dated_frames = sorted(dated_frames.items(), key=lambda item: item[0])
+    for i in range(0, len(dated_frames), chunk_size):
+        chunk = dict(dated_frames[i:i + chunk_size])
+        with atomic():
+            logdts = [frame.get('logdt') for frame in chunk.values()]
+            existing = gateway.data.filter(
+                Q(date_time__in=chunk.keys())
+                | Q(
+                    logdt__in=logdts,
+                    date_time__range=(
+                        min(chunk) - LOGDT_MATCH_MARGIN,
+                        max(chunk) + LOGDT_MATCH_MARGIN,
+                    )
+                )
+            ).values_list('date_time', 'logdt')
+            existing_dts = set()
+            existing_logdts = set()
+            for date_time, logdt in existing:
+                existing_dts.add(date_time)
+                existing_logdts.add(logdt)
+
+            new_frames = []
+            for date_time, frame in chunk.items():
+                if (
+                    date_time in existing_dts
+                    or frame.get('logdt') in existing_logdts
+                ):
+                    duplicated += 1
+                    continue
+                new_frames.append((
+                    rtdata_model(
+                        logdt=frame.get('logdt'),
+                        date_time=date_time,
+                        gateway=gateway
+                    ),
+                    frame
+                ))
+            if not new_frames:
+                continue
+
+            rtdata_model.objects.bulk_create([x[0] for x in new_frames])
+            nodes = []
+            for rt_data, frame in new_frames:
+                nodes.extend(
+                    _make_nodes(devices, rt_data, frame.get('device', []))
+                )
+            link_variables(gateway, nodes)
+            datanode_model.objects.bulk_create(nodes, batch_size=chunk_size)
+            created += len(new_frames)
+    return (created, duplicated)
+
+
+INGESTERS = {
+    INGEST_RTDATA: ingest_rtdata,
+    INGEST_ALARM: ingest_alarms,
+    INGEST_TREND_LOG: ingest_trend_log,
+    INGEST_RTDATA_BATCH: ingest_rtdata_batch,
+}
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from megedc.x6gateapi.backfills import backfill_nodes
+
+
+class Command(BaseCommand):
+
+    help = 'Copy the frame date time, gateway and discard of stored nodes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-c', '--chunk-size', type=int, default=10000,
+            help='Number of ids updated per transaction'
+        )
+        parser.add_argument(
+            '-s', '--sleep', type=float, default=0.0,
+            help='Seconds to wait between chunks'
+        )
+
+    def handle(self, *args, **options):
+        def progress(start_id, last):
+            if options['verbosity'] > 1:
+                self.stdout.write('%s / %s' % (start_id, last))
+
+        updated = backfill_nodes(
+            options['chunk_size'], options['sleep'], progress
+        )
+        self.stdout.write('%s nodes updated' % (updated))
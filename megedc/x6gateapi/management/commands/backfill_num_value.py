@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from megedc.x6gateapi.backfills import NUM_VALUE_TABLES, backfill_num_value
+
+
+class Command(BaseCommand):
+
+    help = 'Fill num_value of stored data nodes and trend log data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-m', '--model', choices=list(NUM_VALUE_TABLES), action='append',
+            help='Model to backfill, all by default'
+        )
+        parser.add_argument(
+            '-c', '--chunk-size', type=int, default=10000,
+            help='Number of ids updated per transaction'
+        )
+        parser.add_argument(
+            '-s', '--sleep', type=float, default=0.0,
+            help='Seconds to wait between chunks'
+        )
+
+    def handle(self, *args, **options):
+        for name in options['model'] or list(NUM_VALUE_TABLES):
+            table = NUM_VALUE_TABLES[name]
+
+            def progress(start_id, last):
+                if options['verbosity'] > 1:
+                    self.stdout.write('%s: %s / %s' % (table, start_id, last))
+
+            updated = backfill_num_value(
+                table,
+                options['chunk_size'],
+                options['sleep'],
+                progress
+            )
+            self.stdout.write('%s: %s rows updated' % (name, updated))
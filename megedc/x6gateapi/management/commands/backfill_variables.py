@@ -0,0 +1,139 @@
+import time
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.transaction import atomic
+from megedc.x6gateapi import rollups
+
+
+VARIABLES_SQL = (
+    'INSERT INTO "x6gateapi_variable"'
+    ' ("device_id", "name", "dblink", "unit", "created_at", "nodes_count",'
+    ' "has_valid_nodes", "has_discarded_nodes")'
+    ' SELECT DISTINCT ON ("device_id", "name")'
+    ' "device_id", "name", "dblink", "unit", NOW(), 0, FALSE, FALSE'
+    ' FROM "{table}" WHERE "device_id" = %s AND "name" IS NOT NULL'
+    ' AND "name" <> \'\' AND "variable_id" IS NULL'
+    ' ORDER BY "device_id", "name", "id"'
+    ' ON CONFLICT ("device_id", "name") DO NOTHING'
+)
+
+LINK_SQL = (
+    'UPDATE "{table}" AS "row" SET "variable_id" = "var"."id", {columns}'
+    ' FROM "x6gateapi_variable" AS "var"'
+    ' WHERE "var"."device_id" = "row"."device_id"'
+    ' AND "var"."name" = "row"."name"'
+    ' AND "row"."id" >= %s AND "row"."id" < %s'
+    ' AND "row"."variable_id" IS NULL'
+)
+
+# The row keeps the value only if it differs from the variable one
+COLUMN_SQL = (
+    '"{column}" = CASE WHEN "row"."{column}" IS NOT DISTINCT FROM'
+    ' "var"."{column}" THEN NULL ELSE "row"."{column}" END'
+)
+
+
+class Command(BaseCommand):
+
+    help = 'Create the variables of stored data and link the rows to them'
+
+    models = {
+        'datanone': 'x6gateapi.datanone',
+        'trendlogdata': 'x6gateapi.trendlogdata',
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-m', '--model', choices=list(self.models), action='append',
+            help='Model to backfill, all by default'
+        )
+        parser.add_argument(
+            '-c', '--chunk-size', type=int, default=10000,
+            help='Number of ids updated per transaction'
+        )
+        parser.add_argument(
+            '-s', '--sleep', type=float, default=0.0,
+            help='Seconds to wait between chunks'
+        )
+
+    @atomic
+    def _execute(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def create_variables(self, model):
+        created = 0
+        sql = VARIABLES_SQL.format(table=model._meta.db_table)
+        devices_ids = apps.get_model('x6gateapi.device').objects.values_list(
+            'dev_id', flat=True
+        )
+        for device_id in devices_ids.iterator():
+            created += self._execute(sql, [device_id])
+        return created
+
+    def link_variables(self, model, chunk_size, sleep):
+        queryset = model.objects.filter(variable__isnull=True)
+        first = queryset.order_by('id').values_list('id', flat=True).first()
+        if first is None:
+            return 0
+        last = model.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first()
+        table = model._meta.db_table
+        sql = LINK_SQL.format(
+            table=table,
+            columns=', '.join(
+                COLUMN_SQL.format(column=column)
+                for column in model.variable_fields
+            )
+        )
+        updated = 0
+        for start_id in range(first, last + 1, chunk_size):
+            updated += self._execute(sql, [start_id, start_id + chunk_size])
+            if self.verbosity > 1:
+                self.stdout.write('%s: %s / %s' % (table, start_id, last))
+            if sleep:
+                time.sleep(sleep)
+        return updated
+
+    def update_stats(self, chunk_size, sleep):
+        variables = apps.get_model('x6gateapi.variable').objects.order_by(
+            'id'
+        ).values_list('device_id', 'name')
+        updated = 0
+        keys = []
+        for key in variables.iterator(chunk_size=chunk_size):
+            keys.append(key)
+            if len(keys) < chunk_size:
+                continue
+            with atomic():
+                rollups.refresh_variables(keys)
+            updated += len(keys)
+            keys = []
+            if sleep:
+                time.sleep(sleep)
+        if keys:
+            with atomic():
+                rollups.refresh_variables(keys)
+            updated += len(keys)
+        return updated
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        for name in options['model'] or list(self.models):
+            model = apps.get_model(self.models[name])
+            created = self.create_variables(model)
+            updated = self.link_variables(
+                model, options['chunk_size'], options['sleep']
+            )
+            self.stdout.write('%s: %s variables created, %s rows linked' % (
+                name, created, updated
+            ))
+            if name == 'datanone':
+                self.stdout.write('%s: %s variables stats updated' % (
+                    name, self.update_stats(
+                        options['chunk_size'], options['sleep']
+                    )
+                ))
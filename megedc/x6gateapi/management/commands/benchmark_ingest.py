@@ -0,0 +1,325 @@
+import random
+import time
+from datetime import datetime, timedelta
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+
+# Synthesized rows, children first, with the lookup to their gateway
+CLEANUP_MODELS = [
+    ('x6gateapi.datanone', 'device__gateway__in'),
+    ('x6gateapi.trendlogdata', 'device__gateway__in'),
+    ('x6gateapi.rtalarm', 'device__gateway__in'),
+    ('x6gateapi.hourlyrollup', 'device__gateway__in'),
+    ('x6gateapi.dailyrollup', 'device__gateway__in'),
+    ('x6gateapi.rolluppending', 'device__gateway__in'),
+    ('x6gateapi.variable', 'device__gateway__in'),
+    ('x6gateapi.rtdata', 'gateway__in'),
+    ('x6gateapi.ingestitem', 'gateway__in'),
+    ('x6gateapi.device', 'gateway__in'),
+]
+
+
+class Stats():
+
+    def __init__(self):
+        self.latencies = []
+        self.queries = 0
+        self.rows = 0
+        self.errors = 0
+
+    def add(self, latency, queries, rows, ok):
+        self.latencies.append(latency)
+        self.queries += queries
+        self.rows += rows if ok else 0
+        self.errors += 0 if ok else 1
+
+    def percentile(self, value):
+        latencies = sorted(self.latencies)
+        index = round((len(latencies) - 1) * value / 100)
+        return latencies[index]
+
+    def row(self, name):
+        requests = len(self.latencies)
+        total = sum(self.latencies)
+        return [
+            name,
+            str(requests),
+            str(self.errors),
+            '%.1f' % (requests / total if total else 0),
+            '%.2f' % (self.percentile(50) * 1000),
+            '%.2f' % (self.percentile(99) * 1000),
+            '%.1f' % (self.queries / requests),
+            '%.1f' % (self.rows / total if total else 0),
+        ]
+
+
+class Command(BaseCommand):
+
+    help = 'Benchmark the x6gateapi ingestion endpoints'
+
+    url_names = [
+        'gateway-create',
+        'device-create',
+        'rtdata-create',
+        'alarmdata-create',
+        'trendlogdata-create',
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--projects', type=int, default=2,
+            help='Number of projects to synthesize'
+        )
+        parser.add_argument(
+            '--gateways', type=int, default=2,
+            help='Number of gateways per project'
+        )
+        parser.add_argument(
+            '--devices', type=int, default=10,
+            help='Number of devices per gateway'
+        )
+        parser.add_argument(
+            '--nodes', type=int, default=20,
+            help='Number of variables per device'
+        )
+        parser.add_argument(
+            '--frames', type=int, default=20,
+            help='Number of realdata frames per gateway'
+        )
+        parser.add_argument(
+            '--alarms', type=int, default=5,
+            help='Number of alarm payloads per gateway'
+        )
+        parser.add_argument(
+            '--trend-points', type=int, default=12,
+            help='Number of trend log points per variable and payload'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed for the payload values'
+        )
+        parser.add_argument(
+            '--commit', action='store_true', default=False,
+            help='Keep the synthesized data, by default it is deleted'
+        )
+
+    def _variables(self, device_index):
+        return [
+            (
+                'dblink_%s_%s' % (device_index, node_index),
+                'var_%s' % (node_index),
+                random.choice(['kWh', 'kW', 'V', 'A', 'PF']),
+            )
+            for node_index in range(self.options['nodes'])
+        ]
+
+    def gateway_payload(self, sn):
+        return {
+            'sn': sn,
+            'name': 'bench %s' % (sn),
+            'ver': '1.0',
+            'site': {'name': 'bench'},
+            'owner': {'name': 'bench'},
+            'room': {'name': 'bench'},
+        }, 1
+
+    def device_payload(self):
+        devices = [
+            {
+                'channel': '1',
+                'id': str(index),
+                'name': 'device %s' % (index),
+                'desc': 'bench device %s' % (index),
+            }
+            for index in range(self.options['devices'])
+        ]
+        return {'device': devices}, len(devices)
+
+    def rtdata_payload(self, logdt):
+        devices = [
+            {
+                'id': str(index),
+                'channel': '1',
+                'node': [
+                    {
+                        'dblink': dblink,
+                        'name': name,
+                        'value': '%.3f' % (random.uniform(0, 1000)),
+                        'unit': unit,
+                    }
+                    for dblink, name, unit in self._variables(index)
+                ]
+            }
+            for index in range(self.options['devices'])
+        ]
+        rows = 1 + sum(len(x['node']) for x in devices)
+        return {
+            'logdt': logdt.strftime('%Y-%m-%d %H:%M:%S'),
+            'device': devices
+        }, rows
+
+    def alarm_payload(self, logdt):
+        nodes = [
+            {
+                'id': str(index),
+                'channel': '1',
+                'logdt': logdt.strftime('%Y-%m-%d %H:%M:%S'),
+                'name': 'alarm_%s' % (index),
+                'value': '0',
+                'threadhold_value': '',
+                'unit': '',
+                'type': 'MMG_GET_VALUE_ERROR',
+                'flag': 'M',
+            }
+            for index in range(self.options['devices'])
+        ]
+        return {'node': nodes}, len(nodes)
+
+    def trend_log_payload(self, start):
+        points = self.options['trend_points']
+        devices = [
+            {
+                'id': str(index),
+                'channel': '1',
+                'trendlog': [
+                    {
+                        'dblink': dblink,
+                        'name': name,
+                        'data': [
+                            {
+                                'date_time': (
+                                    start + timedelta(minutes=15 * point)
+                                ).strftime('%Y-%m-%d %H:%M:%S'),
+                                'value': '%.3f' % (random.uniform(0, 1000)),
+                                'unit': unit,
+                            }
+                            for point in range(points)
+                        ]
+                    }
+                    for dblink, name, unit in self._variables(index)
+                ]
+            }
+            for index in range(self.options['devices'])
+        ]
+        rows = len(devices) * self.options['nodes'] * points
+        return {'device': devices}, rows
+
+    def request(self, url_name, url, data, rows):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = self.client.post(url, data, format='json')
+            latency = time.perf_counter() - start
+        ok = 200 <= response.status_code < 300
+        if not ok and self.options['verbosity'] > 1:
+            self.stderr.write('%s %s %s' % (
+                url_name, response.status_code, response.content[:200]
+            ))
+        self.stats[url_name].add(latency, len(queries), rows, ok)
+
+    def synthesize(self):
+        currency = apps.get_model('general.currency').objects.order_by(
+            'id'
+        ).first()
+        if currency is None:
+            raise CommandError('A currency is required')
+        suffix = '%x' % (int(time.time() * 1000))
+        self.bench_client = apps.get_model('general.client').objects.create(
+            name='bench %s' % (suffix),
+            currency_model=currency
+        )
+        client = self.bench_client
+        start = datetime.now().replace(microsecond=0) - timedelta(days=1)
+        for project_index in range(self.options['projects']):
+            project = apps.get_model('general.project').objects.create(
+                name='bench %s %s' % (suffix, project_index),
+                client=client,
+                currency_model=currency
+            )
+            for gateway_index in range(self.options['gateways']):
+                sn = 'bench-%s-%s-%s' % (suffix, project_index, gateway_index)
+                self.request(
+                    'gateway-create',
+                    reverse('x6gateapi:gateway-create', kwargs={
+                        'project_uuid': str(project.uuid),
+                    }),
+                    *self.gateway_payload(sn)
+                )
+                kwargs = {'project_uuid': str(project.uuid), 'sn': sn}
+                self.request(
+                    'device-create',
+                    reverse('x6gateapi:device-create', kwargs=kwargs),
+                    *self.device_payload()
+                )
+                url = reverse('x6gateapi:rtdata-create', kwargs=kwargs)
+                for frame in range(self.options['frames']):
+                    self.request(
+                        'rtdata-create',
+                        url,
+                        *self.rtdata_payload(
+                            start + timedelta(minutes=5 * frame)
+                        )
+                    )
+                url = reverse('x6gateapi:alarmdata-create', kwargs=kwargs)
+                for alarm in range(self.options['alarms']):
+                    self.request(
+                        'alarmdata-create',
+                        url,
+                        *self.alarm_payload(
+                            start + timedelta(minutes=5 * alarm)
+                        )
+                    )
+                url = reverse('x6gateapi:trendlogdata-create', kwargs=kwargs)
+                self.request(
+                    'trendlogdata-create',
+                    url,
+                    *self.trend_log_payload(start)
+                )
+
+    def report(self):
+        header = [
+            'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms',
+            'queries/req', 'rows/s'
+        ]
+        rows = [header] + [
+            self.stats[name].row(name)
+            for name in self.url_names
+            if self.stats[name].latencies
+        ]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            self.stdout.write('  '.join(
+                value.ljust(width) if index == 0 else value.rjust(width)
+                for index, (value, width) in enumerate(zip(row, widths))
+            ))
+
+    @transaction.atomic
+    def cleanup(self):
+        gateways = apps.get_model('x6gateapi.gateway').objects.filter(
+            project__client=self.bench_client
+        )
+        for model_name, lookup in CLEANUP_MODELS:
+            apps.get_model(model_name).objects.filter(
+                **{lookup: gateways}
+            ).delete()
+        gateways.delete()
+        self.bench_client.delete()
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.client = APIClient()
+        self.stats = {name: Stats() for name in self.url_names}
+        self.bench_client = None
+        random.seed(options['seed'])
+        # Each request commits on its own, like in production, so the work
+        # done on commit is measured too
+        try:
+            self.synthesize()
+        finally:
+            if self.bench_client is not None and not options['commit']:
+                self.cleanup()
+        self.report()
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from megedc.x6gateapi import partitions
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Create the future monthly partitions and detach the expired ones,'
+        ' optionally converting tables to partitioned tables first'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='append', default=[],
+            choices=list(partitions.PARTITIONED_TABLES),
+            help=(
+                'Convert the table to a partitioned table, the table is'
+                ' locked while its rows are checked'
+            )
+        )
+        parser.add_argument(
+            '--ahead', type=int, default=None,
+            help='Number of future months to create on conversion'
+        )
+
+    def handle(self, *args, **options):
+        for table in options['convert']:
+            try:
+                partitions.convert_table(table, months_ahead=options['ahead'])
+            except partitions.PartitionError as exce:
+                raise CommandError(str(exce))
+            self.stdout.write('%s converted' % (table))
+        for table, result in partitions.maintain().items():
+            self.stdout.write('%s: created %s, detached %s' % (
+                table,
+                ', '.join(result['created']) or '-',
+                ', '.join(result['detached']) or '-',
+            ))
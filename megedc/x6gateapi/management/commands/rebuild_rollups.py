@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from megedc.x6gateapi import rollups
+
+
+class Command(BaseCommand):
+
+    help = 'Compute again the hourly and daily rollups from the raw data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-s', '--source', choices=[x for x, _ in rollups.ROLLUP_SOURCES],
+            action='append', help='Rollup source, all by default'
+        )
+        parser.add_argument(
+            '-d', '--device', type=int, action='append',
+            help='Device dev_id, all by default'
+        )
+
+    def handle(self, *args, **options):
+        sources = options['source'] or [x for x, _ in rollups.ROLLUP_SOURCES]
+        for source in sources:
+            rebuilt = rollups.rebuild(source, devices_ids=options['device'])
+            self.stdout.write('%s: %s devices rebuilt' % (source, rebuilt))
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:21
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0024_measure_extra_data'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rtdata',
+            name='date_time',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0025_rtdata_date_time_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('rtdata', 'Realdata'), ('alarm', 'Alarm'), ('trendlog', 'Trend log')], max_length=20)),
+                ('payload', models.JSONField()),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('gateway', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ingest_items', to='x6gateapi.gateway')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ingestitem',
+            index=models.Index(fields=['gateway', 'id'], name='x6gateapi_i_gateway_3f6587_idx'),
+        ),
+    ]
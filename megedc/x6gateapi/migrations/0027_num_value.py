@@ -0,0 +1,23 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0026_ingestitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datanone',
+            name='num_value',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trendlogdata',
+            name='num_value',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0027_num_value'),
+    ]
+
+    operations = [
+        # The columns keep their names, only the model fields are renamed
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='datanone',
+                    old_name='dblink',
+                    new_name='raw_dblink',
+                ),
+                migrations.AlterField(
+                    model_name='datanone',
+                    name='raw_dblink',
+                    field=models.CharField(blank=True, db_column='dblink', max_length=128, null=True),
+                ),
+                migrations.RenameField(
+                    model_name='datanone',
+                    old_name='unit',
+                    new_name='raw_unit',
+                ),
+                migrations.AlterField(
+                    model_name='datanone',
+                    name='raw_unit',
+                    field=models.CharField(blank=True, db_column='unit', max_length=128, null=True),
+                ),
+                migrations.RenameField(
+                    model_name='trendlogdata',
+                    old_name='unit',
+                    new_name='raw_unit',
+                ),
+                migrations.AlterField(
+                    model_name='trendlogdata',
+                    name='raw_unit',
+                    field=models.CharField(blank=True, db_column='unit', max_length=128, null=True),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Variable',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=128)),
+                ('dblink', models.CharField(blank=True, max_length=128, null=True)),
+                ('unit', models.CharField(blank=True, max_length=128, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='variables', to='x6gateapi.device')),
+            ],
+            options={
+                'unique_together': {('device', 'name')},
+            },
+        ),
+        migrations.AddField(
+            model_name='datanone',
+            name='variable',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='x6gateapi.variable'),
+        ),
+        migrations.AddField(
+            model_name='trendlogdata',
+            name='variable',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='x6gateapi.variable'),
+        ),
+    ]
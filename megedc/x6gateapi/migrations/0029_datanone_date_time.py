@@ -0,0 +1,24 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0028_variable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datanone',
+            name='date_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='datanone',
+            name='data',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, related_name='nodes', to='x6gateapi.rtdata'),
+        ),
+    ]
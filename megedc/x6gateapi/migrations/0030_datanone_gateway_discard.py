@@ -0,0 +1,28 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0029_datanone_date_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datanone',
+            name='data_discard',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='datanone',
+            name='gateway',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='nodes', to='x6gateapi.gateway'),
+        ),
+        migrations.AddIndex(
+            model_name='datanone',
+            index=models.Index(fields=['device', 'name', 'date_time'], name='x6gateapi_d_device__772d14_idx'),
+        ),
+    ]
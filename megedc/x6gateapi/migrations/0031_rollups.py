@@ -0,0 +1,82 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0030_datanone_gateway_discard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('rtdata', 'Realdata'), ('trendlog', 'Trend log')], max_length=20, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupPending',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('rtdata', 'Realdata'), ('trendlog', 'Trend log')], max_length=20)),
+                ('name', models.CharField(max_length=128)),
+                ('period_start', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='x6gateapi.device')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('rtdata', 'Realdata'), ('trendlog', 'Trend log')], max_length=20)),
+                ('name', models.CharField(max_length=128)),
+                ('count', models.PositiveIntegerField()),
+                ('min_value', models.FloatField()),
+                ('min_date_time', models.DateTimeField()),
+                ('max_value', models.FloatField()),
+                ('max_date_time', models.DateTimeField()),
+                ('sum_value', models.FloatField()),
+                ('first_value', models.FloatField()),
+                ('first_date_time', models.DateTimeField()),
+                ('last_value', models.FloatField()),
+                ('last_date_time', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('period_start', models.DateTimeField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='hourlyrollups', to='x6gateapi.device')),
+            ],
+            options={
+                'unique_together': {('source', 'device', 'name', 'period_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('rtdata', 'Realdata'), ('trendlog', 'Trend log')], max_length=20)),
+                ('name', models.CharField(max_length=128)),
+                ('count', models.PositiveIntegerField()),
+                ('min_value', models.FloatField()),
+                ('min_date_time', models.DateTimeField()),
+                ('max_value', models.FloatField()),
+                ('max_date_time', models.DateTimeField()),
+                ('sum_value', models.FloatField()),
+                ('first_value', models.FloatField()),
+                ('first_date_time', models.DateTimeField()),
+                ('last_value', models.FloatField()),
+                ('last_date_time', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('day', models.DateField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='dailyrollups', to='x6gateapi.device')),
+            ],
+            options={
+                'unique_together': {('source', 'device', 'name', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0013_auto_20220724_1005'),
+        ('x6gateapi', '0031_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128)),
+                ('enabled', models.BooleanField(default=True)),
+                ('raw_days', models.PositiveIntegerField(help_text='Days the raw data is kept')),
+                ('hourly_rollup_days', models.PositiveIntegerField(blank=True, help_text='Days the hourly rollups are kept, empty keeps them', null=True)),
+                ('daily_rollup_days', models.PositiveIntegerField(blank=True, help_text='Days the daily rollups are kept, empty keeps them', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('removed_at', models.DateTimeField(null=True)),
+                ('gateway', models.ForeignKey(blank=True, help_text='Policy of the gateway, before the project one', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='retention_policies', to='x6gateapi.gateway')),
+                ('project', models.ForeignKey(blank=True, help_text='Policy of all the project gateways', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='retention_policies', to='general.project')),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0032_retentionpolicy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=128)),
+                ('rows', models.PositiveIntegerField()),
+                ('owned_rows', models.PositiveIntegerField(default=0, help_text='Rows of the tables owned by the purged rows')),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('removed_before', models.DateTimeField()),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+            ],
+        ),
+    ]
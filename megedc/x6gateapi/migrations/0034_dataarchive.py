@@ -0,0 +1,32 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0033_purgelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('rtdata', 'Realdata'), ('trendlog', 'Trend log')], max_length=20)),
+                ('month', models.DateTimeField()),
+                ('path', models.CharField(max_length=255)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('variables', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('gateway', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archives', to='x6gateapi.gateway')),
+            ],
+            options={
+                'unique_together': {('gateway', 'kind', 'month')},
+            },
+        ),
+    ]
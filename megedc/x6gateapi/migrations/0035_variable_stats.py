@@ -0,0 +1,38 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0034_dataarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='variable',
+            name='first_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='variable',
+            name='has_discarded_nodes',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='variable',
+            name='has_valid_nodes',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='variable',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='variable',
+            name='nodes_count',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
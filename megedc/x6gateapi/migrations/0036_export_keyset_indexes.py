@@ -0,0 +1,21 @@
+# Generated by Django 3.2.13 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0035_variable_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rtalarm',
+            index=models.Index(fields=['date_time', 'id'], name='x6gateapi_r_date_ti_dc95d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendlogdata',
+            index=models.Index(fields=['date_time', 'id'], name='x6gateapi_t_date_ti_098a00_idx'),
+        ),
+    ]
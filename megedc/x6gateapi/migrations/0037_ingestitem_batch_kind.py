@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0036_export_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingestitem',
+            name='kind',
+            field=models.CharField(choices=[('rtdata', 'Realdata'), ('alarm', 'Alarm'), ('trendlog', 'Trend log'), ('rtdatabatch', 'Realdata batch')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from megedc.x6gateapi.backfills import NUM_VALUE_TABLES, backfill_num_value
+
+
+def fill_num_value(apps, schema_editor):
+    for table in NUM_VALUE_TABLES.values():
+        backfill_num_value(table)
+
+
+class Migration(migrations.Migration):
+
+    # Each chunk of rows is updated in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('x6gateapi', '0037_ingestitem_batch_kind'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_num_value, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+from megedc.x6gateapi.backfills import backfill_nodes
+
+
+def fill_nodes(apps, schema_editor):
+    backfill_nodes()
+
+
+class Migration(migrations.Migration):
+
+    # Each chunk of rows is updated in its own transaction
+    atomic = False
+
+    dependencies = [
+        ('x6gateapi', '0038_backfill_num_value'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_nodes, migrations.RunPython.noop),
+    ]
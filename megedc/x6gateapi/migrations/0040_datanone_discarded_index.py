@@ -0,0 +1,17 @@
+# Generated by Django 3.2.13 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0039_backfill_nodes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='datanone',
+            index=models.Index(condition=models.Q(('discard', True)), fields=['device', 'name'], name='x6gateapi_datanone_discarded'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.13 on 2026-10-18 13:41
+
+from django.db import migrations, models
+
+
+# Few frames are removed, only their nodes are updated
+COPY_REMOVED_SQL = (
+    'UPDATE "x6gateapi_datanone" AS "node"'
+    ' SET "data_removed_at" = "data"."removed_at"'
+    ' FROM "x6gateapi_rtdata" AS "data"'
+    ' WHERE "data"."id" = "node"."data_id"'
+    ' AND "data"."removed_at" IS NOT NULL'
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0040_datanone_discarded_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datanone',
+            name='data_removed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(COPY_REMOVED_SQL, migrations.RunSQL.noop),
+    ]
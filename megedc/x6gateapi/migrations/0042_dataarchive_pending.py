@@ -0,0 +1,18 @@
+# Generated by Django 3.2.13 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('x6gateapi', '0041_datanone_data_removed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataarchive',
+            name='pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
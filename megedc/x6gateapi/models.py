@@ -1,9 +1,15 @@
 import re
+from .archives import ARCHIVE_KINDS
 from .emails import send_alert
+from .ingest import INGEST_KINDS
+from .rollups import ROLLUP_SOURCES
 from datetime import datetime
 from django.contrib.postgres.fields import ArrayField
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.template import Template, Context
+from django.utils import timezone
 from megedc.billing.measue_calculators import Calculators
 from megedc.general.models import Project, Local, UnitCost
 from timezone_field import TimeZoneField
@@ -137,6 +143,127 @@ class Device(models.Model):
         ]
 
 
+class Variable(models.Model):
+
+    # Small key, it is referenced by every data row
+    id = models.AutoField(primary_key=True)
+
+    name = models.CharField(max_length=128)
+
+    dblink = models.CharField(
+        max_length=128,
+        null=True,
+        blank=True
+    )
+
+    unit = models.CharField(
+        max_length=128,
+        null=True,
+        blank=True
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    # Realdata nodes stats, computed again with the rollups. The count is
+    # the one of the numeric values in the daily rollups
+    first_seen = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    last_seen = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    nodes_count = models.BigIntegerField(default=0)
+
+    has_valid_nodes = models.BooleanField(default=False)
+
+    has_discarded_nodes = models.BooleanField(default=False)
+
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.PROTECT,
+        related_name='variables',
+    )
+
+    def __str__(self):
+        return '%s %s' % (self.device, self.name)
+
+    class Meta:
+        unique_together = [
+            ['device', 'name']
+        ]
+
+
+class VariableValueMixer(models.Model):
+    """
+    Rows with the dblink and unit stored once in the variable
+
+    The row columns only keep the values that differ from the variable
+    ones, the dblink and unit attributes resolve both.
+    """
+
+    variable_fields = ['dblink', 'unit']
+
+    variable = models.ForeignKey(
+        Variable,
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='+',
+    )
+
+    class Meta:
+        abstract = True
+
+    def _variable_value(self, field_name):
+        value = getattr(self, 'raw_%s' % (field_name))
+        if value is None and self.variable_id is not None:
+            return getattr(self.variable, field_name)
+        return value
+
+    def set_variable(self, variable):
+        self.variable = variable
+        for field_name in self.variable_fields:
+            raw_name = 'raw_%s' % (field_name)
+            if getattr(self, raw_name) == getattr(variable, field_name):
+                setattr(self, raw_name, None)
+
+
+class VariableQuerySet(models.QuerySet):
+
+    def with_variable_fields(self):
+        """
+        Annotate the dblink and unit resolved with the variable values
+
+        The annotations are used like fields in filter, exclude, Q, values
+        and order_by. Lookups from related models must use the raw and
+        variable fields.
+        """
+        return self.annotate(**{
+            field_name: Coalesce(
+                'raw_%s' % (field_name),
+                'variable__%s' % (field_name)
+            )
+            for field_name in self.model.variable_fields
+        })
+
+
+class VariableManager(models.Manager.from_queryset(VariableQuerySet)):
+    """
+    Manager of the rows with the variable fields annotated
+
+    The dblink and unit lookups keep working like when they were columns.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().with_variable_fields()
+
+
 class RTData(models.Model):
 
     logdt = models.CharField(
@@ -145,7 +272,11 @@ class RTData(models.Model):
         blank=True
     )
 
-    date_time = models.DateTimeField(auto_now_add=True)
+    date_time = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        blank=True
+    )
 
     discard = models.BooleanField(default=False)
 
@@ -165,12 +296,13 @@ class RTData(models.Model):
         ]
 
 
-class DataNone(models.Model):
+class DataNone(VariableValueMixer):
 
-    dblink = models.CharField(
+    raw_dblink = models.CharField(
         max_length=128,
         null=True,
-        blank=True
+        blank=True,
+        db_column='dblink'
     )
 
     name = models.CharField(
@@ -185,18 +317,57 @@ class DataNone(models.Model):
         blank=True
     )
 
-    unit = models.CharField(
+    num_value = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+
+    raw_unit = models.CharField(
         max_length=128,
         null=True,
-        blank=True
+        blank=True,
+        db_column='unit'
     )
 
     discard = models.BooleanField(default=False)
 
+    # Copies of the frame date time, gateway, discard and removal, so the
+    # nodes are filtered without joining RTData. The date time is the
+    # partition column
+    date_time = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+
+    data_discard = models.BooleanField(
+        default=False,
+        editable=False
+    )
+
+    data_removed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+
+    gateway = models.ForeignKey(
+        Gateway,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='nodes',
+        on_delete=models.PROTECT
+    )
+
+    # Without constraint, RTData can be a partitioned table. The purge
+    # deletes the orphan nodes
     data = models.ForeignKey(
         RTData,
         related_name='nodes',
-        on_delete=models.PROTECT
+        on_delete=models.PROTECT,
+        db_constraint=False
     )
 
     device = models.ForeignKey(
@@ -209,11 +380,50 @@ class DataNone(models.Model):
         null=True,
     )
 
+    objects = VariableManager()
+
     class Meta:
         indexes = [
-            models.Index(fields=['device', 'data', 'name'])
+            models.Index(fields=['device', 'data', 'name']),
+            models.Index(fields=['device', 'name', 'date_time']),
+            # Few nodes are discarded, read by the variables stats
+            models.Index(
+                fields=['device', 'name'],
+                condition=models.Q(discard=True),
+                name='x6gateapi_datanone_discarded'
+            ),
         ]
 
+    @property
+    def dblink(self):
+        return self._variable_value('dblink')
+
+    @dblink.setter
+    def dblink(self, value):
+        self.raw_dblink = value
+
+    @property
+    def unit(self):
+        return self._variable_value('unit')
+
+    @unit.setter
+    def unit(self, value):
+        self.raw_unit = value
+
+    def save(self, *args, **kwargs):
+        # num_value is parsed by the pre_save signal
+        if self.data_id is not None and (
+            self.date_time is None or self.gateway_id is None
+        ):
+            self.date_time = self.data.date_time
+            self.gateway_id = self.data.gateway_id
+            self.data_discard = self.data.discard
+            self.data_removed_at = self.data.removed_at
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'value' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'num_value'}
+        return super().save(*args, **kwargs)
+
 
 class RTAlarm(models.Model):
 
@@ -273,7 +483,8 @@ class RTAlarm(models.Model):
 
     class Meta:
         indexes = [
-            models.Index(fields=['device', 'logdt'])
+            models.Index(fields=['device', 'logdt']),
+            models.Index(fields=['date_time', 'id']),
         ]
 
     re_int_charts = re.compile(r'^\D*(\d*).*$')
@@ -287,7 +498,7 @@ class RTAlarm(models.Model):
                 return int(int_val)
 
 
-class TrendLogData(models.Model):
+class TrendLogData(VariableValueMixer):
 
     date_time = models.DateTimeField()
 
@@ -309,10 +520,17 @@ class TrendLogData(models.Model):
         blank=True
     )
 
-    unit = models.CharField(
+    num_value = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+
+    raw_unit = models.CharField(
         max_length=128,
         null=True,
-        blank=True
+        blank=True,
+        db_column='unit'
     )
 
     removed_at = models.DateTimeField(
@@ -325,13 +543,298 @@ class TrendLogData(models.Model):
         on_delete=models.PROTECT
     )
 
+    # The dblink is part of the unique key, so it stays in the row
+    variable_fields = ['unit']
+
+    objects = VariableManager()
+
     class Meta:
         unique_together = [
             ['device', 'dblink', 'date_time'],
         ]
 
         indexes = [
-            models.Index(fields=['device', 'name', 'date_time'])
+            models.Index(fields=['device', 'name', 'date_time']),
+            models.Index(fields=['date_time', 'id']),
+        ]
+
+    @property
+    def unit(self):
+        return self._variable_value('unit')
+
+    @unit.setter
+    def unit(self, value):
+        self.raw_unit = value
+
+    def save(self, *args, **kwargs):
+        # num_value is parsed by the pre_save signal
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'value' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'num_value'}
+        return super().save(*args, **kwargs)
+
+
+class IngestItem(models.Model):
+
+    kind = models.CharField(
+        max_length=20,
+        choices=INGEST_KINDS
+    )
+
+    payload = models.JSONField()
+
+    error = models.TextField(
+        null=True,
+        blank=True
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    gateway = models.ForeignKey(
+        Gateway,
+        on_delete=models.PROTECT,
+        related_name='ingest_items',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['gateway', 'id'])
+        ]
+
+
+class Rollup(models.Model):
+
+    source = models.CharField(
+        max_length=20,
+        choices=ROLLUP_SOURCES
+    )
+
+    name = models.CharField(max_length=128)
+
+    count = models.PositiveIntegerField()
+
+    min_value = models.FloatField()
+
+    min_date_time = models.DateTimeField()
+
+    max_value = models.FloatField()
+
+    max_date_time = models.DateTimeField()
+
+    sum_value = models.FloatField()
+
+    first_value = models.FloatField()
+
+    first_date_time = models.DateTimeField()
+
+    last_value = models.FloatField()
+
+    last_date_time = models.DateTimeField()
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.PROTECT,
+        related_name='%(class)ss',
+    )
+
+    @property
+    def avg_value(self):
+        return self.sum_value / self.count
+
+    class Meta:
+        abstract = True
+
+
+class HourlyRollup(Rollup):
+
+    # UTC hour start
+    period_start = models.DateTimeField()
+
+    class Meta:
+        unique_together = [
+            ['source', 'device', 'name', 'period_start']
+        ]
+
+
+class DailyRollup(Rollup):
+
+    # Day in the gateway time zone
+    day = models.DateField()
+
+    class Meta:
+        unique_together = [
+            ['source', 'device', 'name', 'day']
+        ]
+
+
+class RollupWatermark(models.Model):
+
+    source = models.CharField(
+        max_length=20,
+        choices=ROLLUP_SOURCES,
+        unique=True
+    )
+
+    last_id = models.BigIntegerField(default=0)
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+    )
+
+
+class RollupPending(models.Model):
+
+    source = models.CharField(
+        max_length=20,
+        choices=ROLLUP_SOURCES
+    )
+
+    name = models.CharField(max_length=128)
+
+    period_start = models.DateTimeField()
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    device = models.ForeignKey(
+        Device,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+
+class RetentionPolicy(models.Model):
+
+    name = models.CharField(max_length=128)
+
+    enabled = models.BooleanField(default=True)
+
+    raw_days = models.PositiveIntegerField(
+        help_text='Days the raw data is kept'
+    )
+
+    hourly_rollup_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text='Days the hourly rollups are kept, empty keeps them'
+    )
+
+    daily_rollup_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text='Days the daily rollups are kept, empty keeps them'
+    )
+
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.PROTECT,
+        related_name='retention_policies',
+        null=True,
+        blank=True,
+        help_text='Policy of all the project gateways'
+    )
+
+    gateway = models.ForeignKey(
+        Gateway,
+        on_delete=models.PROTECT,
+        related_name='retention_policies',
+        null=True,
+        blank=True,
+        help_text='Policy of the gateway, before the project one'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    removed_at = models.DateTimeField(
+        null=True
+    )
+
+    def clean(self):
+        if (self.project_id is None) == (self.gateway_id is None):
+            raise ValidationError('Set a project or a gateway')
+
+    def __str__(self):
+        return self.name
+
+
+class PurgeLog(models.Model):
+
+    table = models.CharField(max_length=128)
+
+    rows = models.PositiveIntegerField()
+
+    owned_rows = models.PositiveIntegerField(
+        default=0,
+        help_text='Rows of the tables owned by the purged rows'
+    )
+
+    first_id = models.BigIntegerField()
+
+    last_id = models.BigIntegerField()
+
+    removed_before = models.DateTimeField()
+
+    started_at = models.DateTimeField()
+
+    finished_at = models.DateTimeField()
+
+    def __str__(self):
+        return '%s %s' % (self.table, self.finished_at)
+
+
+class DataArchive(models.Model):
+
+    kind = models.CharField(
+        max_length=20,
+        choices=ARCHIVE_KINDS
+    )
+
+    # UTC month start
+    month = models.DateTimeField()
+
+    # Relative to MEGEDC_ARCHIVE_ROOT
+    path = models.CharField(max_length=255)
+
+    rows = models.PositiveIntegerField(default=0)
+
+    size = models.PositiveBigIntegerField(default=0)
+
+    # [dev_id, name] pairs of the archived rows
+    variables = models.JSONField(default=list)
+
+    # The archived rows are still stored, until they are deleted
+    pending = models.BooleanField(default=False, editable=False)
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True
+    )
+
+    gateway = models.ForeignKey(
+        Gateway,
+        on_delete=models.PROTECT,
+        related_name='archives',
+    )
+
+    class Meta:
+        unique_together = [
+            ['gateway', 'kind', 'month']
         ]
 
 
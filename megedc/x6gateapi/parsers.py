@@ -0,0 +1,119 @@
+import io
+import msgpack
+import zlib
+import zstandard
+from django.conf import settings
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import BaseParser, JSONParser
+
+
+def _decode_gzip(data, max_size):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    decoded = decompressor.decompress(data, max_size + 1)
+    if not decompressor.eof and len(decoded) <= max_size:
+        raise ParseError('Truncated gzip body')
+    return decoded
+
+
+def _decode_zstd(data, max_size):
+    reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    with reader:
+        decoded = reader.read(max_size + 1)
+    if len(decoded) <= max_size:
+        # The reader returns a truncated frame without error, its size is
+        # known to be bounded here, so the frame end is checked decoding it
+        # again
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        decompressor.decompress(data)
+        if not decompressor.eof:
+            raise ParseError('Truncated zstd body')
+    return decoded
+
+
+CONTENT_DECODERS = {
+    'gzip': _decode_gzip,
+    'x-gzip': _decode_gzip,
+    'zstd': _decode_zstd,
+}
+
+
+def decode_body(stream, content_encoding):
+    """
+    Decode a compressed request body
+
+    :param stream: Request body stream
+    :param content_encoding: Content-Encoding header value
+
+    :returns: Stream with the decoded body
+
+    :raises UnsupportedMediaType: If the encoding is not supported
+    :raises ParseError: If the body can not be decoded or the decoded body
+        is bigger than MEGEDC_X6GATEAPI_MAX_DECODED_SIZE
+    """
+    content_encoding = (content_encoding or 'identity').strip().lower()
+    if content_encoding == 'identity' or stream is None:
+        return stream
+    decoder = CONTENT_DECODERS.get(content_encoding)
+    if decoder is None:
+        raise UnsupportedMediaType(
+            content_encoding,
+            detail='Unsupported content encoding "%s"' % (content_encoding)
+        )
+    max_size = settings.MEGEDC_X6GATEAPI_MAX_DECODED_SIZE
+    try:
+        decoded = decoder(stream.read(), max_size)
+    except (zlib.error, zstandard.ZstdError) as exce:
+        raise ParseError('Invalid %s body - %s' % (content_encoding, exce))
+    if len(decoded) > max_size:
+        raise ParseError('Decoded body too large')
+    return io.BytesIO(decoded)
+
+
+class ContentEncodingMixer():
+    """
+    Parser mixer decoding gzip and zstd request bodies
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        if request is not None:
+            stream = decode_body(
+                stream, request.META.get('HTTP_CONTENT_ENCODING')
+            )
+        return super().parse(
+            stream, media_type=media_type, parser_context=parser_context
+        )
+
+
+class IngestJSONParser(ContentEncodingMixer, JSONParser):
+    pass
+
+
+class MessagePackBaseParser(BaseParser):
+    """
+    Parses MessagePack-serialized data
+    """
+
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, msgpack.UnpackException) as exce:
+            raise ParseError('MessagePack parse error - %s' % (exce))
+
+
+class MessagePackParser(ContentEncodingMixer, MessagePackBaseParser):
+    pass
+
+
+class XMessagePackParser(MessagePackParser):
+
+    media_type = 'application/x-msgpack'
+
+
+INGEST_PARSER_CLASSES = [
+    IngestJSONParser,
+    MessagePackParser,
+    XMessagePackParser,
+]
@@ -0,0 +1,389 @@
+import re
+from datetime import datetime
+from django.conf import settings
+from django.db import connection
+from django.db.transaction import atomic
+from django.utils import timezone
+
+
+# Tables that can be partitioned by month and their partition column
+PARTITIONED_TABLES = {
+    'x6gateapi_rtdata': 'date_time',
+    'x6gateapi_datanone': 'date_time',
+    'x6gateapi_trendlogdata': 'date_time',
+    'x6gateapi_rtalarm': 'date_time',
+}
+
+LEGACY_SUFFIX = '_legacy'
+DEFAULT_SUFFIX = '_default'
+MONTH_SUFFIX = '_p%Y%m'
+
+
+class PartitionError(Exception):
+    pass
+
+
+def month_start(date_time, months=0):
+    """
+    First instant in UTC of the month of date_time plus months
+    """
+    month = date_time.year * 12 + date_time.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table, month):
+    return table + month.strftime(MONTH_SUFFIX)
+
+
+def _fetch(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def is_partitioned(table):
+    return bool(_fetch(
+        'SELECT 1 FROM pg_partitioned_table p'
+        ' JOIN pg_class c ON c.oid = p.partrelid'
+        ' WHERE c.relname = %s AND pg_table_is_visible(c.oid)',
+        [table]
+    ))
+
+
+def month_partitions(table):
+    """
+    Get the monthly partitions of a table
+
+    :param table: Partitioned table name
+
+    :returns: Sorted list of (month start, partition name) tuples
+    """
+    pattern = re.compile(re.escape(table) + r'_p(\d{6})$')
+    partitions = []
+    for name, in _fetch(
+        'SELECT c.relname FROM pg_inherits i'
+        ' JOIN pg_class c ON c.oid = i.inhrelid'
+        ' JOIN pg_class p ON p.oid = i.inhparent'
+        ' WHERE p.relname = %s AND pg_table_is_visible(p.oid)',
+        [table]
+    ):
+        match = pattern.match(name)
+        if match:
+            month = datetime.strptime(match.group(1), '%Y%m').replace(
+                tzinfo=timezone.utc
+            )
+            partitions.append((month, name))
+    return sorted(partitions)
+
+
+def _has_partition(name):
+    return bool(_fetch(
+        'SELECT 1 FROM pg_class c'
+        ' WHERE c.relname = %s AND c.relispartition'
+        ' AND pg_table_is_visible(c.oid)',
+        [name]
+    ))
+
+
+def _legacy_upper_bound(table):
+    rows = _fetch(
+        'SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_class c'
+        ' WHERE c.relname = %s AND pg_table_is_visible(c.oid)',
+        [table + LEGACY_SUFFIX]
+    )
+    if not rows or rows[0][0] is None:
+        return None
+    match = re.search(r"TO \('([^']+)'\)", rows[0][0])
+    if match is None:
+        return None
+    return datetime.fromisoformat(match.group(1))
+
+
+def ensure_partitions(table, months_ahead=None, now=None):
+    """
+    Create the monthly partitions from the current month to months_ahead
+
+    The default partition is created too if MEGEDC_PARTITIONS_DEFAULT is
+    set, so the tables partitioned without it get it.
+
+    :param table: Partitioned table name
+    :param months_ahead: Number of future months, by default
+        MEGEDC_PARTITIONS_AHEAD
+    :param now: Current date time, by default timezone.now()
+
+    :returns: List of created partition names
+    """
+    if months_ahead is None:
+        months_ahead = settings.MEGEDC_PARTITIONS_AHEAD
+    now = now or timezone.now()
+    existing = set(month for month, _ in month_partitions(table))
+    has_default = _has_partition(table + DEFAULT_SUFFIX)
+    first = month_start(now)
+    legacy_bound = _legacy_upper_bound(table)
+    if legacy_bound is not None:
+        first = max(first, month_start(legacy_bound))
+    created = []
+    for months in range(months_ahead + 1):
+        month = month_start(first, months)
+        if month in existing:
+            continue
+        name = partition_name(table, month)
+        if has_default:
+            _create_from_default(table, name, month)
+        else:
+            _execute(
+                'CREATE TABLE IF NOT EXISTS %s PARTITION OF %s'
+                ' FOR VALUES FROM (%%s) TO (%%s)' % (
+                    _quote(name), _quote(table)
+                ),
+                [month, month_start(month, 1)]
+            )
+        created.append(name)
+    if settings.MEGEDC_PARTITIONS_DEFAULT and not has_default:
+        name = table + DEFAULT_SUFFIX
+        _execute('CREATE TABLE %s PARTITION OF %s DEFAULT' % (
+            _quote(name), _quote(table)
+        ))
+        created.append(name)
+    return created
+
+
+def _create_from_default(table, name, month):
+    # A new partition can not be created over rows of the default
+    # partition, so they are moved to the new table before attaching it
+    default = table + DEFAULT_SUFFIX
+    column = _quote(PARTITIONED_TABLES[table])
+    _execute(
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        % (_quote(name), _quote(table))
+    )
+    bounds = [month, month_start(month, 1)]
+    _execute(
+        'WITH moved AS (DELETE FROM %s WHERE %s >= %%s AND %s < %%s'
+        ' RETURNING *) INSERT INTO %s SELECT * FROM moved' % (
+            _quote(default), column, column, _quote(name)
+        ),
+        bounds
+    )
+    _execute(
+        'ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM (%%s) TO (%%s)'
+        % (_quote(table), _quote(name)),
+        bounds
+    )
+
+
+def detach_partitions(table, before, drop=False):
+    """
+    Detach the monthly and legacy partitions that end before a date time
+
+    The partitions are detached CONCURRENTLY, without blocking the queries
+    of the table, unless it is called inside a transaction or the table
+    has a default partition, where Postgres does not allow it.
+
+    :param table: Partitioned table name
+    :param before: Partitions with all their rows older are detached
+    :param drop: Drop the detached partitions
+
+    :returns: List of detached partition names
+    """
+    concurrently = not connection.in_atomic_block and not _has_partition(
+        table + DEFAULT_SUFFIX
+    )
+    expired = [
+        name for month, name in month_partitions(table)
+        if month_start(month, 1) <= before
+    ]
+    legacy_bound = _legacy_upper_bound(table)
+    if legacy_bound is not None and legacy_bound <= before:
+        expired.insert(0, table + LEGACY_SUFFIX)
+    for name in expired:
+        _execute('ALTER TABLE %s DETACH PARTITION %s%s' % (
+            _quote(table), _quote(name),
+            ' CONCURRENTLY' if concurrently else ''
+        ))
+        if drop:
+            _execute('DROP TABLE %s' % (_quote(name)))
+    return expired
+
+
+def _renamed(name):
+    return name[:55] + LEGACY_SUFFIX
+
+
+@atomic
+def convert_table(table, months_ahead=None, now=None):
+    """
+    Convert a table into a table partitioned by month
+
+    The current table is kept as the partition of all the rows before the
+    next month, the new rows go to the monthly partitions. The table is
+    locked while the legacy rows are checked. If MEGEDC_PARTITIONS_DEFAULT
+    is set, the default, a default partition keeps the rows out of the
+    monthly ranges, but then the partitions can not be detached
+    concurrently.
+
+    :param table: Table name, one of PARTITIONED_TABLES
+    :param months_ahead: Number of future months to create
+    :param now: Current date time, by default timezone.now()
+
+    :raises PartitionError: If the table can not be converted
+    """
+    column = PARTITIONED_TABLES.get(table)
+    if column is None:
+        raise PartitionError('Table "%s" can not be partitioned' % (table))
+    if is_partitioned(table):
+        raise PartitionError('Table "%s" is already partitioned' % (table))
+    legacy = table + LEGACY_SUFFIX
+    referenced = _fetch(
+        'SELECT conname FROM pg_constraint'
+        ' WHERE contype = \'f\' AND confrelid = %s::regclass',
+        [table]
+    )
+    if referenced:
+        raise PartitionError('Table "%s" is referenced by "%s"' % (
+            table, ', '.join(x[0] for x in referenced)
+        ))
+    _execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % (_quote(table)))
+    if _fetch('SELECT 1 FROM %s WHERE %s IS NULL LIMIT 1' % (
+        _quote(table), _quote(column)
+    )):
+        raise PartitionError('Table "%s" has rows without %s' % (
+            table, column
+        ))
+    cutover = month_start(now or timezone.now(), 1)
+
+    constraints = _fetch(
+        'SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint'
+        ' WHERE conrelid = %s::regclass AND contype IN (\'p\', \'u\', \'f\')',
+        [table]
+    )
+    # Unique keys must include the partition column
+    unpartitioned = _fetch(
+        'SELECT c.conname FROM pg_constraint c'
+        ' WHERE c.conrelid = %s::regclass AND c.contype = \'u\''
+        ' AND NOT EXISTS (SELECT 1 FROM pg_attribute a'
+        ' WHERE a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)'
+        ' AND a.attname = %s)',
+        [table, column]
+    )
+    if unpartitioned:
+        raise PartitionError(
+            'Table "%s" unique constraints "%s" do not include %s' % (
+                table, ', '.join(x[0] for x in unpartitioned), column
+            )
+        )
+    indexes = _fetch(
+        'SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x'
+        ' JOIN pg_class i ON i.oid = x.indexrelid'
+        ' WHERE x.indrelid = %s::regclass AND NOT EXISTS ('
+        ' SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)',
+        [table]
+    )
+    sequence = _fetch(
+        'SELECT pg_get_serial_sequence(%s, \'id\')', [table]
+    )[0][0]
+
+    # The legacy table frees the names for the partitioned one
+    _execute('ALTER TABLE %s RENAME TO %s' % (_quote(table), _quote(legacy)))
+    for name, _, _ in constraints:
+        _execute('ALTER TABLE %s RENAME CONSTRAINT %s TO %s' % (
+            _quote(legacy), _quote(name), _quote(_renamed(name))
+        ))
+    for name, _ in indexes:
+        _execute('ALTER INDEX %s RENAME TO %s' % (
+            _quote(name), _quote(_renamed(name))
+        ))
+    _execute('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL' % (
+        _quote(legacy), _quote(column)
+    ))
+    # The primary key must include the partition column
+    for name, contype, _ in constraints:
+        if contype == 'p':
+            _execute('ALTER TABLE %s DROP CONSTRAINT %s' % (
+                _quote(legacy), _quote(_renamed(name))
+            ))
+            _execute(
+                'ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY (%s, %s)' % (
+                    _quote(legacy), _quote(_renamed(name)), _quote('id'),
+                    _quote(column)
+                )
+            )
+
+    _execute(
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        ' PARTITION BY RANGE (%s)' % (
+            _quote(table), _quote(legacy), _quote(column)
+        )
+    )
+    if sequence:
+        _execute('ALTER SEQUENCE %s OWNED BY %s.%s' % (
+            sequence, _quote(table), _quote('id')
+        ))
+    for name, contype, definition in constraints:
+        if contype == 'p':
+            definition = 'PRIMARY KEY (%s, %s)' % (
+                _quote('id'), _quote(column)
+            )
+        _execute('ALTER TABLE %s ADD CONSTRAINT %s %s' % (
+            _quote(table), _quote(name), definition
+        ))
+    for name, definition in indexes:
+        _execute('CREATE %sINDEX %s ON %s %s' % (
+            'UNIQUE ' if definition.startswith('CREATE UNIQUE') else '',
+            _quote(name),
+            _quote(table),
+            definition[definition.index(' USING '):]
+        ))
+
+    # Matching legacy indexes and foreign keys are attached, not rebuilt
+    _execute(
+        'ALTER TABLE %s ATTACH PARTITION %s'
+        ' FOR VALUES FROM (MINVALUE) TO (%%s)' % (
+            _quote(table), _quote(legacy)
+        ),
+        [cutover]
+    )
+    ensure_partitions(table, months_ahead=months_ahead, now=now)
+
+
+def partitioned_tables():
+    return [table for table in PARTITIONED_TABLES if is_partitioned(table)]
+
+
+def maintain(now=None):
+    """
+    Create the future partitions and detach the expired ones
+
+    Only the tables already partitioned are maintained. Partitions older
+    than MEGEDC_PARTITIONS_RETENTION_MONTHS are detached, and dropped if
+    MEGEDC_PARTITIONS_DROP_DETACHED is set.
+
+    :param now: Current date time, by default timezone.now()
+
+    :returns: Dict of table names with the created and detached partitions
+    """
+    now = now or timezone.now()
+    result = {}
+    retention = settings.MEGEDC_PARTITIONS_RETENTION_MONTHS
+    for table in partitioned_tables():
+        with atomic():
+            created = ensure_partitions(table, now=now)
+        detached = []
+        if retention:
+            # Out of the transaction to detach them concurrently
+            detached = detach_partitions(
+                table,
+                month_start(now, -retention),
+                drop=settings.MEGEDC_PARTITIONS_DROP_DETACHED
+            )
+        result[table] = {'created': created, 'detached': detached}
+    return result
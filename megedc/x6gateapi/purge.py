@@ -0,0 +1,242 @@
+import time
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.transaction import atomic
+from django.utils import timezone
+from megedc.x6gateapi import rollups
+
+
+# Soft deleted models, children first, with the models removed with them
+PURGE_MODELS = [
+    ('x6gateapi.datanone', []),
+    ('x6gateapi.trendlogdata', []),
+    ('x6gateapi.rtdata', []),
+    ('x6gateapi.alert', []),
+    ('x6gateapi.device', [
+        'x6gateapi.variable',
+        'x6gateapi.rtalarm',
+        'x6gateapi.hourlyrollup',
+        'x6gateapi.dailyrollup',
+        'x6gateapi.rolluppending',
+    ]),
+    ('x6gateapi.gateway', [
+        'x6gateapi.ingestitem',
+    ]),
+]
+
+
+def _fetch(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _foreign_key(model, parent):
+    for field in model._meta.concrete_fields:
+        if field.is_relation and field.related_model is parent:
+            return field.column
+    raise ValueError('%s has not foreign key to %s' % (
+        model._meta.label, parent._meta.label
+    ))
+
+
+def references_sql(model, owned_models):
+    """
+    SQL conditions of the rows of model not referenced by other rows
+
+    The references from the owned models are ignored, those rows are
+    purged with the referenced row.
+    """
+    conditions = []
+    pk_column = '%s.%s' % (_quote('t'), _quote(model._meta.pk.column))
+    for relation in model._meta.get_fields(include_hidden=True):
+        if not (
+            relation.auto_created
+            and not relation.concrete
+            and (relation.one_to_many or relation.one_to_one)
+        ):
+            continue
+        if relation.related_model in owned_models:
+            continue
+        conditions.append(
+            'NOT EXISTS (SELECT 1 FROM %s r WHERE r.%s = %s)' % (
+                _quote(relation.related_model._meta.db_table),
+                _quote(relation.field.column),
+                pk_column,
+            )
+        )
+    return conditions
+
+
+def purge_model(model_name, owned_names, removed_before, batch_size=None,
+                sleep=None):
+    """
+    Delete the rows of a model soft deleted before a date time
+
+    The rows are read in id order, batch_size at a time, and each batch is
+    deleted in its own transaction. Rows still referenced are kept.
+
+    :param model_name: Soft deleted model
+    :param owned_names: Models deleted with the rows
+    :param removed_before: Rows with removed_at before are deleted
+    :param batch_size: Rows per batch, by default MEGEDC_PURGE_BATCH_SIZE
+    :param sleep: Seconds between batches, by default MEGEDC_PURGE_SLEEP
+
+    :returns: PurgeLog or None if nothing was deleted
+    """
+    batch_size = batch_size or settings.MEGEDC_PURGE_BATCH_SIZE
+    if sleep is None:
+        sleep = settings.MEGEDC_PURGE_SLEEP
+    model = apps.get_model(model_name)
+    owned_models = [apps.get_model(x) for x in owned_names]
+    table = _quote(model._meta.db_table)
+    pk = _quote(model._meta.pk.column)
+    conditions = [
+        't.%s > %%s' % (pk),
+        't.%s < %%s' % (_quote('removed_at')),
+    ] + references_sql(model, owned_models)
+    select_sql = 'SELECT t.%s FROM %s t WHERE %s ORDER BY t.%s LIMIT %%s' % (
+        pk, table, ' AND '.join(conditions), pk
+    )
+    delete_sql = 'DELETE FROM %s t WHERE t.%s = ANY(%%s) AND %s' % (
+        table, pk, ' AND '.join(conditions[2:] or ['TRUE'])
+    )
+    started_at = timezone.now()
+    last_id = 0
+    first_id = None
+    rows = 0
+    owned_rows = 0
+    while True:
+        with atomic():
+            ids = [x[0] for x in _fetch(
+                select_sql, [last_id, removed_before, batch_size]
+            )]
+            if not ids:
+                break
+            for owned_model in owned_models:
+                owned_rows += _execute(
+                    'DELETE FROM %s WHERE %s = ANY(%%s)' % (
+                        _quote(owned_model._meta.db_table),
+                        _quote(_foreign_key(owned_model, model)),
+                    ),
+                    [ids]
+                )
+            rows += _execute(delete_sql, [ids])
+        if first_id is None:
+            first_id = ids[0]
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+    if not rows:
+        return None
+    return apps.get_model('x6gateapi.purgelog').objects.create(
+        table=model._meta.db_table,
+        rows=rows,
+        owned_rows=owned_rows,
+        first_id=first_id,
+        last_id=last_id,
+        removed_before=removed_before,
+        started_at=started_at,
+        finished_at=timezone.now()
+    )
+
+
+ORPHAN_NODES_SQL = (
+    'SELECT n.id FROM x6gateapi_datanone n WHERE n.id > %s'
+    ' AND NOT EXISTS (SELECT 1 FROM x6gateapi_rtdata d WHERE d.id = n.data_id)'
+    ' ORDER BY n.id LIMIT %s'
+)
+
+
+def purge_orphan_nodes(removed_before, batch_size=None, sleep=None):
+    """
+    Delete the nodes whose frame does not exist
+
+    The nodes reference their frame without a database constraint, so
+    RTData can be partitioned, and a detached frame partition leaves them
+    orphans. They are deleted in id order, batch_size at a time, then the
+    stats of their variables are computed again.
+
+    :param removed_before: Purge date time, only logged
+    :param batch_size: Rows per batch, by default MEGEDC_PURGE_BATCH_SIZE
+    :param sleep: Seconds between batches, by default MEGEDC_PURGE_SLEEP
+
+    :returns: PurgeLog or None if nothing was deleted
+    """
+    batch_size = batch_size or settings.MEGEDC_PURGE_BATCH_SIZE
+    if sleep is None:
+        sleep = settings.MEGEDC_PURGE_SLEEP
+    started_at = timezone.now()
+    last_id = 0
+    first_id = None
+    rows = 0
+    variables = set()
+    while True:
+        with atomic():
+            ids = [x[0] for x in _fetch(
+                ORPHAN_NODES_SQL, [last_id, batch_size]
+            )]
+            if not ids:
+                break
+            deleted = _fetch(
+                'DELETE FROM x6gateapi_datanone WHERE id = ANY(%s)'
+                ' RETURNING device_id, name', [ids]
+            )
+            rows += len(deleted)
+            variables.update(x for x in deleted if x[1] is not None)
+        if first_id is None:
+            first_id = ids[0]
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+    if not rows:
+        return None
+    rollups.refresh_variables(variables)
+    return apps.get_model('x6gateapi.purgelog').objects.create(
+        table='x6gateapi_datanone',
+        rows=rows,
+        first_id=first_id,
+        last_id=last_id,
+        removed_before=removed_before,
+        started_at=started_at,
+        finished_at=timezone.now()
+    )
+
+
+def purge(now=None):
+    """
+    Delete the rows soft deleted more than MEGEDC_PURGE_GRACE_DAYS ago and
+    the orphan nodes
+
+    :param now: Current date time, by default timezone.now()
+
+    :returns: List of PurgeLog
+    """
+    removed_before = (now or timezone.now()) - timedelta(
+        days=settings.MEGEDC_PURGE_GRACE_DAYS
+    )
+    logs = []
+    for model_name, owned_names in PURGE_MODELS:
+        log = purge_model(model_name, owned_names, removed_before)
+        if log is not None:
+            logs.append(log)
+    log = purge_orphan_nodes(removed_before)
+    if log is not None:
+        logs.append(log)
+    return logs
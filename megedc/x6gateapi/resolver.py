@@ -0,0 +1,288 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import Http404
+from django_redis.exceptions import ConnectionInterrupted
+from rest_framework.generics import get_object_or_404
+
+
+logger = logging.getLogger('megedc.x6gateapi.resolver')
+
+PROJECT_KEY = 'x6gateapi_res_project_%s'
+GATEWAY_KEY = 'x6gateapi_res_gateway_%s_%s'
+DEVICES_KEY = 'x6gateapi_res_devices_%s'
+VARIABLES_KEY = 'x6gateapi_res_variables_%s'
+CATALOG_KEY = 'x6gateapi_res_catalog_%s'
+
+# Heavy gateway fields not needed on ingestion
+GATEWAY_DEFERRED_FIELDS = [
+    'site',
+    'owner',
+    'room',
+    'extra_data',
+    'secret_extra_data',
+]
+
+
+class LocalLRUCache():
+    """
+    Small in-process LRU cache with expiration
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expire_at, value = item
+            if expire_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalLRUCache(
+    settings.MEGEDC_X6GATEAPI_RESOLVER_LOCAL_SIZE,
+    settings.MEGEDC_X6GATEAPI_RESOLVER_LOCAL_TIMEOUT,
+)
+
+
+def _cache_call(method, *args):
+    # Without redis the values are loaded from the database
+    try:
+        return method(*args)
+    except ConnectionInterrupted as exce:
+        logger.warning('Resolver cache unavailable: %s', exce)
+        return None
+
+
+def _get(key, loader):
+    value = local_cache.get(key)
+    if value is not None:
+        return value
+    value = _cache_call(cache.get, key)
+    if value is None:
+        value = loader()
+        _cache_call(
+            cache.set, key, value, settings.MEGEDC_X6GATEAPI_RESOLVER_TIMEOUT
+        )
+    local_cache.set(key, value)
+    return value
+
+
+def _delete(keys):
+    local_cache.delete_many(keys)
+    _cache_call(cache.delete_many, keys)
+
+
+def get_project(project_uuid):
+    """
+    Get an enabled project by uuid
+
+    :param project_uuid: Project uuid
+
+    :returns: Project instance with the client loaded
+
+    :raises Http404: If the project does not exist or it is disabled
+    """
+    try:
+        project_uuid = uuid.UUID(str(project_uuid))
+    except ValueError:
+        raise Http404()
+    return _get(
+        PROJECT_KEY % (project_uuid),
+        lambda: get_object_or_404(
+            apps.get_model('general.project').objects.select_related(
+                'client'
+            ),
+            uuid=project_uuid,
+            enabled=True
+        )
+    )
+
+
+def get_gateway(project, sn):
+    """
+    Get an enabled gateway of the project by sn
+
+    The heavy JSON fields are deferred and the project is attached, so
+    the gateway timezone resolves without queries. The cached instance is
+    shared between threads, a copy is returned.
+
+    :param project: Project instance
+    :param sn: Gateway serial number
+
+    :returns: Gateway instance
+
+    :raises Http404: If the gateway does not exist or it is disabled
+    """
+    gateway = _get(
+        GATEWAY_KEY % (project.uuid, sn),
+        lambda: get_object_or_404(
+            project.gateways.filter(enabled=True).defer(
+                *GATEWAY_DEFERRED_FIELDS
+            ),
+            sn=sn,
+        )
+    )
+    gateway = copy(gateway)
+    gateway.project = project
+    return gateway
+
+
+def get_devices(gateway):
+    """
+    Get all the gateway devices
+
+    :param gateway: Gateway instance
+
+    :returns: Dict of (channel, id) keys with copies of the cached Device
+        instances
+    """
+    def load():
+        return {
+            (device.channel, device.id): device
+            for device in apps.get_model('x6gateapi.device').objects.filter(
+                gateway_id=gateway.id
+            )
+        }
+    devices = {}
+    for key, device in _get(DEVICES_KEY % (gateway.id), load).items():
+        devices[key] = copy(device)
+        devices[key].gateway = gateway
+    return devices
+
+
+def get_variables(gateway):
+    """
+    Get all the variables of the gateway devices
+
+    :param gateway: Gateway instance
+
+    :returns: Dict of (device dev_id, name) keys with Variable instances
+    """
+    def load():
+        return {
+            (variable.device_id, variable.name): variable
+            for variable in apps.get_model(
+                'x6gateapi.variable'
+            ).objects.filter(device__gateway_id=gateway.id)
+        }
+    return _get(VARIABLES_KEY % (gateway.id), load)
+
+
+def get_catalog(gateway_id):
+    """
+    Get the variables with realdata nodes of the gateway devices
+
+    The variables stats are computed by rollups.refresh_variables, that
+    invalidates the catalog.
+
+    :param gateway_id: Gateway id
+
+    :returns: List of (device dev_id, name, has valid nodes, has discarded
+        nodes) tuples
+    """
+    def load():
+        return list(apps.get_model('x6gateapi.variable').objects.filter(
+            Q(has_valid_nodes=True) | Q(has_discarded_nodes=True),
+            device__gateway_id=gateway_id
+        ).values_list(
+            'device_id', 'name', 'has_valid_nodes', 'has_discarded_nodes'
+        ))
+    return _get(CATALOG_KEY % (gateway_id), load)
+
+
+@contextmanager
+def devices_guard(gateway):
+    """
+    Invalidate the gateway devices and variables if the wrapped code fails
+
+    Devices created inside a transaction can be cached before it is rolled
+    back, so the cache is invalidated on any error.
+    """
+    try:
+        yield
+    except Exception:
+        invalidate_devices([gateway.id])
+        raise
+
+
+def invalidate_devices(gateway_ids):
+    _delete(
+        [DEVICES_KEY % (gateway_id) for gateway_id in gateway_ids]
+        + [VARIABLES_KEY % (gateway_id) for gateway_id in gateway_ids]
+        + [CATALOG_KEY % (gateway_id) for gateway_id in gateway_ids]
+    )
+
+
+def invalidate_variables(gateway_ids):
+    _delete(
+        [VARIABLES_KEY % (gateway_id) for gateway_id in gateway_ids]
+        + [CATALOG_KEY % (gateway_id) for gateway_id in gateway_ids]
+    )
+
+
+def invalidate_catalog(gateway_ids):
+    _delete([CATALOG_KEY % (gateway_id) for gateway_id in gateway_ids])
+
+
+def invalidate_gateways(gateway_ids):
+    keys = []
+    queryset = apps.get_model('x6gateapi.gateway').objects.filter(
+        id__in=gateway_ids
+    ).values_list('id', 'project_id', 'sn')
+    for gateway_id, project_uuid, sn in queryset:
+        keys.append(GATEWAY_KEY % (project_uuid, sn))
+        keys.append(DEVICES_KEY % (gateway_id))
+        keys.append(VARIABLES_KEY % (gateway_id))
+        keys.append(CATALOG_KEY % (gateway_id))
+    _delete(keys)
+
+
+def invalidate_projects(project_uuids):
+    _delete([PROJECT_KEY % (project_uuid) for project_uuid in project_uuids])
+    invalidate_gateways(
+        apps.get_model('x6gateapi.gateway').objects.filter(
+            project_id__in=project_uuids
+        ).values_list('id', flat=True)
+    )
+
+
+def clear():
+    local_cache.clear()
+    for key in [
+        PROJECT_KEY, GATEWAY_KEY, DEVICES_KEY, VARIABLES_KEY, CATALOG_KEY
+    ]:
+        cache.delete_pattern(key.replace('%s', '*'))
@@ -0,0 +1,256 @@
+import pytz
+import time
+from datetime import datetime, timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.transaction import atomic
+from django.utils import timezone
+from megedc.x6gateapi import rollups
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _fetch(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def local_day_start(date_time, tz, days=0):
+    """
+    First instant of the local day of date_time plus days
+    """
+    day = date_time.astimezone(tz).date() + timedelta(days=days)
+    return tz.localize(datetime(day.year, day.month, day.day))
+
+
+def gateways_policies():
+    """
+    Get the retention policy of the gateways with one
+
+    The gateway policy is used before the project one.
+
+    :returns: List of (gateway, policy) tuples
+    """
+    policies = apps.get_model('x6gateapi.retentionpolicy').objects.filter(
+        enabled=True,
+        removed_at__isnull=True
+    ).order_by('id')
+    gateways_policies = {}
+    projects_policies = {}
+    for policy in policies:
+        if policy.gateway_id is not None:
+            gateways_policies[policy.gateway_id] = policy
+        elif policy.project_id is not None:
+            projects_policies[policy.project_id] = policy
+    gateways = apps.get_model('x6gateapi.gateway').objects.filter(
+        Q(id__in=list(gateways_policies))
+        | Q(project_id__in=list(projects_policies)),
+        removed_at__isnull=True
+    ).select_related('project__client')
+    return [
+        (
+            gateway,
+            gateways_policies.get(gateway.id)
+            or projects_policies.get(gateway.project_id)
+        )
+        for gateway in gateways
+    ]
+
+
+def delete_batches(table, where, params, batch_size=None, sleep=None):
+    """
+    Delete the rows of a table in batches of ids, each one in its own
+    transaction
+
+    :param table: Table name
+    :param where: SQL condition of the rows to delete
+    :param params: Parameters of the condition
+    :param batch_size: Rows per batch, by default MEGEDC_RETENTION_BATCH_SIZE
+    :param sleep: Seconds between batches, by default MEGEDC_RETENTION_SLEEP
+
+    :returns: Number of deleted rows
+    """
+    batch_size = batch_size or settings.MEGEDC_RETENTION_BATCH_SIZE
+    if sleep is None:
+        sleep = settings.MEGEDC_RETENTION_SLEEP
+    sql = (
+        'DELETE FROM %s WHERE id IN (SELECT id FROM %s WHERE %s'
+        ' ORDER BY id LIMIT %%s)' % (table, table, where)
+    )
+    deleted = 0
+    while True:
+        with atomic():
+            rowcount = _execute(sql, list(params) + [batch_size])
+        deleted += rowcount
+        if rowcount < batch_size:
+            return deleted
+        if sleep:
+            time.sleep(sleep)
+
+
+def enforce_raw(source, devices_ids, tz, cutoff, max_days=None):
+    """
+    Remove the raw rows of the devices older than cutoff
+
+    The rows are removed a local day at a time, the rollups of the day are
+    computed again before the rows are removed.
+
+    :param source: Rollup source, one of rollups.ROLLUP_SOURCES
+    :param devices_ids: Devices dev_id
+    :param tz: Gateway time zone
+    :param cutoff: Local day start, rows before are removed
+    :param max_days: Maximum number of days, by default
+        MEGEDC_RETENTION_MAX_DAYS
+
+    :returns: Number of removed rows
+    """
+    max_days = max_days or settings.MEGEDC_RETENTION_MAX_DAYS
+    table = rollups.source_table(source)
+    deleted = 0
+    for _ in range(max_days):
+        oldest = _fetch(
+            'SELECT MIN(date_time) FROM %s WHERE device_id = ANY(%%s)'
+            ' AND date_time < %%s' % (table),
+            [devices_ids, cutoff]
+        )[0][0]
+        if oldest is None:
+            break
+        end = min(local_day_start(oldest, tz, 1), cutoff)
+        with atomic():
+            rollups.refresh(source, set(_fetch(
+                'SELECT DISTINCT device_id, name,'
+                ' DATE_TRUNC(\'hour\', date_time) FROM %s'
+                ' WHERE device_id = ANY(%%s) AND date_time < %%s'
+                ' AND name IS NOT NULL' % (table),
+                [devices_ids, end]
+            )))
+        deleted += delete_batches(
+            table, 'device_id = ANY(%s) AND date_time < %s',
+            [devices_ids, end]
+        )
+    return deleted
+
+
+def enforce_frames(gateway, tz, cutoff, max_days=None):
+    """
+    Remove the frames of the gateway older than cutoff with their nodes
+
+    The frames are removed a local day at a time, the rollups of the day
+    are computed again before and the variables stats after. The nodes are
+    selected by their frame, so the ones without the frame date time copy
+    are removed too.
+
+    :param gateway: Gateway
+    :param tz: Gateway time zone
+    :param cutoff: Local day start, frames before are removed
+    :param max_days: Maximum number of days, by default
+        MEGEDC_RETENTION_MAX_DAYS
+
+    :returns: Tuple with the number of removed nodes and frames
+    """
+    max_days = max_days or settings.MEGEDC_RETENTION_MAX_DAYS
+    nodes_table = rollups.source_table(rollups.ROLLUP_RTDATA)
+    frames_table = apps.get_model('x6gateapi.rtdata')._meta.db_table
+    frames_sql = (
+        'SELECT id FROM %s WHERE gateway_id = %%s AND date_time < %%s' % (
+            frames_table
+        )
+    )
+    nodes = frames = 0
+    for _ in range(max_days):
+        oldest = _fetch(
+            'SELECT MIN(date_time) FROM %s WHERE gateway_id = %%s'
+            ' AND date_time < %%s' % (frames_table),
+            [gateway.id, cutoff]
+        )[0][0]
+        if oldest is None:
+            break
+        end = min(local_day_start(oldest, tz, 1), cutoff)
+        variables = _fetch(
+            'SELECT DISTINCT device_id, name FROM %s'
+            ' WHERE data_id IN (%s) AND name IS NOT NULL' % (
+                nodes_table, frames_sql
+            ),
+            [gateway.id, end]
+        )
+        with atomic():
+            rollups.refresh(rollups.ROLLUP_RTDATA, set(_fetch(
+                'SELECT DISTINCT device_id, name,'
+                ' DATE_TRUNC(\'hour\', date_time) FROM %s'
+                ' WHERE data_id IN (%s) AND name IS NOT NULL'
+                ' AND date_time IS NOT NULL' % (nodes_table, frames_sql),
+                [gateway.id, end]
+            )))
+        nodes += delete_batches(
+            nodes_table, 'data_id IN (%s)' % (frames_sql), [gateway.id, end]
+        )
+        frames += delete_batches(
+            frames_table, 'gateway_id = %s AND date_time < %s',
+            [gateway.id, end]
+        )
+        rollups.refresh_variables(variables)
+    return (nodes, frames)
+
+
+def enforce_gateway(gateway, policy, now=None):
+    """
+    Enforce a retention policy on the data of a gateway
+
+    The frames with their realdata nodes and the trend log values are
+    summarized in the rollups and removed, then the expired rollups.
+
+    :param gateway: Gateway
+    :param policy: RetentionPolicy
+    :param now: Current date time, by default timezone.now()
+
+    :returns: Dict of table names with the number of removed rows
+    """
+    now = now or timezone.now()
+    tz = pytz.timezone(str(gateway.timezone))
+    cutoff = local_day_start(now - timedelta(days=policy.raw_days), tz)
+    devices_ids = list(gateway.devices.values_list('dev_id', flat=True))
+    result = {}
+    nodes_table = rollups.source_table(rollups.ROLLUP_RTDATA)
+    frames_table = apps.get_model('x6gateapi.rtdata')._meta.db_table
+    result[nodes_table], result[frames_table] = enforce_frames(
+        gateway, tz, cutoff
+    )
+    result[rollups.source_table(rollups.ROLLUP_TREND_LOG)] = enforce_raw(
+        rollups.ROLLUP_TREND_LOG, devices_ids, tz, cutoff
+    )
+    for model_name, period, days in [
+        ('x6gateapi.hourlyrollup', 'period_start', policy.hourly_rollup_days),
+        ('x6gateapi.dailyrollup', 'day', policy.daily_rollup_days),
+    ]:
+        if days is None:
+            continue
+        before = local_day_start(now - timedelta(days=days), tz)
+        if period == 'day':
+            before = before.date()
+        table = apps.get_model(model_name)._meta.db_table
+        result[table] = delete_batches(
+            table, 'device_id = ANY(%%s) AND %s < %%s' % (period),
+            [devices_ids, before]
+        )
+    return result
+
+
+def enforce(now=None):
+    """
+    Enforce the retention policies of all the gateways
+
+    :param now: Current date time, by default timezone.now()
+
+    :returns: Dict of gateway ids with the removed rows per table
+    """
+    return {
+        gateway.id: enforce_gateway(gateway, policy, now=now)
+        for gateway, policy in gateways_policies()
+    }
@@ -0,0 +1,478 @@
+import pytz
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.db.models.functions import Trunc
+from django.db.transaction import atomic
+from django.utils import timezone
+from megedc.x6gateapi import resolver
+
+
+ROLLUP_RTDATA = 'rtdata'
+ROLLUP_TREND_LOG = 'trendlog'
+
+ROLLUP_SOURCES = [
+    (ROLLUP_RTDATA, 'Realdata'),
+    (ROLLUP_TREND_LOG, 'Trend log'),
+]
+
+SOURCES_MODELS = {
+    ROLLUP_RTDATA: 'x6gateapi.datanone',
+    ROLLUP_TREND_LOG: 'x6gateapi.trendlogdata',
+}
+
+# Rows used by the rollups
+SOURCES_FILTERS = {
+    ROLLUP_RTDATA: (
+        'n.removed_at IS NULL AND NOT n.discard AND NOT n.data_discard'
+        ' AND n.num_value IS NOT NULL AND n.date_time IS NOT NULL'
+        ' AND n.name IS NOT NULL'
+    ),
+    ROLLUP_TREND_LOG: (
+        'n.removed_at IS NULL AND n.num_value IS NOT NULL'
+        ' AND n.name IS NOT NULL'
+    ),
+}
+
+ROLLUP_COLUMNS = (
+    'source, device_id, name, {period}, count, min_value, min_date_time,'
+    ' max_value, max_date_time, sum_value, first_value, first_date_time,'
+    ' last_value, last_date_time, updated_at'
+)
+
+AGGREGATES_SQL = (
+    'COUNT(*), MIN(n.num_value),'
+    ' (ARRAY_AGG(n.date_time ORDER BY n.num_value, n.date_time))[1],'
+    ' MAX(n.num_value),'
+    ' (ARRAY_AGG(n.date_time ORDER BY n.num_value DESC, n.date_time))[1],'
+    ' SUM(n.num_value),'
+    ' (ARRAY_AGG(n.num_value ORDER BY n.date_time, n.id))[1],'
+    ' MIN(n.date_time),'
+    ' (ARRAY_AGG(n.num_value ORDER BY n.date_time DESC, n.id DESC))[1],'
+    ' MAX(n.date_time), NOW()'
+)
+
+HOURS_KEYS_SQL = (
+    'SELECT * FROM UNNEST(%s::integer[], %s::varchar[], %s::timestamptz[])'
+    ' AS k(device_id, name, period_start)'
+)
+
+DAYS_KEYS_SQL = (
+    'SELECT * FROM UNNEST(%s::integer[], %s::varchar[], %s::date[],'
+    ' %s::varchar[]) AS k(device_id, name, day, tz)'
+)
+
+# Buckets with raw rows left, the rollups of the removed raw rows by the
+# retention or the archive are kept
+HOURS_RAW_SQL = (
+    'EXISTS (SELECT 1 FROM {table} n WHERE n.device_id = k.device_id'
+    ' AND n.name = k.name AND n.date_time >= k.period_start'
+    ' AND n.date_time < k.period_start + INTERVAL \'1 hour\')'
+)
+
+DAYS_RAW_SQL = (
+    'EXISTS (SELECT 1 FROM {table} n WHERE n.device_id = k.device_id'
+    ' AND n.name = k.name'
+    ' AND n.date_time >= (k.day::timestamp AT TIME ZONE k.tz)'
+    ' AND n.date_time < ((k.day + 1)::timestamp AT TIME ZONE k.tz))'
+)
+
+
+# Stats of the realdata variables, the nodes are read with their indexes
+VARIABLES_NODES_SQL = (
+    'n.device_id = v.device_id AND n.name = v.name AND n.removed_at IS NULL'
+)
+
+VARIABLES_SQL = (
+    'UPDATE x6gateapi_variable v SET'
+    ' first_seen = (SELECT MIN(n.date_time) FROM {nodes} n WHERE {filter}),'
+    ' last_seen = (SELECT MAX(n.date_time) FROM {nodes} n WHERE {filter}),'
+    ' nodes_count = COALESCE((SELECT SUM(r.count) FROM {daily} r'
+    ' WHERE r.source = %s AND r.device_id = v.device_id'
+    ' AND r.name = v.name), 0),'
+    ' has_valid_nodes = EXISTS (SELECT 1 FROM {nodes} n WHERE {filter}'
+    ' AND NOT n.discard),'
+    ' has_discarded_nodes = EXISTS (SELECT 1 FROM {nodes} n WHERE {filter}'
+    ' AND n.discard)'
+    ' FROM UNNEST(%s::integer[], %s::varchar[]) AS k(device_id, name)'
+    ' WHERE v.device_id = k.device_id AND v.name = k.name'
+)
+
+
+def source_table(source):
+    return apps.get_model(SOURCES_MODELS[source])._meta.db_table
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _fetch(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def devices_time_zones(devices_ids):
+    """
+    Get the time zone names of the devices gateways
+
+    :param devices_ids: Devices dev_id
+
+    :returns: Dict of dev_id keys with time zone names
+    """
+    devices = apps.get_model('x6gateapi.device').objects.filter(
+        dev_id__in=set(devices_ids)
+    ).select_related('gateway__project__client')
+    return {device.dev_id: str(device.gateway.timezone) for device in devices}
+
+
+def days_keys(hours_keys):
+    """
+    Get the local days keys of hours keys
+
+    :param hours_keys: Set of (dev_id, name, UTC hour start) tuples
+
+    :returns: Set of (dev_id, name, local date, time zone name) tuples
+    """
+    time_zones = devices_time_zones(key[0] for key in hours_keys)
+    keys = set()
+    for device_id, name, hour in hours_keys:
+        tz_name = time_zones.get(device_id)
+        if tz_name is None:
+            continue
+        tz = pytz.timezone(tz_name)
+        # Half hour time zones split an hour between two days
+        for date_time in [hour, hour + timedelta(minutes=59, seconds=59)]:
+            keys.add((
+                device_id, name, date_time.astimezone(tz).date(), tz_name
+            ))
+    return keys
+
+
+def refresh_hours(source, keys):
+    """
+    Compute again the hourly rollups of keys from the raw rows
+
+    The hours without raw rows are kept, their rows were removed by the
+    retention or the archive.
+
+    :param source: Rollup source, one of ROLLUP_SOURCES
+    :param keys: Set of (dev_id, name, UTC hour start) tuples
+    """
+    if not keys:
+        return
+    params = [list(x) for x in zip(*keys)]
+    table = apps.get_model('x6gateapi.hourlyrollup')._meta.db_table
+    _execute(
+        'WITH k AS (%s) DELETE FROM %s r USING k WHERE r.source = %%s'
+        ' AND r.device_id = k.device_id AND r.name = k.name'
+        ' AND r.period_start = k.period_start AND %s' % (
+            HOURS_KEYS_SQL,
+            table,
+            HOURS_RAW_SQL.format(table=source_table(source)),
+        ),
+        params + [source]
+    )
+    _execute(
+        'WITH k AS (%s) INSERT INTO %s (%s)'
+        ' SELECT %%s, k.device_id, k.name, k.period_start, %s'
+        ' FROM k JOIN %s n ON n.device_id = k.device_id'
+        ' AND n.name = k.name AND n.date_time >= k.period_start'
+        ' AND n.date_time < k.period_start + INTERVAL \'1 hour\''
+        ' WHERE %s GROUP BY k.device_id, k.name, k.period_start' % (
+            HOURS_KEYS_SQL,
+            table,
+            ROLLUP_COLUMNS.format(period='period_start'),
+            AGGREGATES_SQL,
+            source_table(source),
+            SOURCES_FILTERS[source],
+        ),
+        params + [source]
+    )
+
+
+def refresh_days(source, keys):
+    """
+    Compute again the daily rollups of keys from the raw rows
+
+    The days without raw rows are kept, like in refresh_hours.
+
+    :param source: Rollup source, one of ROLLUP_SOURCES
+    :param keys: Set of (dev_id, name, local date, time zone name) tuples
+    """
+    if not keys:
+        return
+    params = [list(x) for x in zip(*keys)]
+    table = apps.get_model('x6gateapi.dailyrollup')._meta.db_table
+    _execute(
+        'WITH k AS (%s) DELETE FROM %s r USING k WHERE r.source = %%s'
+        ' AND r.device_id = k.device_id AND r.name = k.name'
+        ' AND r.day = k.day AND %s' % (
+            DAYS_KEYS_SQL,
+            table,
+            DAYS_RAW_SQL.format(table=source_table(source)),
+        ),
+        params + [source]
+    )
+    _execute(
+        'WITH k AS (%s) INSERT INTO %s (%s)'
+        ' SELECT %%s, k.device_id, k.name, k.day, %s'
+        ' FROM k JOIN %s n ON n.device_id = k.device_id'
+        ' AND n.name = k.name'
+        ' AND n.date_time >= (k.day::timestamp AT TIME ZONE k.tz)'
+        ' AND n.date_time < ((k.day + 1)::timestamp AT TIME ZONE k.tz)'
+        ' WHERE %s GROUP BY k.device_id, k.name, k.day' % (
+            DAYS_KEYS_SQL,
+            table,
+            ROLLUP_COLUMNS.format(period='day'),
+            AGGREGATES_SQL,
+            source_table(source),
+            SOURCES_FILTERS[source],
+        ),
+        params + [source]
+    )
+
+
+def refresh(source, hours_keys):
+    """
+    Compute again the hourly and daily rollups of the hours keys
+    """
+    refresh_hours(source, hours_keys)
+    refresh_days(source, days_keys(hours_keys))
+
+
+def refresh_variables(keys):
+    """
+    Compute again the stats of the realdata variables
+
+    The first and last seen and whether there are valid or discarded
+    nodes are read from the stored nodes, the count from the daily
+    rollups. The catalog of the variables gateways is invalidated.
+
+    :param keys: Set of (dev_id, name) tuples
+    """
+    keys = sorted(set(tuple(x) for x in keys))
+    if not keys:
+        return
+    _execute(
+        VARIABLES_SQL.format(
+            nodes=source_table(ROLLUP_RTDATA),
+            daily=apps.get_model('x6gateapi.dailyrollup')._meta.db_table,
+            filter=VARIABLES_NODES_SQL
+        ),
+        [ROLLUP_RTDATA] + [list(x) for x in zip(*keys)]
+    )
+    resolver.invalidate_catalog(set(
+        apps.get_model('x6gateapi.device').objects.filter(
+            dev_id__in=set(x[0] for x in keys)
+        ).values_list('gateway_id', flat=True)
+    ))
+
+
+def invalidate(source, queryset):
+    """
+    Queue the rollups of changed rows to be computed again
+
+    :param source: Rollup source, one of ROLLUP_SOURCES
+    :param queryset: DataNone or TrendLogData queryset of the changed rows
+    """
+    pending_model = apps.get_model('x6gateapi.rolluppending')
+    keys = queryset.filter(
+        name__isnull=False,
+        date_time__isnull=False
+    ).annotate(
+        hour=Trunc('date_time', 'hour', tzinfo=timezone.utc)
+    ).values_list('device_id', 'name', 'hour').distinct()
+    pending_model.objects.bulk_create([
+        pending_model(
+            source=source,
+            device_id=device_id,
+            name=name,
+            period_start=hour
+        )
+        for device_id, name, hour in keys
+    ])
+
+
+def soft_delete(source, queryset, removed_at):
+    """
+    Mark rows as removed and queue their rollups to be computed again
+
+    :param source: Rollup source, one of ROLLUP_SOURCES
+    :param queryset: DataNone or TrendLogData queryset of the removed rows
+    :param removed_at: Removal date time
+
+    :returns: Number of removed rows
+    """
+    invalidate(source, queryset)
+    return queryset.update(removed_at=removed_at)
+
+
+def soft_delete_frames(queryset, removed_at):
+    """
+    Mark RTData frames as removed, with the copy of their nodes
+
+    :param queryset: RTData queryset of the removed frames
+    :param removed_at: Removal date time
+
+    :returns: Number of removed frames
+    """
+    apps.get_model('x6gateapi.datanone').objects.filter(
+        data_id__in=queryset.values('pk')
+    ).update(data_removed_at=removed_at)
+    return queryset.update(removed_at=removed_at)
+
+
+def update(source, batch_size=None, max_batches=None):
+    """
+    Update the rollups with the rows stored since the watermark
+
+    The rows are read by id in batches, the last ids before the watermark
+    are read again because ids are not committed in order. The queued
+    changed rows are processed too, and the realdata variables stats of
+    the refreshed hours are computed again.
+
+    :param source: Rollup source, one of ROLLUP_SOURCES
+    :param batch_size: Number of ids per batch, by default
+        MEGEDC_ROLLUPS_BATCH_SIZE
+    :param max_batches: Maximum number of batches, by default
+        MEGEDC_ROLLUPS_MAX_BATCHES
+
+    :returns: Number of refreshed hours
+    """
+    batch_size = batch_size or settings.MEGEDC_ROLLUPS_BATCH_SIZE
+    max_batches = max_batches or settings.MEGEDC_ROLLUPS_MAX_BATCHES
+    watermark_model = apps.get_model('x6gateapi.rollupwatermark')
+    pending_model = apps.get_model('x6gateapi.rolluppending')
+    table = source_table(source)
+    refreshed = 0
+    for _ in range(max_batches):
+        with atomic():
+            watermark, _ = watermark_model.objects.select_for_update(
+            ).get_or_create(source=source)
+            from_id = max(
+                watermark.last_id - settings.MEGEDC_ROLLUPS_ID_OVERLAP, 0
+            )
+            to_id = _fetch(
+                'SELECT MAX(id) FROM (SELECT id FROM %s WHERE id > %%s'
+                ' ORDER BY id LIMIT %%s) AS ids' % (table),
+                [watermark.last_id, batch_size]
+            )[0][0]
+            keys = set()
+            if to_id is not None:
+                keys.update(_fetch(
+                    'SELECT DISTINCT n.device_id, n.name,'
+                    ' DATE_TRUNC(\'hour\', n.date_time) FROM %s n'
+                    ' WHERE n.id > %%s AND n.id <= %%s'
+                    ' AND n.name IS NOT NULL'
+                    ' AND n.date_time IS NOT NULL' % (table),
+                    [from_id, to_id]
+                ))
+            pending = pending_model.objects.filter(source=source)
+            keys.update(pending.values_list(
+                'device_id', 'name', 'period_start'
+            ).distinct())
+            pending.delete()
+            refresh(source, keys)
+            if source == ROLLUP_RTDATA:
+                refresh_variables(x[:2] for x in keys)
+            refreshed += len(keys)
+            if to_id is None:
+                break
+            watermark.last_id = to_id
+            watermark.save()
+    return refreshed
+
+
+def update_all():
+    return {source: update(source) for source, _ in ROLLUP_SOURCES}
+
+
+def rebuild(source, devices_ids=None):
+    """
+    Compute again all the rollups of the devices from the raw rows
+
+    The rollups before the oldest raw row are kept, their raw rows were
+    removed by the retention policies.
+
+    :param source: Rollup source, one of ROLLUP_SOURCES
+    :param devices_ids: Devices dev_id, all the devices by default
+
+    :returns: Number of rebuilt devices
+    """
+    table = source_table(source)
+    hourly_table = apps.get_model('x6gateapi.hourlyrollup')._meta.db_table
+    daily_table = apps.get_model('x6gateapi.dailyrollup')._meta.db_table
+    if devices_ids is None:
+        devices_ids = apps.get_model('x6gateapi.device').objects.values_list(
+            'dev_id', flat=True
+        )
+        with atomic():
+            watermark, _ = apps.get_model(
+                'x6gateapi.rollupwatermark'
+            ).objects.select_for_update().get_or_create(source=source)
+            watermark.last_id = _fetch(
+                'SELECT COALESCE(MAX(id), 0) FROM %s' % (table)
+            )[0][0]
+            watermark.save()
+    time_zones = devices_time_zones(devices_ids)
+    for device_id, tz_name in time_zones.items():
+        with atomic():
+            oldest = _fetch(
+                'SELECT MIN(date_time) FROM %s WHERE device_id = %%s' % (
+                    table
+                ),
+                [device_id]
+            )[0][0]
+            if oldest is None:
+                continue
+            _execute(
+                'DELETE FROM %s WHERE source = %%s AND device_id = %%s'
+                ' AND period_start >= DATE_TRUNC(\'hour\', %%s)' % (
+                    hourly_table
+                ),
+                [source, device_id, oldest]
+            )
+            _execute(
+                'DELETE FROM %s WHERE source = %%s AND device_id = %%s'
+                ' AND day >= (%%s AT TIME ZONE %%s)::date' % (daily_table),
+                [source, device_id, oldest, tz_name]
+            )
+            for rollup_table, period, period_sql in [
+                (
+                    hourly_table, 'period_start',
+                    'DATE_TRUNC(\'hour\', n.date_time)'
+                ),
+                (
+                    daily_table, 'day',
+                    '(n.date_time AT TIME ZONE %s)::date'
+                ),
+            ]:
+                params = [source, device_id]
+                if period == 'day':
+                    params = [source, tz_name, device_id, tz_name]
+                _execute(
+                    'INSERT INTO %s (%s) SELECT %%s, n.device_id, n.name,'
+                    ' %s, %s FROM %s n WHERE n.device_id = %%s AND %s'
+                    ' GROUP BY n.device_id, n.name, %s' % (
+                        rollup_table,
+                        ROLLUP_COLUMNS.format(period=period),
+                        period_sql,
+                        AGGREGATES_SQL,
+                        table,
+                        SOURCES_FILTERS[source],
+                        period_sql,
+                    ),
+                    params
+                )
+            if source == ROLLUP_RTDATA:
+                refresh_variables(apps.get_model(
+                    'x6gateapi.variable'
+                ).objects.filter(device_id=device_id).values_list(
+                    'device_id', 'name'
+                ))
+    return len(time_zones)
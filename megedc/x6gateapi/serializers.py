@@ -1,4 +1,6 @@
+from datetime import datetime
 from django.apps import apps
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
 
 
@@ -51,9 +53,100 @@ class DataSerializer(serializers.ModelSerializer):
     def get_gateway_name(self, obj):
         return obj.device.gateway.name
 
+    # Columns read by the fast path, the fields name by default
+    values_sources = {
+        'device_name': 'device__name',
+        'device_id': 'device__id',
+        'device_channel': 'device__channel',
+        'gateway_sn': 'device__gateway__sn',
+        'gateway_name': 'device__gateway__name',
+    }
+
+    values_annotations = {}
+
+    def values_queryset(self, queryset):
+        """
+        Queryset of the rows as dicts with the joined columns of the fields
+
+        The id and date_time columns are included for the pagination.
+        """
+        sources = set(
+            self.values_sources.get(x, x) for x in self.Meta.fields
+        ) | {'id', 'date_time'}
+        return queryset.annotate(**self.values_annotations).values(*sources)
+
+    def values_representation(self, rows):
+        """
+        Represent the rows of values_queryset like to_representation
+
+        Only the fields with a type conversion go through its
+        to_representation, the model instances are represented as usual.
+
+        :param rows: Iterable of values_queryset rows or model instances
+
+        :returns: List of dicts
+        """
+        builder = []
+        for field in self._readable_fields:
+            to_representation = field.to_representation
+            if isinstance(field, (
+                serializers.CharField, serializers.SerializerMethodField
+            )):
+                to_representation = None
+            builder.append((
+                field.field_name,
+                self.values_sources.get(field.field_name, field.field_name),
+                to_representation
+            ))
+        data = []
+        for row in rows:
+            if not isinstance(row, dict):
+                data.append(self.to_representation(row))
+                continue
+            item = {}
+            for name, source, to_representation in builder:
+                value = row[source]
+                if to_representation is not None and value is not None:
+                    value = to_representation(value)
+                item[name] = value
+            data.append(item)
+        return data
+
+    def values_rows(self, rows):
+        """
+        Rows of the fields with their typed values, without representation
+
+        :param rows: Iterable of values_queryset rows or model instances
+
+        :returns: Iterator of dicts
+        """
+        fields = list(self._readable_fields)
+        for row in rows:
+            if isinstance(row, dict):
+                yield {
+                    field.field_name: row[self.values_sources.get(
+                        field.field_name, field.field_name
+                    )]
+                    for field in fields
+                }
+                continue
+            item = {}
+            for field in fields:
+                value = field.get_attribute(row)
+                if isinstance(field, serializers.SerializerMethodField):
+                    value = field.to_representation(value)
+                item[field.field_name] = value
+            yield item
+
 
 class TrendLogDataSerializer(DataSerializer):
 
+    values_sources = dict(DataSerializer.values_sources, unit='values_unit')
+
+    values_annotations = {
+        'values_unit': Coalesce('raw_unit', 'variable__unit'),
+    }
+
     class Meta:
         model = apps.get_model('x6gateapi.trendlogdata')
         fields = [
@@ -88,3 +181,124 @@ class RTAlarmDataSerializer(DataSerializer):
             'gateway_sn',
             'gateway_name',
         ]
+
+
+class NodePayloadSerializer(serializers.Serializer):
+
+    dblink = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    name = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    value = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    unit = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+
+
+class DevicePayloadSerializer(serializers.Serializer):
+
+    id = serializers.CharField(max_length=10)
+    channel = serializers.CharField(max_length=128)
+    name = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+
+
+class RTDataDevicePayloadSerializer(DevicePayloadSerializer):
+
+    node = NodePayloadSerializer(many=True, required=False)
+
+
+class RTDataPayloadSerializer(serializers.Serializer):
+
+    logdt = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    device = RTDataDevicePayloadSerializer(many=True, required=False)
+
+
+class RTDataBatchFramePayloadSerializer(RTDataPayloadSerializer):
+
+    logdt = serializers.CharField(max_length=128)
+
+    def validate_logdt(self, value):
+        try:
+            datetime.fromisoformat(value)
+        except ValueError:
+            raise serializers.ValidationError('Invalid logdt')
+        return value
+
+
+class RTAlarmNodePayloadSerializer(serializers.Serializer):
+
+    id = serializers.CharField(max_length=10)
+    channel = serializers.CharField(max_length=128)
+    logdt = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    name = serializers.CharField(
+        max_length=256, required=False, allow_null=True, allow_blank=True
+    )
+    value = serializers.CharField(
+        max_length=2048, required=False, allow_null=True, allow_blank=True
+    )
+    threadhold_value = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    unit = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    type = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    flag = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+
+
+class RTAlarmPayloadSerializer(serializers.Serializer):
+
+    node = RTAlarmNodePayloadSerializer(many=True, required=False)
+
+
+class TrendLogPointPayloadSerializer(serializers.Serializer):
+
+    date_time = serializers.CharField()
+    value = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    unit = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+
+    def validate_date_time(self, value):
+        try:
+            datetime.fromisoformat(value)
+        except ValueError:
+            raise serializers.ValidationError('Invalid date time')
+        return value
+
+
+class TrendLogItemPayloadSerializer(serializers.Serializer):
+
+    dblink = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    name = serializers.CharField(
+        max_length=128, required=False, allow_null=True, allow_blank=True
+    )
+    data = TrendLogPointPayloadSerializer(many=True, required=False)
+
+
+class TrendLogDevicePayloadSerializer(DevicePayloadSerializer):
+
+    trendlog = TrendLogItemPayloadSerializer(many=True, required=False)
+
+
+class TrendLogPayloadSerializer(serializers.Serializer):
+
+    device = TrendLogDevicePayloadSerializer(many=True, required=False)
@@ -0,0 +1,73 @@
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save, pre_save
+from megedc.x6gateapi import ingest, resolver, rollups
+
+
+# Rollup sources of the data models
+ROWS_SOURCES = {
+    model: source for source, model in rollups.SOURCES_MODELS.items()
+}
+
+
+def project_changed(sender, instance, **kwargs):
+    resolver.invalidate_projects([instance.pk])
+
+
+def client_changed(sender, instance, **kwargs):
+    resolver.invalidate_projects(
+        list(instance.projects.all().values_list('pk', flat=True))
+    )
+
+
+def gateway_changed(sender, instance, **kwargs):
+    # Called before and after save, so the old sn is invalidated too
+    if instance.pk is not None:
+        resolver.invalidate_gateways([instance.pk])
+
+
+def device_changed(sender, instance, **kwargs):
+    resolver.invalidate_devices([instance.gateway_id])
+
+
+def variable_changed(sender, instance, **kwargs):
+    resolver.invalidate_variables([instance.device.gateway_id])
+
+
+def variable_row_saving(sender, instance, **kwargs):
+    instance.num_value = ingest.to_num_value(instance.value)
+    # Same bulk path of the ingest, the variables come from the resolver
+    if instance.variable_id is None and instance.name:
+        ingest.link_variables(instance.device.gateway, [instance])
+    elif instance.variable_id is not None:
+        instance.set_variable(instance.variable)
+
+
+def variable_row_saved(sender, instance, created, **kwargs):
+    # The new rows are read by the rollups from their watermark
+    if not created:
+        rollups.invalidate(
+            ROWS_SOURCES[sender._meta.label_lower],
+            sender.objects.filter(pk=instance.pk)
+        )
+
+
+def connect():
+    project_model = apps.get_model('general.project')
+    client_model = apps.get_model('general.client')
+    gateway_model = apps.get_model('x6gateapi.gateway')
+    device_model = apps.get_model('x6gateapi.device')
+    variable_model = apps.get_model('x6gateapi.variable')
+    for signal in [post_save, post_delete]:
+        signal.connect(project_changed, sender=project_model)
+        signal.connect(client_changed, sender=client_model)
+        signal.connect(gateway_changed, sender=gateway_model)
+        signal.connect(device_changed, sender=device_model)
+        signal.connect(variable_changed, sender=variable_model)
+    pre_save.connect(gateway_changed, sender=gateway_model)
+    for model_name in ROWS_SOURCES:
+        pre_save.connect(
+            variable_row_saving, sender=apps.get_model(model_name)
+        )
+        post_save.connect(
+            variable_row_saved, sender=apps.get_model(model_name)
+        )
@@ -7,12 +7,19 @@ from celery import shared_task
 from datetime import datetime
 from django.apps import apps
 from django.conf import settings
+from django.core.cache import cache
 from django.core.mail import EmailMessage
-from django.db.transaction import atomic
+from django.db.transaction import atomic, on_commit
 from megedc.emporiaenergy.partner_api import partner_api
+from megedc.x6gateapi import (
+    archives, ingest, partitions, purge, retention, rollups
+)
 from os.path import join
 
 
+INGEST_DRAIN_CACHE_KEY = 'x6gateapi_ingest_drain_%s'
+
+
 @shared_task
 def emporia_energy_gateway_sync(gateways=None):
     queryset = apps.get_model('x6gateapi.gateway').objects.filter(
@@ -155,3 +162,71 @@ def mmg_errors_alert(*args, **kwargs):
             email.attach_file(file_path)
             email.send()
         queryset.update(flag='P')
+
+
+@shared_task
+def drain_ingest_queue(gateway_id=None):
+    cache.delete(INGEST_DRAIN_CACHE_KEY % (gateway_id))
+    return ingest.drain_queue(gateway_id)
+
+
+def schedule_ingest_drain(gateway_id):
+    # Only one drain is scheduled per gateway and delay, so the payloads
+    # received meanwhile are stored together
+    delay = settings.MEGEDC_X6GATEAPI_INGEST_DRAIN_DELAY
+    if cache.add(INGEST_DRAIN_CACHE_KEY % (gateway_id), True, timeout=delay):
+        on_commit(lambda: drain_ingest_queue.apply_async(
+            (gateway_id,), countdown=delay
+        ))
+
+
+@shared_task
+def send_alarms_alerts(alarm_ids):
+    rt_alarms = apps.get_model('x6gateapi.RTAlarm').objects.filter(
+        id__in=alarm_ids
+    ).select_related('device', 'device__gateway').order_by('id')
+    rt_alarms = list(rt_alarms)
+    alerts = {}
+    alerts_qs = apps.get_model('x6gateapi.Alert').objects.filter(
+        enabled=True,
+        removed_at__isnull=True,
+        gateway_id__in=set(x.device.gateway_id for x in rt_alarms),
+    ).select_related('gateway')
+    for alert in alerts_qs.iterator():
+        key = (alert.gateway_id, alert.device_channel, alert.device_id)
+        alerts.setdefault(key, []).append(alert)
+    sends = 0
+    for rt_alarm in rt_alarms:
+        device = rt_alarm.device
+        key = (device.gateway_id, device.channel, device.id)
+        for alert in alerts.get(key, []):
+            alert.send(rt_alarm)
+            sends += 1
+    return sends
+
+
+@shared_task
+def maintain_partitions():
+    return partitions.maintain()
+
+
+@shared_task
+def update_rollups():
+    return rollups.update_all()
+
+
+@shared_task
+def enforce_retention():
+    return retention.enforce()
+
+
+@shared_task
+def purge_removed():
+    return [
+        (log.table, log.rows, log.owned_rows) for log in purge.purge()
+    ]
+
+
+@shared_task
+def archive_cold_data():
+    return [archive.path for archive in archives.archive()]
@@ -1,15 +1,49 @@
+import gzip
+import io
+import json
+import msgpack
+import os
+import pytz
+import tempfile
 import uuid
+import zstandard
+from datetime import datetime, timedelta
 from django.apps import apps
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django_redis.exceptions import ConnectionInterrupted
 from faker import Faker
+from megedc.billing.measue_calculators import (
+    BussParkWConsumption, PlzRAirConditioningConsumption
+)
+from megedc.data_export.admin import ExportDataAdmin
+from megedc.data_export.models import DataExport
+from megedc.x6gateapi import (
+    archives, ingest, parsers, partitions, purge, resolver, retention,
+    rollups, tasks
+)
 from rest_framework import status
+from rest_framework.exceptions import ParseError
 from rest_framework.test import APITestCase
+from types import SimpleNamespace
+from unittest import mock
 
 
 class X6GateApiTestCase(APITestCase):
 
     faker = Faker()
 
+    def setUp(self):
+        resolver.clear()
+        cache.delete_pattern(ingest.IDEMPOTENCY_KEY.replace('%s', '*'))
+
     def test_create_gateway(self):
         client = apps.get_model('general.client').objects.create(
             name=self.faker.country(),
@@ -610,6 +644,23 @@ class X6GateApiTestCase(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+        # Device sin id
+        response = self.client.post(
+            reverse(
+                'x6gateapi:rtdata-create',
+                kwargs={
+                    'project_uuid': str(project.uuid),
+                    'sn': gateway.sn
+                }
+            ),
+            {
+                "logdt": in_data['logdt'],
+                "device": [{"channel": device.channel, "node": []}]
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
         # Normal
         response = self.client.post(
             reverse(
@@ -708,3 +759,1752 @@ class X6GateApiTestCase(APITestCase):
                 discard=False
             )
         )
+
+    def test_create_data_node_bulk(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        url = reverse(
+            'x6gateapi:rtdata-create',
+            kwargs={
+                'project_uuid': str(project.uuid),
+                'sn': gateway.sn
+            }
+        )
+
+        def make_data(logdt, devices_count):
+            return {
+                "logdt": logdt,
+                "device": [
+                    {
+                        "id": str(i),
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_%s" % (j),
+                                "value": str(self.faker.random_number(3)),
+                                "unit": "kWh",
+                                "dblink": "dblink_%s" % (j),
+                            }
+                            for j in range(3)
+                        ]
+                    }
+                    for i in range(devices_count)
+                ]
+            }
+
+        # Devices nuevos
+        response = self.client.post(
+            url, make_data("2016-02-19 00:05:00", 10), format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(gateway.devices.count(), 10)
+        self.assertEqual(
+            apps.get_model('x6gateapi.DataNone').objects.filter(
+                data__gateway=gateway,
+                device__name='no name',
+                discard=True
+            ).count(),
+            30
+        )
+
+        # Las consultas no dependen de la cantidad de devices
+        with CaptureQueriesContext(connection) as one_device:
+            response = self.client.post(
+                url, make_data("2016-02-19 00:10:00", 1), format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as ten_devices:
+            response = self.client.post(
+                url, make_data("2016-02-19 00:15:00", 10), format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(one_device), len(ten_devices))
+        self.assertEqual(gateway.devices.count(), 10)
+
+    def test_create_data_node_batch(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1,
+            time_zone=pytz.timezone('America/Panama')
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+
+        def make_frame(logdt):
+            return {
+                "logdt": logdt,
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_1",
+                                "value": str(self.faker.random_number(3)),
+                                "unit": "kWh",
+                                "dblink": "dblink_1",
+                            }
+                        ]
+                    }
+                ]
+            }
+
+        now = datetime.now(pytz.timezone('America/Panama'))
+        logdts = [
+            (now - timedelta(minutes=x)).strftime('%Y-%m-%d %H:%M:00')
+            for x in [0, 5, 10]
+        ]
+
+        # Frame recibido en vivo
+        response = self.client.post(
+            reverse(
+                'x6gateapi:rtdata-create',
+                kwargs={
+                    'project_uuid': str(project.uuid),
+                    'sn': gateway.sn
+                }
+            ),
+            make_frame(logdts[0]),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        url = reverse(
+            'x6gateapi:rtdata-batch-create',
+            kwargs={
+                'project_uuid': str(project.uuid),
+                'sn': gateway.sn
+            }
+        )
+        frames = [
+            make_frame(logdts[0]),
+            make_frame(logdts[1]),
+            make_frame(logdts[2]),
+            make_frame(logdts[2]),
+        ]
+        response = self.client.post(url, {'frames': frames}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['duplicated'], 2)
+        self.assertEqual(gateway.data.count(), 3)
+        self.assertEqual(
+            apps.get_model('x6gateapi.DataNone').objects.filter(
+                data__gateway=gateway
+            ).count(),
+            3
+        )
+        rt_data = gateway.data.get(logdt=logdts[1])
+        self.assertEqual(
+            rt_data.date_time.astimezone(now.tzinfo).strftime(
+                '%Y-%m-%d %H:%M:%S'
+            ),
+            logdts[1]
+        )
+
+        # Reenvio
+        response = self.client.post(url, frames, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(response.data['duplicated'], 4)
+
+        # logdt invalido
+        response = self.client.post(
+            url, [make_frame("no date")], format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Device sin id
+        frame = make_frame(logdts[2])
+        del frame['device'][0]['id']
+        response = self.client.post(url, [frame], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Reenvio con Idempotency-Key
+        frames = [
+            make_frame(
+                (now - timedelta(minutes=15)).strftime('%Y-%m-%d %H:%M:00')
+            )
+        ]
+        for created in [1, None]:
+            response = self.client.post(
+                url, frames, format='json', HTTP_IDEMPOTENCY_KEY='batch-1'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                response.data and response.data['created'], created
+            )
+        self.assertEqual(gateway.data.count(), 4)
+
+    @override_settings(MEGEDC_X6GATEAPI_ASYNC_INGEST=True)
+    def test_async_ingest(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        kwargs = {
+            'project_uuid': str(project.uuid),
+            'sn': gateway.sn
+        }
+        rt_data = {
+            "logdt": "2016-02-19 00:05:00",
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "node": [
+                        {
+                            "name": "var_1",
+                            "value": "10",
+                            "unit": "kWh",
+                            "dblink": "dblink_1",
+                        }
+                    ]
+                }
+            ]
+        }
+        rt_data_logdt = "2016-02-19 00:10:00"
+        alarm_data = {
+            "node": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "logdt": "2016-02-19 00:05:00",
+                    "name": "alarm_1",
+                    "value": "1",
+                    "type": "MMG_GET_VALUE_ERROR",
+                    "flag": "M",
+                }
+            ]
+        }
+        trend_log_data = {
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "trendlog": [
+                        {
+                            "dblink": "dblink_1",
+                            "name": "var_1",
+                            "data": [
+                                {
+                                    "date_time": "2016-02-19 00:00:00",
+                                    "value": "10",
+                                    "unit": "kWh",
+                                },
+                                {
+                                    "date_time": "2016-02-19 00:15:00",
+                                    "value": "11",
+                                    "unit": "kWh",
+                                }
+                            ]
+                        }
+                    ]
+                }
+            ]
+        }
+
+        for url_name, data in [
+            ('x6gateapi:rtdata-create', rt_data),
+            ('x6gateapi:rtdata-create', dict(rt_data, logdt=rt_data_logdt)),
+            ('x6gateapi:rtdata-create', rt_data),
+            ('x6gateapi:alarmdata-create', alarm_data),
+            ('x6gateapi:trendlogdata-create', trend_log_data),
+        ]:
+            response = self.client.post(
+                reverse(url_name, kwargs=kwargs), data, format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        # Lote de frames, se encola el payload validado
+        response = self.client.post(
+            reverse('x6gateapi:rtdata-batch-create', kwargs=kwargs),
+            [dict(rt_data, logdt="2016-02-19 00:20:00", extra="x")],
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(
+            gateway.ingest_items.latest('id').payload,
+            [dict(rt_data, logdt="2016-02-19 00:20:00")]
+        )
+
+        # Payload invalido
+        response = self.client.post(
+            reverse('x6gateapi:rtdata-create', kwargs=kwargs),
+            {"device": [{"id": "1"}]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(gateway.ingest_items.count(), 5)
+        self.assertEqual(gateway.data.count(), 0)
+
+        result = ingest.drain_queue(gateway.id)
+        self.assertEqual(result[gateway.id], {'stored': 5, 'failed': 0})
+        self.assertEqual(gateway.ingest_items.count(), 0)
+        self.assertEqual(gateway.data.count(), 3)
+        self.assertEqual(gateway.devices.count(), 1)
+        device = gateway.devices.get()
+        self.assertEqual(device.nodes.count(), 3)
+        self.assertEqual(device.alarms.count(), 1)
+        self.assertEqual(device.trend_log_data.count(), 2)
+
+    def test_create_alarm_data(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        apps.get_model('x6gateapi.alert').objects.create(
+            name=self.faker.user_name(),
+            emails=['alert@example.com'],
+            device_channel='1',
+            device_id='1',
+            subject_template='{{ alarm.name }}',
+            msg_template='{{ alarm.value }}',
+            gateway=gateway,
+        )
+        kwargs = {
+            'project_uuid': str(project.uuid),
+            'sn': gateway.sn
+        }
+        alarm_data = {
+            "node": [
+                {
+                    "id": str(i % 3),
+                    "channel": "1",
+                    "logdt": "2016-02-19 00:05:00",
+                    "name": "alarm_%s" % (i),
+                    "value": "1",
+                    "type": "MMG_GET_VALUE_ERROR",
+                    "flag": "M",
+                }
+                for i in range(30)
+            ]
+        }
+        url = reverse('x6gateapi:alarmdata-create', kwargs=kwargs)
+
+        # Sin envio de alertas por defecto
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                url, {"node": alarm_data["node"][:3]}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(callbacks), 0)
+        apps.get_model('x6gateapi.rtalarm').objects.filter(
+            device__gateway=gateway
+        ).delete()
+
+        with self.captureOnCommitCallbacks() as callbacks, \
+                self.settings(MEGEDC_X6GATEAPI_ALARM_ALERTS=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, alarm_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(callbacks), 1)
+        inserts = [
+            x for x in queries.captured_queries
+            if x['sql'].startswith('INSERT INTO "x6gateapi_rtalarm"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+        alarm_model = apps.get_model('x6gateapi.rtalarm')
+        alarms = alarm_model.objects.filter(device__gateway=gateway)
+        self.assertEqual(alarms.count(), 30)
+        self.assertEqual(gateway.devices.count(), 3)
+        self.assertEqual(len(mail.outbox), 0)
+
+        alarm_ids = list(alarms.values_list('id', flat=True))
+        self.assertEqual(tasks.send_alarms_alerts(alarm_ids), 10)
+        self.assertEqual(len(mail.outbox), 10)
+
+    def test_idempotent_ingest(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        kwargs = {
+            'project_uuid': str(project.uuid),
+            'sn': gateway.sn
+        }
+        rt_data = {
+            "logdt": "2016-02-19 00:05:00",
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "node": [
+                        {
+                            "name": "var_1",
+                            "value": "10",
+                            "unit": "kWh",
+                            "dblink": "dblink_1",
+                        }
+                    ]
+                }
+            ]
+        }
+        alarm_data = {
+            "node": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "logdt": "2016-02-19 00:05:00",
+                    "name": "alarm_1",
+                    "value": "1",
+                    "type": "MMG_GET_VALUE_ERROR",
+                    "flag": "M",
+                }
+            ]
+        }
+        rtdata_url = reverse('x6gateapi:rtdata-create', kwargs=kwargs)
+        alarm_url = reverse('x6gateapi:alarmdata-create', kwargs=kwargs)
+
+        response = self.client.post(rtdata_url, rt_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Reintento sin tocar la base de datos
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(rtdata_url, rt_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(gateway.data.count(), 1)
+
+        # Idempotency-Key header
+        for _ in range(2):
+            response = self.client.post(
+                alarm_url,
+                alarm_data,
+                format='json',
+                HTTP_IDEMPOTENCY_KEY='alarm-1'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            apps.get_model('x6gateapi.rtalarm').objects.filter(
+                device__gateway=gateway
+            ).count(),
+            1
+        )
+
+        # Payload en proceso por otra peticion
+        key = ingest.idempotency_key(
+            gateway, ingest.INGEST_RTDATA, {'logdt': '2016-02-19 00:10:00'}
+        )
+        self.assertIsNone(ingest.idempotency_claim(key))
+        response = self.client.post(
+            rtdata_url, dict(rt_data, logdt='2016-02-19 00:10:00'),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        ingest.idempotency_release(key)
+        response = self.client.post(
+            rtdata_url, dict(rt_data, logdt='2016-02-19 00:10:00'),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(gateway.data.count(), 2)
+
+    def test_compact_wire_formats(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        url = reverse('x6gateapi:rtdata-create', kwargs={
+            'project_uuid': str(project.uuid),
+            'sn': gateway.sn
+        })
+
+        def rt_data(logdt):
+            return {
+                "logdt": logdt,
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_1",
+                                "value": "10",
+                                "unit": "kWh",
+                                "dblink": "dblink_1",
+                            }
+                        ]
+                    }
+                ]
+            }
+
+        for body, content_type, encoding in [
+            (
+                gzip.compress(
+                    json.dumps(rt_data('2016-02-19 00:05:00')).encode()
+                ),
+                'application/json',
+                'gzip'
+            ),
+            (
+                msgpack.packb(rt_data('2016-02-19 00:10:00')),
+                'application/msgpack',
+                None
+            ),
+            (
+                zstandard.ZstdCompressor().compress(
+                    msgpack.packb(rt_data('2016-02-19 00:15:00'))
+                ),
+                'application/x-msgpack',
+                'zstd'
+            ),
+        ]:
+            extra = {}
+            if encoding is not None:
+                extra['HTTP_CONTENT_ENCODING'] = encoding
+            response = self.client.post(
+                url, body, content_type=content_type, **extra
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(gateway.data.count(), 3)
+        self.assertEqual(
+            apps.get_model('x6gateapi.datanone').objects.filter(
+                device__gateway=gateway
+            ).count(),
+            3
+        )
+
+        response = self.client.post(
+            url,
+            msgpack.packb(rt_data('2016-02-19 00:20:00')),
+            content_type='application/msgpack',
+            HTTP_CONTENT_ENCODING='br'
+        )
+        self.assertEqual(
+            response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+        response = self.client.post(
+            url,
+            b'not gzip',
+            content_type='application/json',
+            HTTP_CONTENT_ENCODING='gzip'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with override_settings(MEGEDC_X6GATEAPI_MAX_DECODED_SIZE=64):
+            response = self.client.post(
+                url,
+                gzip.compress(
+                    json.dumps(rt_data('2016-02-19 00:25:00')).encode()
+                ),
+                content_type='application/json',
+                HTTP_CONTENT_ENCODING='gzip'
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(gateway.data.count(), 3)
+
+        # Un frame zstd truncado no se ingesta en parte
+        body = zstandard.ZstdCompressor().compress(b'[' + b'1,' * 1000 + b'1]')
+        self.assertEqual(
+            parsers.decode_body(io.BytesIO(body), 'zstd').read(),
+            b'[' + b'1,' * 1000 + b'1]'
+        )
+        with self.assertRaises(ParseError):
+            parsers.decode_body(io.BytesIO(body[:-4]), 'zstd')
+
+    @override_settings(MEGEDC_SERVER_TIMING_HEADER=True)
+    def test_server_timing(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        url = reverse('x6gateapi:rtdata-create', kwargs={
+            'project_uuid': str(project.uuid),
+            'sn': gateway.sn
+        })
+        in_data = {
+            "logdt": "2016-02-19 00:05:00",
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "node": [
+                        {
+                            "name": "var_1",
+                            "value": "10",
+                            "unit": "kWh",
+                            "dblink": "dblink_1",
+                        }
+                    ]
+                }
+            ]
+        }
+        with self.assertLogs('megedc.timing', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        server_timing = response['Server-Timing']
+        self.assertIn('db;dur=', server_timing)
+        self.assertIn('"%s queries"' % (len(queries)), server_timing)
+        self.assertIn('redis;dur=', server_timing)
+        self.assertIn('app;dur=', server_timing)
+        log_data = json.loads(logs.records[0].getMessage())
+        self.assertEqual(log_data['url_name'], 'x6gateapi:rtdata-create')
+        self.assertEqual(log_data['status'], status.HTTP_200_OK)
+        self.assertEqual(log_data['db_queries'], len(queries))
+        self.assertGreater(log_data['redis_calls'], 0)
+
+        # Sin cabecera por defecto
+        with override_settings(MEGEDC_SERVER_TIMING_HEADER=False):
+            response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_num_value(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        url = reverse('x6gateapi:rtdata-create', kwargs={
+            'project_uuid': str(project.uuid),
+            'sn': gateway.sn
+        })
+        values = {
+            'var_1': ('10.5', 10.5),
+            'var_2': (' -2e3 ', -2000.0),
+            'var_3': ('ERR', None),
+            'var_4': ('nan', None),
+            'var_5': ('', None),
+            'var_6': ('1e400', None),
+        }
+        in_data = {
+            "logdt": "2016-02-19 00:05:00",
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "node": [
+                        {
+                            "name": name,
+                            "value": value,
+                            "unit": "kWh",
+                            "dblink": "dblink_%s" % (name),
+                        }
+                        for name, (value, _) in values.items()
+                    ]
+                }
+            ]
+        }
+        response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        device = gateway.devices.get()
+        for node in device.nodes.all():
+            self.assertEqual(node.num_value, values[node.name][1])
+
+        node = device.nodes.get(name='var_3')
+        node.value = '7'
+        node.save(update_fields=['value'])
+        node.refresh_from_db()
+        self.assertEqual(node.num_value, 7.0)
+
+        # Backfill de filas sin num_value
+        device.nodes.update(num_value=None)
+        call_command('backfill_num_value', chunk_size=2, stdout=io.StringIO())
+        for node in device.nodes.exclude(name='var_3'):
+            self.assertEqual(node.num_value, values[node.name][1])
+        self.assertEqual(device.nodes.get(name='var_3').num_value, 7.0)
+
+        # Los calculadores saltan los valores no numericos
+        ingest.ingest_trend_log(gateway, {
+            "device": [{"id": "1", "channel": "1", "trendlog": [{
+                "dblink": "dblink_t",
+                "name": "var_t",
+                "data": [
+                    {"date_time": "2016-02-19 00:%02d:00" % (minute),
+                     "value": value}
+                    for minute, value in [(0, '10'), (15, '12'), (30, 'ERR')]
+                ]
+            }]}]
+        })
+        start_trend, end_trend = (
+            PlzRAirConditioningConsumption().get_min_max_trends(
+                SimpleNamespace(local=SimpleNamespace(project=project)),
+                {'name': 'var_t', 'device_id': device.dev_id},
+                datetime(2016, 2, 19, tzinfo=timezone.utc),
+                datetime(2016, 2, 19, 1, tzinfo=timezone.utc)
+            )
+        )
+        self.assertEqual(
+            (start_trend.num_value, end_trend.num_value), (10.0, 12.0)
+        )
+
+    def test_variables(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        url = reverse('x6gateapi:rtdata-create', kwargs={
+            'project_uuid': str(project.uuid),
+            'sn': gateway.sn
+        })
+
+        def rt_data(logdt, unit):
+            return {
+                "logdt": logdt,
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_%s" % (i),
+                                "value": "10",
+                                "unit": unit,
+                                "dblink": "dblink_%s" % (i),
+                            }
+                            for i in range(3)
+                        ]
+                    }
+                ]
+            }
+
+        for logdt, unit in [
+            ('2016-02-19 00:05:00', 'kWh'),
+            ('2016-02-19 00:10:00', 'kWh'),
+            ('2016-02-19 00:15:00', 'Wh'),
+        ]:
+            response = self.client.post(
+                url, rt_data(logdt, unit), format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        device = gateway.devices.get()
+        self.assertEqual(device.variables.count(), 3)
+        variable = device.variables.get(name='var_0')
+        self.assertEqual(variable.dblink, 'dblink_0')
+        self.assertEqual(variable.unit, 'kWh')
+        nodes = device.nodes.filter(name='var_0')
+        self.assertEqual(nodes.filter(variable=variable).count(), 3)
+        self.assertEqual(nodes.filter(raw_dblink__isnull=True).count(), 3)
+        self.assertEqual(nodes.filter(raw_unit__isnull=True).count(), 2)
+        self.assertEqual(nodes.filter(unit='kWh').count(), 2)
+        self.assertEqual(nodes.filter(unit='Wh').count(), 1)
+        self.assertEqual(nodes.filter(dblink='dblink_0').count(), 3)
+        self.assertEqual(nodes.exclude(Q(unit='kWh')).count(), 1)
+        self.assertEqual(
+            list(nodes.order_by('unit', 'dblink').values_list(
+                'unit', flat=True
+            )),
+            ['Wh', 'kWh', 'kWh']
+        )
+        for node in nodes.select_related('data'):
+            self.assertEqual(node.dblink, 'dblink_0')
+            self.assertEqual(
+                node.unit,
+                'Wh' if node.data.logdt == '2016-02-19 00:15:00' else 'kWh'
+            )
+
+        # Las variables de los nodos guardados salen del resolver
+        rt_data = gateway.data.first()
+        with CaptureQueriesContext(connection) as queries:
+            node = device.nodes.create(
+                name='var_1', value='11', unit='kWh', dblink='dblink_1',
+                data=rt_data, device=device
+            )
+        self.assertEqual(node.variable.name, 'var_1')
+        self.assertIsNone(node.raw_dblink)
+        self.assertFalse([
+            x for x in queries.captured_queries
+            if 'x6gateapi_variable' in x['sql']
+        ])
+        node.delete()
+
+        # Filas previas al catalogo de variables
+        device.nodes.update(variable=None, raw_dblink='dblink', raw_unit='V')
+        device.variables.all().delete()
+        call_command('backfill_variables', chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(device.variables.count(), 3)
+        self.assertEqual(device.nodes.filter(variable__isnull=True).count(), 0)
+        self.assertEqual(device.nodes.filter(raw_unit__isnull=True).count(), 9)
+        self.assertEqual(
+            device.nodes.filter(unit='V').count(), 9
+        )
+        # Los dispositivos creados en la ingesta no estan listos
+        self.assertEqual(
+            list(device.variables.values_list(
+                'has_discarded_nodes', flat=True
+            )),
+            [True, True, True]
+        )
+
+    def test_partitions(self):
+        now = datetime(2026, 10, 18, 12, tzinfo=pytz.utc)
+        for table in ['x6gateapi_rtdata', 'x6gateapi_datanone']:
+            partitions.convert_table(table, months_ahead=2, now=now)
+            self.assertTrue(partitions.is_partitioned(table))
+            self.assertEqual(
+                [name for _, name in partitions.month_partitions(table)],
+                [table + '_p202611', table + '_p202612', table + '_p202701']
+            )
+        with self.assertRaises(partitions.PartitionError):
+            partitions.convert_table('x6gateapi_rtdata', now=now)
+
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        frames = [
+            {
+                "logdt": logdt,
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_1",
+                                "value": "10",
+                                "unit": "kWh",
+                                "dblink": "dblink_1",
+                            }
+                        ]
+                    }
+                ]
+            }
+            for logdt in ['2026-10-10 00:00:00', '2026-11-10 00:00:00']
+        ]
+        created, _ = ingest.ingest_rtdata_batch(gateway, frames)
+        self.assertEqual(created, 2)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM x6gateapi_datanone_p202611')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('SELECT COUNT(*) FROM x6gateapi_datanone_legacy')
+            self.assertEqual(cursor.fetchone()[0], 1)
+        node = apps.get_model('x6gateapi.datanone').objects.filter(
+            date_time__gte=datetime(2026, 11, 1, tzinfo=pytz.utc)
+        ).select_related('data').get()
+        self.assertEqual(node.date_time, node.data.date_time)
+
+        # Las tramas fuera de las particiones van a la particion por defecto
+        frames[0]['logdt'] = '2027-06-10 00:00:00'
+        created, _ = ingest.ingest_rtdata_batch(gateway, frames[:1])
+        self.assertEqual(created, 1)
+        with connection.cursor() as cursor:
+            for table in ['x6gateapi_rtdata', 'x6gateapi_datanone']:
+                cursor.execute('SELECT COUNT(*) FROM %s_default' % (table))
+                self.assertEqual(cursor.fetchone()[0], 1)
+        gateway.nodes.filter(data__logdt=frames[0]['logdt']).delete()
+        gateway.data.filter(logdt=frames[0]['logdt']).delete()
+
+        # Las tablas con eventos de triggers pendientes no se pueden borrar
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        with override_settings(
+            MEGEDC_PARTITIONS_RETENTION_MONTHS=1,
+            MEGEDC_PARTITIONS_DROP_DETACHED=True
+        ):
+            result = partitions.maintain(now=now + timedelta(days=90))
+        self.assertEqual(result['x6gateapi_datanone'], {
+            'created': [
+                'x6gateapi_datanone_p202702',
+                'x6gateapi_datanone_p202703',
+                'x6gateapi_datanone_p202704',
+            ],
+            'detached': [
+                'x6gateapi_datanone_legacy', 'x6gateapi_datanone_p202611'
+            ],
+        })
+        self.assertNotIn('x6gateapi_rtalarm', result)
+        self.assertEqual(
+            apps.get_model('x6gateapi.datanone').objects.count(), 0
+        )
+
+        # Las claves unicas sin la columna de particion no se pierden
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'ALTER TABLE x6gateapi_rtalarm'
+                ' ADD CONSTRAINT x6gateapi_rtalarm_logdt_uniq UNIQUE (logdt)'
+            )
+        with self.assertRaisesMessage(
+            partitions.PartitionError, 'x6gateapi_rtalarm_logdt_uniq'
+        ):
+            partitions.convert_table('x6gateapi_rtalarm', now=now)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'ALTER TABLE x6gateapi_rtalarm'
+                ' DROP CONSTRAINT x6gateapi_rtalarm_logdt_uniq'
+            )
+
+        # Las filas de la particion por defecto pasan al nuevo mes
+        with override_settings(MEGEDC_PARTITIONS_DEFAULT=True):
+            partitions.convert_table(
+                'x6gateapi_rtalarm', months_ahead=0, now=now
+            )
+        alarm = apps.get_model('x6gateapi.rtalarm').objects.create(
+            name='alarm_1',
+            device=gateway.devices.get()
+        )
+        alarm.date_time = datetime(2027, 3, 10, tzinfo=pytz.utc)
+        alarm.save()
+        self.assertIn(
+            'x6gateapi_rtalarm_p202703',
+            partitions.ensure_partitions(
+                'x6gateapi_rtalarm', months_ahead=6, now=now
+            )
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM x6gateapi_rtalarm_default')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute('SELECT COUNT(*) FROM x6gateapi_rtalarm_p202703')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_node_frame_copies(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        frames = [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_1",
+                                "value": str(value),
+                                "unit": "kWh",
+                                "dblink": "dblink_1",
+                            }
+                        ]
+                    }
+                ]
+            }
+            for minute, value in [(5, 10), (10, 15), (15, 30)]
+        ]
+        device = gateway.devices.create(channel='1', id='1', ready=True)
+        ingest.ingest_rtdata_batch(gateway, frames)
+        for node in device.nodes.select_related('data'):
+            self.assertEqual(node.gateway_id, gateway.id)
+            self.assertEqual(node.date_time, node.data.date_time)
+            self.assertFalse(node.data_discard)
+
+        # Descartar una trama se copia a sus nodos
+        discard_action = ExportDataAdmin.discard_action()
+        last_data = gateway.data.order_by('-date_time')[:1]
+        discard_action(None, None, DataExport.objects.filter(
+            pk__in=last_data.values('pk')
+        ))
+        self.assertEqual(
+            list(device.nodes.filter(data_discard=True).values_list(
+                'value', flat=True
+            )),
+            ['30']
+        )
+        calculator = BussParkWConsumption()
+        start_date = gateway.data.order_by('date_time').first().date_time
+        end_date = start_date + timedelta(hours=1)
+        values = calculator._get_rtdata_values(
+            device, 'var_1', start_date, end_date
+        )
+        self.assertEqual([x[1] for x in values], [10.0, 15.0])
+        self.assertEqual(
+            calculator._get_rtdata_demand(
+                device, 'var_1', start_date, end_date
+            ),
+            15.0
+        )
+        # Las tramas borradas no cuentan aunque sus nodos no lo esten
+        rollups.soft_delete_frames(
+            gateway.data.filter(logdt__endswith='10:00'), timezone.now()
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                calculator._get_rtdata_demand(
+                    device, 'var_1', start_date, end_date
+                ),
+                10.0
+            )
+            calculator._get_rtdata_values(
+                device, 'var_1', start_date, end_date
+            )
+        # Sin join con las tramas
+        self.assertFalse([
+            x for x in queries if 'x6gateapi_rtdata' in x['sql']
+        ])
+        gateway.data.update(removed_at=None)
+        device.nodes.update(data_removed_at=None)
+
+        # Backfill de nodos sin las copias de la trama
+        device.nodes.update(date_time=None, gateway=None, data_discard=False)
+        call_command('backfill_nodes', chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(device.nodes.filter(gateway=gateway).count(), 3)
+        self.assertEqual(device.nodes.filter(data_discard=True).count(), 1)
+        self.assertFalse(device.nodes.filter(date_time__isnull=True).exists())
+
+    def test_rollups(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1,
+            time_zone=pytz.timezone('America/Panama')
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        frames = [
+            {
+                "logdt": "2016-02-19 %s" % (logdt),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_1",
+                                "value": str(value),
+                                "unit": "kWh",
+                                "dblink": "dblink_1",
+                            }
+                        ]
+                    }
+                ]
+            }
+            for logdt, value in [
+                ('18:30:00', 10), ('18:45:00', 5), ('19:10:00', 30)
+            ]
+        ]
+        device = gateway.devices.create(channel='1', id='1', ready=True)
+        ingest.ingest_rtdata_batch(gateway, frames)
+        rollups.update(rollups.ROLLUP_RTDATA)
+        hourly = apps.get_model('x6gateapi.hourlyrollup').objects.filter(
+            device=device, name='var_1'
+        ).order_by('period_start')
+        self.assertEqual([x.count for x in hourly], [2, 1])
+        daily_rollups = apps.get_model('x6gateapi.dailyrollup').objects.filter(
+            device=device, name='var_1'
+        )
+        daily = daily_rollups.get()
+        # El dia es el local del gateway, no el de UTC
+        self.assertEqual(daily.day.isoformat(), '2016-02-19')
+        self.assertEqual(daily.count, 3)
+        self.assertEqual(daily.min_value, 5.0)
+        self.assertEqual(daily.max_value, 30.0)
+        self.assertEqual(daily.sum_value, 45.0)
+        self.assertEqual(daily.first_value, 10.0)
+        self.assertEqual(daily.last_value, 30.0)
+        self.assertEqual(daily.min_date_time, hourly[0].last_date_time)
+
+        # Descartar una trama ya procesada recalcula sus rollups
+        discard_action = ExportDataAdmin.discard_action()
+        last_data = gateway.data.order_by('-date_time')[:1]
+        discard_action(None, None, DataExport.objects.filter(
+            pk__in=last_data.values('pk')
+        ))
+        rollups.update(rollups.ROLLUP_RTDATA)
+        self.assertEqual([x.count for x in hourly.all()], [2])
+        daily = daily_rollups.get()
+        self.assertEqual(daily.count, 2)
+        self.assertEqual(daily.last_value, 5.0)
+
+        # Editar un nodo tambien
+        node = device.nodes.get(value='10')
+        node.value = '20'
+        node.save()
+        rollups.update(rollups.ROLLUP_RTDATA)
+        daily = daily_rollups.get()
+        self.assertEqual(daily.sum_value, 25.0)
+
+        # Reconstruir desde los datos crudos da el mismo resultado
+        daily_rollups.delete()
+        call_command(
+            'rebuild_rollups', device=[device.dev_id], stdout=io.StringIO()
+        )
+        rebuilt = daily_rollups.get()
+        self.assertEqual(
+            (rebuilt.day, rebuilt.count, rebuilt.sum_value),
+            (daily.day, 2, 25.0)
+        )
+
+        # Borrar los nodos los quita de los rollups
+        rollups.soft_delete(
+            rollups.ROLLUP_RTDATA, device.nodes.all(), timezone.now()
+        )
+        rollups.update(rollups.ROLLUP_RTDATA)
+        self.assertFalse(hourly.all().exists())
+        self.assertFalse(daily_rollups.exists())
+
+    def test_retention(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        now = timezone.now()
+        old = (now - timedelta(days=40)).replace(hour=12, minute=0)
+        frames = [
+            {
+                "logdt": date_time.strftime('%Y-%m-%d %H:%M:%S'),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_1",
+                                "value": str(value),
+                                "unit": "kWh",
+                                "dblink": "dblink_1",
+                            }
+                        ]
+                    }
+                ]
+            }
+            for date_time, value in [
+                (old, 10),
+                (old + timedelta(minutes=5), 20),
+                (now - timedelta(days=1), 30),
+            ]
+        ]
+        device = gateway.devices.create(channel='1', id='1', ready=True)
+        ingest.ingest_rtdata_batch(gateway, frames)
+        rollups.update(rollups.ROLLUP_RTDATA)
+        # Nodo sin la copia de la fecha de la trama
+        device.nodes.create(
+            name='var_2', value='1', data=gateway.data.order_by('id')[0],
+            device=device
+        )
+        device.nodes.filter(name='var_2').update(date_time=None)
+        policy_model = apps.get_model('x6gateapi.retentionpolicy')
+        # La del gateway se usa antes que la del proyecto
+        policy_model.objects.create(
+            name='project', project=project, raw_days=10
+        )
+        policy_model.objects.create(
+            name='gateway', gateway=gateway, raw_days=30, hourly_rollup_days=35
+        )
+        self.assertEqual(
+            [(x.id, y.name) for x, y in retention.gateways_policies()],
+            [(gateway.id, 'gateway')]
+        )
+        retention.enforce(now)
+        self.assertEqual(
+            list(device.nodes.values_list('value', flat=True)), ['30']
+        )
+        # Las variables sin nodos quedan sin estadisticas
+        self.assertEqual(
+            list(device.variables.order_by('name').values_list(
+                'name', 'has_valid_nodes'
+            )),
+            [('var_1', True), ('var_2', False)]
+        )
+        self.assertEqual(gateway.data.count(), 1)
+        # El dia borrado queda en los rollups diarios, no en los horarios
+        daily_rollups = apps.get_model('x6gateapi.dailyrollup').objects.filter(
+            device=device, name='var_1'
+        )
+        self.assertEqual(
+            list(daily_rollups.order_by('day').values_list(
+                'count', 'sum_value'
+            )),
+            [(2, 30.0), (1, 30.0)]
+        )
+        self.assertEqual(
+            list(apps.get_model('x6gateapi.hourlyrollup').objects.filter(
+                device=device
+            ).values_list('count', 'sum_value')),
+            [(1, 30.0)]
+        )
+
+        # Reconstruir no borra los rollups sin datos crudos
+        call_command(
+            'rebuild_rollups', device=[device.dev_id], stdout=io.StringIO()
+        )
+        self.assertEqual(
+            list(daily_rollups.order_by('day').values_list(
+                'count', flat=True
+            )),
+            [2, 1]
+        )
+        # Ni recalcular las horas borradas
+        rollups.refresh(rollups.ROLLUP_RTDATA, {
+            (device.dev_id, 'var_1', old.replace(second=0, microsecond=0))
+        })
+        self.assertEqual(
+            list(daily_rollups.order_by('day').values_list(
+                'count', flat=True
+            )),
+            [2, 1]
+        )
+
+    @override_settings(MEGEDC_PURGE_BATCH_SIZE=2, MEGEDC_PURGE_SLEEP=0)
+    def test_purge_removed(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateways = [
+            apps.get_model('x6gateapi.gateway').objects.create(
+                sn=self.faker.ssn(),
+                name=self.faker.user_name(),
+                site={},
+                owner={},
+                room={},
+                project=project
+            )
+            for _ in range(2)
+        ]
+        frames = [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_%s" % (index),
+                                "value": str(minute),
+                                "unit": "kWh",
+                                "dblink": "dblink_%s" % (index),
+                            }
+                            for index in range(2)
+                        ]
+                    }
+                ]
+            }
+            for minute in [5, 10, 15]
+        ]
+        for gateway in gateways:
+            gateway.devices.create(channel='1', id='1', ready=True)
+            ingest.ingest_rtdata_batch(gateway, frames)
+        now = timezone.now()
+        old = now - timedelta(days=40)
+        removed, kept = gateways
+        # Gateway borrado completo, como al borrar el proyecto
+        for queryset in [
+            removed.nodes.all(),
+            removed.data.all(),
+            removed.devices.all(),
+            apps.get_model('x6gateapi.gateway').objects.filter(pk=removed.pk),
+        ]:
+            queryset.update(removed_at=old)
+        # Un nodo borrado hace tiempo y otro dentro del periodo de gracia
+        kept_nodes = kept.nodes.order_by('id')
+        kept_nodes.filter(pk=kept_nodes[0].pk).update(removed_at=old)
+        kept_nodes.filter(pk=kept_nodes[1].pk).update(removed_at=now)
+        # Nodos huerfanos de un frame borrado sin ellos
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM x6gateapi_rtdata WHERE id = %s',
+                [kept.data.get(logdt="2016-02-19 00:15:00").id]
+            )
+        logs = purge.purge(now)
+        self.assertEqual(
+            sorted((x.table, x.rows, x.owned_rows) for x in logs),
+            [
+                ('x6gateapi_datanone', 2, 0),
+                ('x6gateapi_datanone', 7, 0),
+                ('x6gateapi_device', 1, 2),
+                ('x6gateapi_gateway', 1, 0),
+                ('x6gateapi_rtdata', 3, 0),
+            ]
+        )
+        self.assertFalse(apps.get_model('x6gateapi.gateway').objects.filter(
+            pk=removed.pk
+        ).exists())
+        self.assertEqual(kept.nodes.count(), 3)
+        self.assertEqual(kept.data.count(), 2)
+        self.assertEqual(
+            apps.get_model('x6gateapi.purgelog').objects.count(), 5
+        )
+
+    def test_cold_data_archive(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        device = gateway.devices.create(
+            channel='1', id='1', name='device_1', ready=True
+        )
+        ingest.ingest_rtdata_batch(gateway, [
+            {
+                "logdt": "2016-02-19 00:%02d:00" % (minute),
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "node": [
+                            {
+                                "name": "var_%s" % (index),
+                                "value": str(minute + index),
+                                "unit": "kWh",
+                                "dblink": "dblink_%s" % (index),
+                            }
+                            for index in range(2)
+                        ]
+                    }
+                ]
+            }
+            for minute in [5, 10, 15]
+        ])
+        ingest.ingest_trend_log(gateway, {
+            "device": [
+                {
+                    "id": "1",
+                    "channel": "1",
+                    "trendlog": [
+                        {
+                            "dblink": "dblink_1",
+                            "name": "var_1",
+                            "data": [
+                                {
+                                    "date_time": "2016-02-19 00:%02d:00" % (
+                                        minute
+                                    ),
+                                    "value": str(minute),
+                                    "unit": "kWh",
+                                }
+                                for minute in [0, 15, 30]
+                            ]
+                        }
+                    ]
+                }
+            ]
+        })
+        with tempfile.TemporaryDirectory() as archive_root:
+            with override_settings(
+                MEGEDC_ARCHIVE_ROOT=archive_root,
+                MEGEDC_ARCHIVE_AFTER_MONTHS=1,
+                MEGEDC_ARCHIVE_CHUNK_SIZE=3
+            ):
+                # El borrado espera al commit, el archivo ya existe
+                with self.captureOnCommitCallbacks() as callbacks:
+                    archived = archives.archive()
+                self.assertEqual(
+                    sorted((x.kind, x.rows, x.pending) for x in archived),
+                    [('rtdata', 6, True), ('trendlog', 3, True)]
+                )
+                self.assertTrue(gateway.data.exists())
+                self.assertTrue(all(
+                    os.path.exists(archives.archive_path(x))
+                    for x in archived
+                ))
+                # Las filas guardadas no se leen del archivo pendiente
+                for kind, _ in archives.ARCHIVE_KINDS:
+                    self.assertEqual(
+                        list(archives.archived_rows(kind, gateway.id)), []
+                    )
+                # Una trama queda entre dos lotes de borrado
+                for callback in callbacks:
+                    callback()
+                self.assertFalse(gateway.data.exists())
+                self.assertFalse(
+                    gateway.archives.filter(pending=True).exists()
+                )
+                self.assertFalse(device.nodes.exists())
+                self.assertFalse(device.trend_log_data.exists())
+
+                # Un archivo interrumpido antes del borrado no se duplica
+                ingest.ingest_rtdata_batch(gateway, [{
+                    "logdt": "2016-02-19 00:20:00",
+                    "device": [{
+                        "id": "1",
+                        "channel": "1",
+                        "node": [{"name": "var_0", "value": "20"}]
+                    }]
+                }])
+                with self.captureOnCommitCallbacks():
+                    archives.archive()
+                self.assertEqual(
+                    len(list(archives.archived_rows(
+                        archives.ARCHIVE_RTDATA, gateway.id
+                    ))),
+                    6
+                )
+                with self.captureOnCommitCallbacks(execute=True):
+                    archive = archives.archive()[0]
+                self.assertEqual(archive.rows, 7)
+                self.assertEqual(
+                    len(list(archives.archived_rows(
+                        archives.ARCHIVE_RTDATA, gateway.id
+                    ))),
+                    7
+                )
+                self.assertFalse(archive.pending)
+                self.assertFalse(gateway.data.exists())
+
+    def test_resolver_cache(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        device = apps.get_model('x6gateapi.device').objects.create(
+            channel='1',
+            id='1',
+            name=self.faker.user_name(),
+            gateway=gateway
+        )
+        url = reverse(
+            'x6gateapi:rtdata-create',
+            kwargs={
+                'project_uuid': str(project.uuid),
+                'sn': gateway.sn
+            }
+        )
+        in_data = {
+            "logdt": "2016-02-19 00:05:00",
+            "device": [
+                {
+                    "id": device.id,
+                    "channel": device.channel,
+                    "node": [
+                        {
+                            "name": "var_1",
+                            "value": "1",
+                            "unit": "kWh",
+                            "dblink": "dblink_1",
+                        }
+                    ]
+                }
+            ]
+        }
+        response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Project, gateway y devices desde el cache
+        in_data['logdt'] = "2016-02-19 00:10:00"
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for query in queries:
+            self.assertNotIn('FROM "general_project"', query['sql'])
+            self.assertNotIn('FROM "x6gateapi_gateway"', query['sql'])
+            self.assertNotIn('FROM "x6gateapi_device"', query['sql'])
+
+        # Cambios en el device invalidan el cache
+        device.ready = True
+        device.save()
+        in_data['logdt'] = "2016-02-19 00:15:00"
+        response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(device.nodes.filter(discard=False).count(), 1)
+
+        # Copias de las instancias en cache, no se comparten
+        devices = resolver.get_devices(gateway)
+        self.assertIsNot(
+            devices[('1', '1')], resolver.get_devices(gateway)[('1', '1')]
+        )
+
+        # Sin redis se lee de la base de datos
+        resolver.local_cache.clear()
+        with mock.patch.object(resolver, 'cache') as redis_cache, \
+                self.assertLogs('megedc.x6gateapi.resolver', 'WARNING'):
+            for method in ['get', 'set', 'delete_many']:
+                getattr(redis_cache, method).side_effect = (
+                    ConnectionInterrupted(None)
+                )
+            in_data['logdt'] = "2016-02-19 00:20:00"
+            in_data['device'][0]['node'].append(
+                {"name": "var_2", "value": "2"}
+            )
+            response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(device.nodes.filter(discard=False).count(), 3)
+        # Las variables nuevas se enlazan sin el cache
+        self.assertEqual(
+            device.nodes.filter(
+                name='var_2', variable__name='var_2'
+            ).count(),
+            1
+        )
+
+        # Cambios en el gateway invalidan el cache
+        gateway.enabled = False
+        gateway.save()
+        response = self.client.post(url, in_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_trend_log_data(self):
+        client = apps.get_model('general.client').objects.create(
+            name=self.faker.country(),
+            currency_model_id=1,
+            time_zone=pytz.timezone('America/Panama')
+        )
+        project = apps.get_model('general.project').objects.create(
+            name=self.faker.country(),
+            client=client,
+            currency_model_id=1
+        )
+        gateway = apps.get_model('x6gateapi.gateway').objects.create(
+            sn=self.faker.ssn(),
+            name=self.faker.user_name(),
+            site={},
+            owner={},
+            room={},
+            project=project
+        )
+        url = reverse(
+            'x6gateapi:trendlogdata-create',
+            kwargs={
+                'project_uuid': str(project.uuid),
+                'sn': gateway.sn
+            }
+        )
+
+        def make_data(values):
+            return {
+                "device": [
+                    {
+                        "id": "1",
+                        "channel": "1",
+                        "name": "device_1",
+                        "trendlog": [
+                            {
+                                "dblink": dblink,
+                                "name": "var_1",
+                                "data": [
+                                    {
+                                        "date_time": date_time,
+                                        "value": value,
+                                        "unit": "kWh",
+                                    }
+                                    for date_time, value in values
+                                ]
+                            }
+                            for dblink in ["dblink_1", None]
+                        ]
+                    }
+                ]
+            }
+
+        response = self.client.post(
+            url,
+            make_data([
+                ("2016-02-19 00:00:00", "10"),
+                ("2016-02-19 00:15:00", "11"),
+                ("2016-02-19 00:15:00", "12"),
+            ]),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        device = gateway.devices.get(channel='1', id='1')
+        self.assertEqual(device.name, 'device_1')
+        self.assertEqual(device.trend_log_data.count(), 4)
+        trend_log = device.trend_log_data.get(
+            dblink='dblink_1',
+            date_time=pytz.timezone('America/Panama').localize(
+                datetime(2016, 2, 19, 0, 15)
+            )
+        )
+        self.assertEqual(trend_log.value, '11')
+
+        # Los puntos existentes no se modifican
+        response = self.client.post(
+            url,
+            make_data([
+                ("2016-02-19 00:15:00", "13"),
+                ("2016-02-19 00:30:00", "14"),
+            ]),
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(device.trend_log_data.count(), 6)
+        trend_log.refresh_from_db()
+        self.assertEqual(trend_log.value, '11')
+
+        # date_time invalido
+        response = self.client.post(
+            url, make_data([("no date", "15")]), format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(device.trend_log_data.count(), 6)
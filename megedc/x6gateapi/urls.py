@@ -24,6 +24,11 @@ urls = (
             views.RTDataCreateApiView.as_view(),
             name='rtdata-create'
         ),
+        path(
+            '<str:project_uuid>/realdata/<str:sn>/batch',
+            views.RTDataBatchCreateApiView.as_view(),
+            name='rtdata-batch-create'
+        ),
         path(
             '<str:project_uuid>/alarmdata/<str:sn>',
             views.RTAlarmCreateApiView.as_view(),
@@ -1,15 +1,14 @@
-from datetime import datetime
-from django.apps import apps
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.transaction import atomic
 # from django.http import Http404
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import (
     GenericAPIView,
     RetrieveAPIView,
-    get_object_or_404
 )
-from megedc.x6gateapi import serializers
+from megedc.x6gateapi import ingest, parsers, resolver, serializers, tasks
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
@@ -32,11 +31,7 @@ class GatewayMixier(X6GateApiMixer):
     @property
     def project(self):
         if self._project is None:
-            self._project = get_object_or_404(
-                apps.get_model('general.project').objects,
-                uuid=self.project_uuid,
-                enabled=True
-            )
+            self._project = resolver.get_project(self.project_uuid)
         return self._project
 
     @property
@@ -100,10 +95,7 @@ class DeviceMixser(GatewayMixier):
     @property
     def gateway(self):
         if self._gateway is None:
-            self._gateway = get_object_or_404(
-                super().queryset,
-                sn=self.gateway_sn,
-            )
+            self._gateway = resolver.get_gateway(self.project, self.gateway_sn)
         return self._gateway
 
     @property
@@ -161,101 +153,119 @@ class DeviceListCreateApiView(DeviceMixser, GenericAPIView):
         return Response({'device': serializer.data})
 
 
-class RTDataCreateApiView(DeviceMixser, GenericAPIView):
+class IngestMixer(DeviceMixser):
+
+    parser_classes = parsers.INGEST_PARSER_CLASSES
+
+    ingest_kind = None
+
+    payload_serializer_class = None
 
     def post(self, request, *args, **kwargs):
         return self.create(request, *args, **kwargs)
 
-    @atomic
     def create(self, request, *args, **kwargs):
-        gateway = self.gateway
-        logdt = request.data.get('logdt')
-        rt_data = gateway.data.create(
-            logdt=logdt,
-            gateway=gateway
+        if settings.MEGEDC_X6GATEAPI_ASYNC_INGEST:
+            action = self.enqueue
+            done_status = status.HTTP_202_ACCEPTED
+        else:
+            action = self.ingest
+            done_status = status.HTTP_200_OK
+        payload = self.get_payload(request)
+        key = ingest.idempotency_key(
+            self.gateway,
+            self.ingest_kind,
+            payload,
+            request.headers.get('Idempotency-Key')
         )
-        for device_data in request.data.get('device', []):
-            device, _ = self.get_queryset().get_or_create(
-                gateway=gateway,
-                id=device_data.get('id'),
-                channel=device_data.get('channel'),
-                defaults={
-                    'name': 'no name'
-                }
+        if key is None:
+            return action(payload)
+        claim = ingest.idempotency_claim(key)
+        if claim == ingest.IDEMPOTENCY_DONE:
+            return Response(None, status=done_status)
+        if claim == ingest.IDEMPOTENCY_PENDING:
+            return Response(
+                {'detail': 'The payload is being stored'},
+                status=status.HTTP_409_CONFLICT
             )
-            for node in device_data.get('node', []):
-                device.nodes.all().create(
-                    dblink=node.get('dblink'),
-                    name=node.get('name'),
-                    value=node.get('value'),
-                    unit=node.get('unit'),
-                    device=device,
-                    data=rt_data,
-                    discard=(not device.ready)
-                )
+        try:
+            response = action(payload)
+        except Exception:
+            ingest.idempotency_release(key)
+            raise
+        ingest.idempotency_done(key)
+        return response
+
+    def get_payload(self, request):
+        serializer = self.payload_serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @atomic
+    def ingest(self, payload):
+        ingest.ingest(self.gateway, self.ingest_kind, payload)
         return Response(None, status=status.HTTP_200_OK)
 
+    @atomic
+    def enqueue(self, payload):
+        gateway = self.gateway
+        ingest.enqueue(gateway, self.ingest_kind, payload)
+        tasks.schedule_ingest_drain(gateway.id)
+        return Response(None, status=status.HTTP_202_ACCEPTED)
 
-# Todo: De esto nno hay pruebas echas
-class RTAlarmCreateApiView(DeviceMixser, GenericAPIView):
 
-    def post(self, request, *args, **kwargs):
-        return self.create(request, *args, **kwargs)
+class RTDataCreateApiView(IngestMixer, GenericAPIView):
 
-    @atomic
-    def create(self, request, *args, **kwargs):
-        gateway = self.gateway
-        for node_data in request.data.get('node', []):
-            device, _ = self.get_queryset().get_or_create(
-                gateway=gateway,
-                id=node_data.get('id'),
-                channel=node_data.get('channel'),
-                defaults={
-                    'name': 'no name'
-                }
-            )
-            device.alarms.all().create(
-                logdt=node_data.get('logdt'),
-                name=node_data.get('name'),
-                value=node_data.get('value'),
-                threadhold_value=node_data.get('threadhold_value'),
-                unit=node_data.get('unit'),
-                type=node_data.get('type'),
-                flag=node_data.get('flag'),
-                device=device
-            )
-        return Response(None, status=status.HTTP_200_OK)
+    ingest_kind = ingest.INGEST_RTDATA
 
+    payload_serializer_class = serializers.RTDataPayloadSerializer
 
-class TrendLogDataCreateApiView(DeviceMixser, GenericAPIView):
 
-    def post(self, request, *args, **kwargs):
-        return self.create(request, *args, **kwargs)
+class RTDataBatchCreateApiView(IngestMixer, GenericAPIView):
 
-    @atomic
-    def create(self, request, *args, **kwargs):
-        for device_data in request.data.get('device', []):
-            gateway = self.gateway
-            device, _ = self.get_queryset().get_or_create(
-                gateway=gateway,
-                id=device_data.get('id'),
-                channel=device_data.get('channel'),
-                defaults={
-                    'name': device_data.get('name', 'no_name')
-                }
+    ingest_kind = ingest.INGEST_RTDATA_BATCH
+
+    payload_serializer_class = serializers.RTDataBatchFramePayloadSerializer
+
+    def get_payload(self, request):
+        frames = request.data
+        if isinstance(frames, dict):
+            frames = frames.get('frames')
+        if not isinstance(frames, list):
+            raise ValidationError({'frames': 'A list of frames is required'})
+        serializer = self.payload_serializer_class(data=frames, many=True)
+        if not serializer.is_valid():
+            raise ValidationError({'frames': serializer.errors})
+        return serializer.validated_data
+
+    def ingest(self, payload):
+        # Each chunk of frames is written in its own transaction
+        try:
+            created, duplicated = ingest.ingest(
+                self.gateway, self.ingest_kind, payload
             )
-            for trendlog in device_data.get('trendlog', []):
-                for node in trendlog.get('data', []):
-                    device.trend_log_data.all().get_or_create(
-                        device=device,
-                        date_time=device.gateway.timezone.localize(
-                            datetime.fromisoformat(node.get('date_time'))
-                        ),
-                        dblink=trendlog.get('dblink'),
-                        defaults={
-                            'name': trendlog.get('name'),
-                            'value': node.get('value'),
-                            'unit': node.get('unit'),
-                        }
-                    )
-        return Response(None, status=status.HTTP_200_OK)
+        except ValueError as exce:
+            raise ValidationError({'frames': str(exce)})
+        return Response(
+            {
+                'frames': len(payload),
+                'created': created,
+                'duplicated': duplicated,
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+# Todo: De esto nno hay pruebas echas
+class RTAlarmCreateApiView(IngestMixer, GenericAPIView):
+
+    ingest_kind = ingest.INGEST_ALARM
+
+    payload_serializer_class = serializers.RTAlarmPayloadSerializer
+
+
+class TrendLogDataCreateApiView(IngestMixer, GenericAPIView):
+
+    ingest_kind = ingest.INGEST_TREND_LOG
+
+    payload_serializer_class = serializers.TrendLogPayloadSerializer